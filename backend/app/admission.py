@@ -0,0 +1,185 @@
+"""准入控制与背压：队列深度、帧积压、临时盘剩余空间（扣除已入队任务的预留）、单客户端并发"""
+import asyncio
+import ipaddress
+import math
+import shutil
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Union
+
+from fastapi import HTTPException, Request
+
+from .config import (
+    ADMISSION_MAX_BACKLOG_FRAMES,
+    ADMISSION_MAX_QUEUED_JOBS,
+    ADMISSION_MIN_FREE_DISK_MB,
+    CLUSTER_FRAMES_PER_SEC,
+    MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT,
+    MAX_ACTIVE_JOBS_PER_CLIENT,
+    MAX_CONCURRENT_MATTE,
+    QUEUE_MAINTENANCE_INTERVAL_SEC,
+    TEMP_DIR,
+    TRUSTED_PROXIES,
+)
+
+# 磁盘不足时无法靠等待恢复，给一个固定的重试间隔
+_DISK_RETRY_AFTER_SEC = 300
+_MATTE_RETRY_AFTER_SEC = 5
+_QUOTA_RETRY_AFTER_SEC = 30
+
+_matte_in_flight = 0
+
+# 队列积压快照：由后台队列维护定期从 Redis 刷新，两次刷新之间本进程的提交累加到快照上，提交路径不再扫描队列
+_backlog: Optional[dict] = None
+_backlog_at = 0.0
+
+
+_trusted_proxies = [ipaddress.ip_network(p, strict=False) for p in TRUSTED_PROXIES]
+
+
+def _parse_ip(addr: str) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    try:
+        return ipaddress.ip_address(addr)
+    except ValueError:
+        return None
+
+
+def _is_trusted_proxy(ip) -> bool:
+    return ip is not None and any(ip in net for net in _trusted_proxies)
+
+
+def request_ip(request: Request) -> str:
+    """
+    来源 IP。直连地址是受信任代理时按 X-Forwarded-For 从右往左跳过受信任代理，
+    第一个不受信任的地址即客户端（更左侧的条目可由客户端伪造，不采信）。
+    """
+    ip = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(_parse_ip(ip)):
+        return ip
+    hops = [h.strip() for h in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if h.strip()]
+    for hop in reversed(hops):
+        addr = _parse_ip(hop)
+        if addr is None:
+            break
+        ip = str(addr)
+        if not _is_trusted_proxy(addr):
+            break
+    return ip
+
+
+def client_id(request: Request) -> str:
+    """
+    客户端标识：来源 IP（见 request_ip）；带 X-Client-Id 时作为子键附在 IP 后（"ip/id"），便于区分同一出口下的调用方。
+    配额按 IP 计（见 client_ip），更换请求头不能绕过。
+    """
+    ip = request_ip(request)
+    cid = request.headers.get("x-client-id")
+    return f"{ip}/{cid[:64]}" if cid else ip
+
+
+def client_ip(client: str) -> str:
+    """client_id 中的 IP 部分"""
+    return client.split("/", 1)[0]
+
+
+def _reject(status: int, code: str, message: str, retry_after: int) -> HTTPException:
+    retry_after = max(1, int(retry_after))
+    return HTTPException(
+        status,
+        {"code": code, "message": message, "estimated_wait_sec": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def _estimated_wait(backlog_frames: int) -> int:
+    return math.ceil(backlog_frames / max(CLUSTER_FRAMES_PER_SEC, 0.1))
+
+
+def refresh_backlog() -> Optional[dict]:
+    """从 Redis 重新统计队列积压（由后台队列维护调用）；无 Redis（同步模式）时为 None，跳过队列类检查"""
+    global _backlog, _backlog_at
+    try:
+        from worker.tasks import get_backlog
+        _backlog = get_backlog()
+    except Exception:
+        _backlog = None
+    _backlog_at = time.monotonic()
+    return _backlog
+
+
+def note_enqueued(jobs: int, frames: int, temp_bytes: int) -> None:
+    """本进程入队后累加到积压快照，下次刷新前的准入检查即可看到"""
+    if _backlog is not None:
+        _backlog["queued_jobs"] += jobs
+        _backlog["backlog_frames"] += frames
+        _backlog["temp_bytes"] += temp_bytes
+
+
+def _backlog_stale() -> bool:
+    # 后台刷新关闭或停滞时（超过两个周期未刷新）在提交路径上同步刷新
+    max_age = 2 * QUEUE_MAINTENANCE_INTERVAL_SEC
+    return not max_age or time.monotonic() - _backlog_at > max_age
+
+
+def check_disk(temp_bytes: int = 0) -> None:
+    """
+    临时盘检查：剩余空间扣除排队 / 执行中任务预留的临时盘（积压快照）与本任务估算用量后，
+    仍须不低于 ADMISSION_MIN_FREE_DISK_MB，否则抛 503。执行中任务已写入的部分会被重复扣除，偏保守。
+    """
+    if not ADMISSION_MIN_FREE_DISK_MB:
+        return
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    reserved = _backlog["temp_bytes"] if _backlog else 0
+    free_mb = (shutil.disk_usage(TEMP_DIR).free - reserved - temp_bytes) / (1024 * 1024)
+    if free_mb < ADMISSION_MIN_FREE_DISK_MB:
+        raise _reject(503, "DISK_FULL", "临时存储空间不足，请稍后重试", _DISK_RETRY_AFTER_SEC)
+
+
+async def check_capacity(jobs: int = 1) -> None:
+    """集群容量检查，超限抛 503；jobs 为本次提交将入队的任务数（批量为条目数）"""
+    if _backlog_stale():
+        await asyncio.to_thread(refresh_backlog)
+    check_disk()
+
+    backlog = _backlog
+    if backlog is None:
+        return
+    wait = _estimated_wait(backlog["backlog_frames"])
+    if ADMISSION_MAX_QUEUED_JOBS and backlog["queued_jobs"] + jobs > ADMISSION_MAX_QUEUED_JOBS:
+        raise _reject(503, "QUEUE_FULL", f"排队任务过多（{backlog['queued_jobs']}），请稍后重试", wait)
+    if ADMISSION_MAX_BACKLOG_FRAMES and backlog["backlog_frames"] >= ADMISSION_MAX_BACKLOG_FRAMES:
+        raise _reject(503, "BACKLOG_FULL", f"待处理帧积压过多（{backlog['backlog_frames']}），请稍后重试", wait)
+
+
+def check_client_quota(active_jobs: int, active_batch_items: int = 0, batch_items: int = 0) -> None:
+    """
+    单客户端并发配额，超限抛 429。批量任务整体计为一个任务，
+    另按条目数计入 MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT（batch_items 为本次提交的条目数）。
+    """
+    if MAX_ACTIVE_JOBS_PER_CLIENT and active_jobs >= MAX_ACTIVE_JOBS_PER_CLIENT:
+        raise _reject(
+            429, "TOO_MANY_JOBS",
+            f"进行中的任务已达上限（{MAX_ACTIVE_JOBS_PER_CLIENT}），请等待完成后再提交",
+            _QUOTA_RETRY_AFTER_SEC,
+        )
+    if (batch_items and MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT
+            and active_batch_items + batch_items > MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT):
+        raise _reject(
+            429, "TOO_MANY_BATCH_ITEMS",
+            f"未完成的批量条目将超过上限（{active_batch_items} + {batch_items} > {MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT}），"
+            "请等待完成后再提交",
+            _QUOTA_RETRY_AFTER_SEC,
+        )
+
+
+@asynccontextmanager
+async def matte_slot():
+    """/matte 在 API 进程内同步推理，限制并发数，超限抛 503"""
+    global _matte_in_flight
+    if MAX_CONCURRENT_MATTE and _matte_in_flight >= MAX_CONCURRENT_MATTE:
+        raise _reject(503, "MATTE_BUSY", "抠图服务繁忙，请稍后重试", _MATTE_RETRY_AFTER_SEC)
+    _matte_in_flight += 1
+    try:
+        yield
+    finally:
+        _matte_in_flight -= 1
@@ -14,6 +14,45 @@ MAX_VIDEO_DURATION_SEC = int(os.getenv("MAX_VIDEO_DURATION_SEC", "300"))
 MAX_FRAMES = int(os.getenv("MAX_FRAMES", "2000"))
 MAX_SHEET_EDGE = int(os.getenv("MAX_SHEET_EDGE", "16384"))
 
+# 结果下载缓存（结果不可变，CDN 可长期缓存）
+RESULT_CACHE_MAX_AGE = int(os.getenv("RESULT_CACHE_MAX_AGE", "86400"))
+
+# 单帧随机访问：API 进程内解码图 LRU 缓存上限，及一次区间请求最多帧数
+FRAME_CACHE_MB = int(os.getenv("FRAME_CACHE_MB", "256"))
+MAX_FRAMES_PER_RANGE = int(os.getenv("MAX_FRAMES_PER_RANGE", "256"))
+
+# 准入控制（0 表示不限制）：超出集群容量返回 503，超出单客户端并发返回 429
+ADMISSION_MAX_QUEUED_JOBS = int(os.getenv("ADMISSION_MAX_QUEUED_JOBS", "200"))
+ADMISSION_MAX_BACKLOG_FRAMES = int(os.getenv("ADMISSION_MAX_BACKLOG_FRAMES", "100000"))
+ADMISSION_MIN_FREE_DISK_MB = int(os.getenv("ADMISSION_MIN_FREE_DISK_MB", "2048"))
+MAX_ACTIVE_JOBS_PER_CLIENT = int(os.getenv("MAX_ACTIVE_JOBS_PER_CLIENT", "4"))
+# 受信任的反向代理 / CDN 地址（逗号分隔，IP 或 CIDR）：来自这些地址的请求按 X-Forwarded-For 识别客户端 IP
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+MAX_CONCURRENT_MATTE = int(os.getenv("MAX_CONCURRENT_MATTE", "4"))
+# 队列维护（large 队列老化提升）的执行间隔，0 关闭
+QUEUE_MAINTENANCE_INTERVAL_SEC = int(os.getenv("QUEUE_MAINTENANCE_INTERVAL_SEC", "30"))
+# 集群整体处理吞吐（帧/秒），用于估算等待时间与 Retry-After
+CLUSTER_FRAMES_PER_SEC = float(os.getenv("CLUSTER_FRAMES_PER_SEC", "10"))
+
+# 存储生命周期（0 表示不限制 / 关闭）：各类目录的保留时长，输出目录总配额（超出按最近访问 LRU 淘汰）
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS", "24"))
+OUTPUT_TTL_HOURS = float(os.getenv("OUTPUT_TTL_HOURS", "168"))
+TEMP_TTL_HOURS = float(os.getenv("TEMP_TTL_HOURS", "6"))
+OUTPUT_QUOTA_MB = int(os.getenv("OUTPUT_QUOTA_MB", "0"))
+# 输出所在卷的剩余空间低于卷容量的该百分比（且不低于 ADMISSION_MIN_FREE_DISK_MB）时，同样按 LRU 淘汰输出
+OUTPUT_MIN_FREE_PERCENT = float(os.getenv("OUTPUT_MIN_FREE_PERCENT", "10"))
+STORAGE_GC_INTERVAL_SEC = int(os.getenv("STORAGE_GC_INTERVAL_SEC", "300"))
+
+# 批量提交：单批最多条目数；允许提交服务器目录时的根目录（为空则只接受上传）
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "500"))
+# 批量提交时 API 并行探测条目的数量
+BATCH_PROBE_CONCURRENCY = int(os.getenv("BATCH_PROBE_CONCURRENCY", "8"))
+# 单客户端（来源 IP）未完成的批量条目总数上限，0 不限制；批量任务在 MAX_ACTIVE_JOBS_PER_CLIENT 中只计一个
+MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT = int(os.getenv("MAX_ACTIVE_BATCH_ITEMS_PER_CLIENT", str(MAX_BATCH_ITEMS)))
+BATCH_SOURCE_ROOT = os.getenv("BATCH_SOURCE_ROOT", "")
+
+# URL 取源的主机校验（URL_ALLOWED_HOSTS 等）在 worker/ingest.py，API 与 worker 共用
+
 # Redis
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
@@ -0,0 +1,146 @@
+"""
+序列帧随机访问：按字节数限额的 LRU 缓存（帧索引、解码后的整图、编码后的单帧）。
+大图由 worker 另存逐帧 PNG（frames/{i}.png），直接读文件，不解码整图；
+同一序列帧图的未命中按键加锁，并发请求只解码一次。
+"""
+import io
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from .config import FRAME_CACHE_MB
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class LRUByteCache:
+    """线程安全的 LRU，按条目字节数之和淘汰"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[Any, tuple[Any, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, nbytes: int) -> None:
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (value, nbytes)
+            self._size += nbytes
+            while self._size > self.max_bytes and self._items:
+                _, (_, n) = self._items.popitem(last=False)
+                self._size -= n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+_cache = LRUByteCache(FRAME_CACHE_MB * 1024 * 1024)
+
+# worker 为大图写出的逐帧 PNG 目录（见 worker/processor.py 的 FRAME_FILES_DIR）
+FRAME_FILES_DIR = "frames"
+
+# 按键分段的锁：同一序列帧图的未命中串行处理，后到的请求等待后直接命中缓存
+_key_locks = [threading.Lock() for _ in range(64)]
+
+
+def _lock_for(key) -> threading.Lock:
+    return _key_locks[hash(key) % len(_key_locks)]
+
+
+def _load_index(index_path: Path) -> list[dict]:
+    """读取并缓存帧索引；以 mtime 作为缓存键的一部分，结果被替换即失效"""
+    st = index_path.stat()
+    key = ("index", str(index_path), st.st_mtime_ns)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    with open(index_path, "r", encoding="utf-8") as f:
+        frames = json.load(f).get("frames", [])
+    _cache.put(key, frames, st.st_size)
+    return frames
+
+
+def _load_sheet(sprite_path: Path) -> "Image.Image":
+    """解码整图；放得进缓存时缓存（没有逐帧文件的大图每次调用解码一次，调用方应一次裁出所需的全部帧）"""
+    key = ("sheet", str(sprite_path), sprite_path.stat().st_mtime_ns)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    from PIL import Image  # 仅帧接口用到，不拖慢 API 启动
+
+    sheet = Image.open(sprite_path).convert("RGBA")
+    sheet.load()
+    _cache.put(key, sheet, sheet.width * sheet.height * 4)
+    return sheet
+
+
+def frame_count(sprite_path: Path, index_path: Path) -> int:
+    """帧总数（只读索引，不解码整图）"""
+    return len(_load_index(index_path))
+
+
+def get_frame_pngs(sprite_path: Path, index_path: Path, start: int, end: int) -> list[bytes]:
+    """
+    [start, end) 各帧的 PNG（越界部分截掉）。单帧 PNG 逐个缓存；
+    有未命中时优先读 worker 写出的逐帧文件，否则整图只解码一次，从中裁出所有缺失的帧。
+    """
+    frames = _load_index(index_path)
+    start, end = max(0, start), min(end, len(frames))
+    mtime = sprite_path.stat().st_mtime_ns
+    keys = [("frame", str(sprite_path), mtime, i) for i in range(start, end)]
+    out = [_cache.get(key) for key in keys]
+    if all(data is not None for data in out):
+        return out
+
+    with _lock_for(("sheet", str(sprite_path), mtime)):
+        # 等锁期间其他请求可能已填好缓存
+        for k, data in enumerate(out):
+            if data is None:
+                out[k] = _cache.get(keys[k])
+        missing = [k for k, data in enumerate(out) if data is None]
+        frames_dir = sprite_path.parent / FRAME_FILES_DIR
+        sheet = None
+        for k in missing:
+            frame_file = frames_dir / f"{start + k}.png"
+            if frame_file.is_file():
+                out[k] = frame_file.read_bytes()
+            else:
+                if sheet is None:
+                    sheet = _load_sheet(sprite_path)
+                fr = frames[start + k]
+                crop = sheet.crop((fr["x"], fr["y"], fr["x"] + fr["w"], fr["y"] + fr["h"]))
+                buf = io.BytesIO()
+                crop.save(buf, "PNG", compress_level=1)
+                out[k] = buf.getvalue()
+            _cache.put(keys[k], out[k], len(out[k]))
+    return out
+
+
+def get_frame_png(sprite_path: Path, index_path: Path, i: int) -> Optional[bytes]:
+    """裁出第 i 帧并编码为 PNG；越界返回 None"""
+    if i < 0:
+        return None
+    pngs = get_frame_pngs(sprite_path, index_path, i, i + 1)
+    return pngs[0] if pngs else None
+
+
+def cache_stats() -> dict:
+    """缓存占用"""
+    return _cache.stats()
@@ -1,44 +1,92 @@
 """FastAPI 主应用"""
 import asyncio
+import json
 import os
+import subprocess
 import sys
 import threading
 from pathlib import Path
+from typing import Optional
 
 # 确保项目根目录在 path 中
 ROOT = Path(__file__).resolve().parent.parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 
 from .config import (
     ALLOWED_VIDEO_EXTENSIONS,
+    BATCH_PROBE_CONCURRENCY,
+    BATCH_SOURCE_ROOT,
+    MAX_BATCH_ITEMS,
+    MAX_FRAMES,
+    MAX_FRAMES_PER_RANGE,
     MAX_UPLOAD_SIZE_MB,
+    MAX_VIDEO_DURATION_SEC,
     OUTPUT_DIR,
+    QUEUE_MAINTENANCE_INTERVAL_SEC,
+    STORAGE_GC_INTERVAL_SEC,
     TEMP_DIR,
     UPLOAD_DIR,
 )
 
 ALLOWED_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
 MAX_IMAGE_MB = 20
+# 上传文件分块写盘的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 # Worker 与 API 共享存储路径
-from .models import JobParams, JobResponse
+from .models import JobParams, JobResponse, WatermarkParams
+from .admission import (
+    check_capacity,
+    check_client_quota,
+    check_disk,
+    client_id,
+    client_ip,
+    matte_slot,
+    note_enqueued,
+    refresh_backlog,
+)
+from .frame_cache import cache_stats, frame_count, get_frame_png, get_frame_pngs
+from .responses import cache_headers, cached_file_response, etag_matches, file_etag
 from .storage import (
+    PROFILE_FILENAMES,
+    SPRITE_MIME_TYPES,
+    collect_garbage,
+    delete_upload,
     ensure_dirs,
     generate_job_id,
+    get_preview_paths,
+    get_profile_path,
     get_result_paths,
+    get_result_zip_path,
     get_video_path,
     get_watermark_output_path,
+    iter_results_zip,
     save_uploaded_file,
+    storage_usage,
+    touch_output,
 )
 
 # 任务状态存储（生产环境应使用 Redis）
 _jobs: dict[str, dict] = {}
 _watermark_jobs: dict[str, dict] = {}
+_batches: dict[str, dict] = {}
+
+
+_RQ_STATUS_MAP = {
+    "queued": "queued", "started": "processing", "finished": "completed", "failed": "failed",
+    "deferred": "queued", "scheduled": "queued", "canceled": "canceled", "stopped": "canceled",
+}
+_FAILURE_CODES = {"failed": "PROCESSING_ERROR", "canceled": "CANCELED"}
+
+
+def _failure_status(exc_info: str) -> str:
+    """RQ 失败信息中若为 JobCanceled，视为已取消"""
+    return "canceled" if "JobCanceled" in exc_info else "failed"
 
 
 def _update_job(job_id: str, **kwargs):
@@ -47,17 +95,28 @@ def _update_job(job_id: str, **kwargs):
         _jobs[job_id].update(kwargs)
 
 
-def _run_pipeline_sync(job_id: str, video_path: str):
+def _run_pipeline_sync(job_id: str, video_path: str, video_info: Optional[dict] = None):
     """同步模式：在后台线程中执行管线（Windows 无 Redis 时使用）"""
     try:
         from worker.processor import run_pipeline
-        result = run_pipeline(job_id, video_path, str(OUTPUT_DIR), str(TEMP_DIR), _jobs[job_id]["params"])
-        _update_job(job_id, status="completed", progress=100, result=result)
+        result = run_pipeline(job_id, video_path, str(OUTPUT_DIR), str(TEMP_DIR), _jobs[job_id]["params"], video_info)
+        if _jobs.get(job_id, {}).get("status") != "canceled":
+            _update_job(job_id, status="completed", progress=100, result=result)
     except Exception as e:
-        _update_job(job_id, status="failed", error={"code": "PROCESSING_ERROR", "message": str(e)})
-
-
-def _run_watermark_sync(job_id: str, video_path: str):
+        if _jobs.get(job_id, {}).get("status") != "canceled":
+            _update_job(job_id, status="failed", error={"code": "PROCESSING_ERROR", "message": str(e)})
+    finally:
+        from worker.cancellation import clear_cancel
+        clear_cancel(job_id)
+
+
+def _run_watermark_sync(
+    job_id: str,
+    video_path: str,
+    region: Optional[dict] = None,
+    preset: Optional[str] = None,
+    profile: bool = False
+):
     """同步模式：在后台线程中执行水印去除"""
     def _update_wm(jid: str, **kwargs):
         if jid in _watermark_jobs:
@@ -65,10 +124,15 @@ def _run_watermark_sync(job_id: str, video_path: str):
 
     try:
         from worker.watermark_remover import run_watermark_pipeline
-        result = run_watermark_pipeline(job_id, video_path, str(OUTPUT_DIR))
-        _update_wm(job_id, status="completed", progress=100, result=result)
+        result = run_watermark_pipeline(job_id, video_path, str(OUTPUT_DIR), str(TEMP_DIR), region, preset, profile)
+        if _watermark_jobs.get(job_id, {}).get("status") != "canceled":
+            _update_wm(job_id, status="completed", progress=100, result=result)
     except Exception as e:
-        _update_wm(job_id, status="failed", error={"code": "PROCESSING_ERROR", "message": str(e)})
+        if _watermark_jobs.get(job_id, {}).get("status") != "canceled":
+            _update_wm(job_id, status="failed", error={"code": "PROCESSING_ERROR", "message": str(e)})
+    finally:
+        from worker.cancellation import clear_cancel
+        clear_cancel(job_id)
 
 app = FastAPI(
     title="PixelWork - 视频转序列帧",
@@ -85,7 +149,7 @@ app.add_middleware(
 )
 
 
-def _init_job(job_id: str, params: JobParams, rq_job_id: str = ""):
+def _init_job(job_id: str, params: JobParams, rq_job_id: str = "", client: str = ""):
     """初始化任务记录"""
     _jobs[job_id] = {
         "id": job_id,
@@ -93,23 +157,218 @@ def _init_job(job_id: str, params: JobParams, rq_job_id: str = ""):
         "progress": 0,
         "params": params.model_dump(),
         "rq_job_id": rq_job_id,
+        "client": client,
         "result": None,
         "error": None,
     }
 
 
+def _sync_rq_statuses(jobs: list[dict]) -> None:
+    """一次往返批量同步任务的 RQ 状态（内存状态可能滞后）；无 Redis 时保持原状态"""
+    rq_pending = [job for job in jobs if job.get("rq_job_id")]
+    if not rq_pending:
+        return
+    try:
+        from worker.tasks import get_job_statuses
+        statuses = get_job_statuses([job["rq_job_id"] for job in rq_pending])
+    except Exception:
+        return
+    for job, rq_status in zip(rq_pending, statuses):
+        if not rq_status:
+            continue
+        status = _RQ_STATUS_MAP.get(rq_status["status"], job["status"])
+        if rq_status.get("exc_info"):
+            status = _failure_status(rq_status["exc_info"])
+            job["error"] = {"code": _FAILURE_CODES[status], "message": rq_status["exc_info"]}
+        if status == "completed":
+            job.update(progress=100, result=rq_status.get("result"))
+        job["status"] = status
+
+
+def _count_active_jobs(client: str) -> tuple[int, int]:
+    """
+    统计同一来源 IP 进行中的任务数（批量任务整体计为一个）与未完成的批量条目数；
+    仍在排队 / 处理的任务一次往返向 RQ 核实。
+    """
+    ip = client_ip(client)
+    pending = [
+        job for job in list(_jobs.values()) + list(_watermark_jobs.values())
+        if client_ip(job.get("client") or "") == ip and job["status"] in ("queued", "processing")
+    ]
+    _sync_rq_statuses(pending)
+    pending = [job for job in pending if job["status"] in ("queued", "processing")]
+    active = {job.get("batch_id") or job["id"] for job in pending}
+    return len(active), sum(1 for job in pending if job.get("batch_id"))
+
+
+async def _admit(request: Request, batch_items: int = 0) -> str:
+    """提交前的准入检查，返回客户端标识；batch_items 为批量提交的条目数（单个任务为 0）"""
+    client = client_id(request)
+    active, active_batch_items = await asyncio.to_thread(_count_active_jobs, client)
+    check_client_quota(active, active_batch_items, batch_items)
+    await check_capacity(max(1, batch_items))
+    return client
+
+
+async def _validate_source_url(url: str):
+    """
+    URL 取源：仅 http(s)，主机须解析为公网地址（URL_ALLOWED_HOSTS 内的主机除外）。
+    worker 拉取时对每一跳重定向再次校验。
+    """
+    from worker.ingest import check_url
+    try:
+        await asyncio.to_thread(check_url, url)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def _save_upload(job_id: str, filename: str, upload: UploadFile) -> tuple[Path, str]:
+    """把上传文件分块写入上传目录，同时计算内容摘要（探测缓存的键）；返回 (路径, 摘要)"""
+    from worker.probe import content_hasher
+    hasher = content_hasher()
+
+    def chunks():
+        upload.file.seek(0)
+        while chunk := upload.file.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+            yield chunk
+
+    path = save_uploaded_file(job_id, filename, chunks())
+    return path, hasher.hexdigest()
+
+
+def _probe_upload(video_path: Path, digest: Optional[str]) -> Optional[dict]:
+    """
+    上传时探测一次（按内容摘要缓存；digest 为 None 时为服务器上的文件，直接探测）。
+    本机无 ffprobe 时返回 None，交由 worker 探测。
+    """
+    from worker.probe import probe_video
+    try:
+        return probe_video(video_path, digest)
+    except (subprocess.CalledProcessError, ValueError):
+        raise HTTPException(400, "无法解析视频文件")
+    except OSError:
+        return None
+
+
+async def _inspect_upload(job_id: str, video_path: Path, digest: Optional[str], params: Optional[JobParams]) -> Optional[dict]:
+    """
+    探测上传的视频并检查时长与帧数上限，不合格时删除上传文件并返回 400，不占用队列；
+    临时盘扣除已有预留后放不下本任务的估算用量时返回 503。
+    params 为 None 表示水印任务（处理全部源帧，只检查时长）。返回探测结果，随任务传给 worker。
+    """
+    try:
+        info = await asyncio.to_thread(_probe_upload, video_path, digest)
+        if info is None:
+            return None
+        if not info["width"] or not info["height"]:
+            raise HTTPException(400, "未找到视频流")
+        duration = info["duration"]
+        if MAX_VIDEO_DURATION_SEC and duration > MAX_VIDEO_DURATION_SEC:
+            raise HTTPException(400, f"视频过长（{duration:.1f}s），限制 {MAX_VIDEO_DURATION_SEC}s")
+        if params is not None and duration and params.frame_range.start_sec >= duration:
+            raise HTTPException(400, f"起始时间超出视频时长（{duration:.1f}s）")
+        from worker.tasks import estimate_job
+        estimate = estimate_job(str(video_path), params.model_dump() if params else None, info)
+        if params is not None and MAX_FRAMES and estimate["frames"] > MAX_FRAMES:
+            raise HTTPException(400, f"待处理帧数 {estimate['frames']} 超过上限 {MAX_FRAMES}")
+        # 按本任务的临时盘估算预留空间，不足时 503
+        check_disk(estimate["temp_bytes"])
+        return info
+    except HTTPException:
+        delete_upload(job_id)
+        raise
+
+
+_last_gc: dict = {}
+
+
+def _run_storage_gc() -> dict:
+    """
+    一轮存储回收；结果已被淘汰的已完成任务标记为 expired。
+    进行中的任务以 RQ 为准（排队、执行中、等待重试，含其他 API 副本提交的），并上本进程内的同步模式任务；
+    无 Redis（同步模式）时只有后者。
+    """
+    active = {
+        jid for jobs in (_jobs, _watermark_jobs) for jid, job in list(jobs.items())
+        if job["status"] in ("queued", "processing")
+    }
+    try:
+        from worker.tasks import active_job_ids
+        active |= active_job_ids()
+    except Exception:
+        pass
+    report = collect_garbage(active)
+    for jid in report["expired_outputs"]:
+        for jobs in (_jobs, _watermark_jobs):
+            job = jobs.get(jid)
+            if job and job["status"] == "completed":
+                job["status"] = "expired"
+    return report
+
+
+async def _storage_gc_loop():
+    """后台定期回收存储；单轮失败不影响下一轮"""
+    import time
+    while True:
+        try:
+            report = await asyncio.to_thread(_run_storage_gc)
+            _last_gc.clear()
+            _last_gc.update(report, finished_at=time.time())
+        except Exception as e:
+            _last_gc["error"] = str(e)
+        await asyncio.sleep(STORAGE_GC_INTERVAL_SEC)
+
+
+def _maintain_queues() -> None:
+    from worker.tasks import promote_aged_jobs
+    refresh_backlog()
+    promote_aged_jobs()
+
+
+async def _queue_maintenance_loop():
+    """
+    后台定期维护队列：刷新准入用的积压快照；large 队列中等待过久的任务提升到 small 队列，不依赖有新任务提交。
+    无 Redis 时跳过。
+    """
+    while True:
+        try:
+            await asyncio.to_thread(_maintain_queues)
+        except Exception:
+            pass
+        await asyncio.sleep(QUEUE_MAINTENANCE_INTERVAL_SEC)
+
+
 @app.on_event("startup")
 async def startup():
     ensure_dirs()
+    if STORAGE_GC_INTERVAL_SEC > 0:
+        app.state.storage_gc = asyncio.create_task(_storage_gc_loop())
+    if QUEUE_MAINTENANCE_INTERVAL_SEC > 0:
+        app.state.queue_maintenance = asyncio.create_task(_queue_maintenance_loop())
+
+
+@app.get("/storage/usage")
+async def get_storage_usage():
+    """存储占用、最近一轮回收结果与帧缓存占用"""
+    return {
+        "usage": await asyncio.to_thread(storage_usage),
+        "last_gc": {k: v for k, v in _last_gc.items() if k != "expired_outputs"},
+        "frame_cache": cache_stats(),
+    }
 
 
 @app.post("/jobs", response_model=dict)
 async def create_job(
+    request: Request,
     file: UploadFile = File(None),
+    url: Optional[str] = Form(None),
     params: str = Form(default="{}"),
 ):
     """
-    创建任务。上传视频文件或提供 URL（URL 可选实现）。
+    创建任务。上传视频文件，或提供 http(s) URL 由 worker 直接拉取（不经 API 中转）。
+    超出容量返回 503、超出客户端并发配额返回 429，均带 Retry-After。
+    上传的视频在入队前探测，无法解析或超出时长 / 帧数上限时返回 400。
     """
     job_id = generate_job_id()
 
@@ -118,42 +377,276 @@ async def create_job(
     except Exception as e:
         raise HTTPException(400, f"参数解析失败: {e}")
 
-    if not file:
-        raise HTTPException(400, "请上传视频文件")
+    if url and not file:
+        await _validate_source_url(url)
+        client = await _admit(request)
+        video_path = url
+        video_info = None
+    else:
+        if not file:
+            raise HTTPException(400, "请上传视频文件或提供 URL")
 
-    ext = Path(file.filename or "").suffix.lower()
-    if ext not in ALLOWED_VIDEO_EXTENSIONS:
-        raise HTTPException(400, f"不支持的格式，仅支持: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}")
+        ext = Path(file.filename or "").suffix.lower()
+        if ext not in ALLOWED_VIDEO_EXTENSIONS:
+            raise HTTPException(400, f"不支持的格式，仅支持: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}")
 
-    content = await file.read()
-    if len(content) > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
-        raise HTTPException(400, f"文件过大，限制 {MAX_UPLOAD_SIZE_MB}MB")
+        if (file.size or 0) > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+            raise HTTPException(400, f"文件过大，限制 {MAX_UPLOAD_SIZE_MB}MB")
 
-    save_uploaded_file(job_id, file.filename or "video.mp4", content)
-    video_path = get_video_path(job_id)
-    if not video_path:
-        raise HTTPException(500, "保存视频失败")
+        client = await _admit(request)
+        _, digest = await asyncio.to_thread(_save_upload, job_id, file.filename or "video.mp4", file)
+        video_path = get_video_path(job_id)
+        if not video_path:
+            raise HTTPException(500, "保存视频失败")
+        video_info = await _inspect_upload(job_id, video_path, digest, params_obj)
 
-    _init_job(job_id, params_obj)
+    _init_job(job_id, params_obj, client=client)
 
     try:
         from worker.tasks import enqueue_job
-        rq_id = enqueue_job(
+        queued = enqueue_job(
             job_id,
             str(video_path),
             str(OUTPUT_DIR),
             str(TEMP_DIR),
             params_obj.model_dump(),
+            video_info,
         )
-        _update_job(job_id, rq_job_id=rq_id)
+        _update_job(job_id, rq_job_id=queued["rq_job_id"], queue=queued["queue"], estimated_cost=queued["estimated_cost"])
+        note_enqueued(1, queued["estimated_frames"] or 0, queued["estimated_temp_bytes"] or 0)
     except Exception as e:
         # Windows 无 Redis 或 RQ 不支持时，使用同步模式在后台线程执行
         _update_job(job_id, status="processing", rq_job_id="")
-        thread = threading.Thread(target=_run_pipeline_sync, args=(job_id, str(video_path)))
+        thread = threading.Thread(target=_run_pipeline_sync, args=(job_id, str(video_path), video_info))
+        thread.daemon = True
+        thread.start()
+        return {"job_id": job_id}
+
+    return {
+        "job_id": job_id,
+        "queue": queued["queue"],
+        "estimated_cost": queued["estimated_cost"],
+        "queue_position": queued["queue_position"],
+    }
+
+
+def _batch_sources(files: Optional[list[UploadFile]], source_dir: Optional[str]) -> list[tuple[str, Optional[UploadFile], Optional[Path]]]:
+    """整理批量条目：(文件名, 上传文件, 服务器路径)；服务器目录须位于 BATCH_SOURCE_ROOT 内"""
+    if files and source_dir:
+        raise HTTPException(400, "files 与 source_dir 只能二选一")
+    if files:
+        items = [(f.filename or "video.mp4", f, None) for f in files]
+    elif source_dir:
+        if not BATCH_SOURCE_ROOT:
+            raise HTTPException(400, "未启用服务器目录提交（BATCH_SOURCE_ROOT）")
+        root = Path(BATCH_SOURCE_ROOT).resolve()
+        directory = (root / source_dir).resolve()
+        if not directory.is_relative_to(root) or not directory.is_dir():
+            raise HTTPException(400, "source_dir 不存在或不在允许的目录内")
+        items = [
+            (p.name, None, p) for p in sorted(directory.iterdir())
+            if p.is_file() and p.suffix.lower() in ALLOWED_VIDEO_EXTENSIONS
+        ]
+    else:
+        raise HTTPException(400, "请上传视频文件或提供 source_dir")
+
+    if not items:
+        raise HTTPException(400, "没有可处理的视频")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(400, f"单批最多 {MAX_BATCH_ITEMS} 个视频")
+    for name, upload, _ in items:
+        if Path(name).suffix.lower() not in ALLOWED_VIDEO_EXTENSIONS:
+            raise HTTPException(400, f"{name}: 不支持的格式，仅支持: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}")
+        if upload is not None and (upload.size or 0) > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+            raise HTTPException(400, f"{name}: 文件过大，限制 {MAX_UPLOAD_SIZE_MB}MB")
+    return items
+
+
+def _run_batch_sync(job_ids: list[str]):
+    """同步模式：单个后台线程依次执行批量条目"""
+    from worker.cancellation import clear_cancel
+    for job_id in job_ids:
+        job = _jobs.get(job_id)
+        if not job or job["status"] != "queued":
+            clear_cancel(job_id)
+            continue
+        _update_job(job_id, status="processing")
+        _run_pipeline_sync(job_id, job["video_path"], job.get("video_info"))
+
+
+def _update_progress(job: dict) -> None:
+    """处理中的序列帧任务按 worker 的检查点（TEMP_DIR/<job_id>/manifest.json）刷新进度"""
+    if job["status"] != "processing":
+        return
+    from worker.checkpoint import manifest_progress
+    progress = manifest_progress(TEMP_DIR / job["id"])
+    if progress is not None:
+        job["progress"] = max(job.get("progress", 0), progress)
+
+
+def _refresh_batch(batch: dict) -> bool:
+    """一次往返批量同步条目的 RQ 状态并刷新处理中条目的进度；返回是否仍有进行中的条目"""
+    pending = [
+        _jobs[jid] for jid in batch["job_ids"]
+        if jid in _jobs and _jobs[jid]["status"] in ("queued", "processing")
+    ]
+    _sync_rq_statuses(pending)
+    for job in pending:
+        _update_progress(job)
+    return any(_jobs[jid]["status"] in ("queued", "processing") for jid in batch["job_ids"] if jid in _jobs)
+
+
+@app.post("/batches", response_model=dict)
+async def create_batch(
+    request: Request,
+    files: Optional[list[UploadFile]] = File(None),
+    source_dir: Optional[str] = Form(None),
+    params: str = Form(default="{}"),
+):
+    """
+    批量创建任务：上传多个视频，或提供 BATCH_SOURCE_ROOT 下的服务器目录，所有条目共用一组参数。
+    整批只做一次准入检查（按条目数计入队列容量与批量条目配额），条目逐个探测并检查上限，
+    探测结果随任务传给 worker，整批在一个 Redis pipeline 中入队。
+    轮询 GET /batches/{id} 获取汇总状态，完成后 GET /batches/{id}/result 下载全部结果 ZIP。
+    """
+    try:
+        params_obj = JobParams.model_validate_json(params)
+    except Exception as e:
+        raise HTTPException(400, f"参数解析失败: {e}")
+
+    items = _batch_sources(files, source_dir)
+    client = await _admit(request, batch_items=len(items))
+    batch_id = generate_job_id()
+
+    # 逐条保存并探测，时长 / 帧数超限或无法解析的条目使整批返回 400（与单个提交一致，不占用队列）；
+    # 上传逐条分块写盘并计算摘要，只保留 (文件名, 路径, 摘要)，不把整批内容同时留在内存
+    job_ids, sources = [], []
+    for name, upload, source in items:
+        job_id = generate_job_id()
+        digest = None
+        if upload is not None:
+            source, digest = await asyncio.to_thread(_save_upload, job_id, name, upload)
+            await upload.close()
+        job_ids.append(job_id)
+        sources.append((name, source, digest))
+    probe_slots = asyncio.Semaphore(BATCH_PROBE_CONCURRENCY)
+
+    async def inspect(job_id: str, name: str, source: Path, digest: Optional[str]) -> Optional[dict]:
+        async with probe_slots:
+            try:
+                return await _inspect_upload(job_id, source, digest, params_obj)
+            except HTTPException as e:
+                detail = f"{name}: {e.detail}" if isinstance(e.detail, str) else e.detail
+                raise HTTPException(e.status_code, detail, headers=e.headers)
+
+    results = await asyncio.gather(
+        *(inspect(jid, name, source, digest) for jid, (name, source, digest) in zip(job_ids, sources)),
+        return_exceptions=True,
+    )
+    error = next((r for r in results if isinstance(r, BaseException)), None)
+    if error is None:
+        from worker.tasks import estimate_job
+        # 各条目已分别核对临时盘，这里再按整批的合计用量核对一次
+        estimates = [estimate_job(str(source), params_obj.model_dump(), info) if info else None
+                     for (_, source, _), info in zip(sources, results)]
+        try:
+            check_disk(sum(e["temp_bytes"] for e in estimates if e))
+        except HTTPException as e:
+            error = e
+    if error is not None:
+        for job_id in job_ids:
+            delete_upload(job_id)
+        raise error
+
+    for job_id, (name, source, _), info in zip(job_ids, sources, results):
+        _init_job(job_id, params_obj, client=client)
+        _jobs[job_id].update(batch_id=batch_id, filename=name, video_path=str(source), video_info=info)
+
+    _batches[batch_id] = {"id": batch_id, "client": client, "job_ids": job_ids}
+
+    try:
+        from worker.tasks import enqueue_batch
+        queued = await asyncio.to_thread(
+            enqueue_batch,
+            [(jid, _jobs[jid]["video_path"]) for jid in job_ids],
+            str(OUTPUT_DIR),
+            str(TEMP_DIR),
+            params_obj.model_dump(),
+            [_jobs[jid]["video_info"] for jid in job_ids],
+        )
+        for job_id, entry in zip(job_ids, queued):
+            _update_job(job_id, **entry)
+        note_enqueued(
+            len(queued),
+            sum(entry["estimated_frames"] or 0 for entry in queued),
+            sum(entry["estimated_temp_bytes"] or 0 for entry in queued),
+        )
+    except Exception:
+        thread = threading.Thread(target=_run_batch_sync, args=(job_ids,))
         thread.daemon = True
         thread.start()
 
-    return {"job_id": job_id}
+    return {"batch_id": batch_id, "job_ids": job_ids, "total": len(job_ids)}
+
+
+@app.get("/batches/{batch_id}", response_model=dict)
+async def get_batch(batch_id: str):
+    """批量任务汇总状态：各状态条目数、整体进度与条目列表"""
+    batch = _batches.get(batch_id)
+    if not batch:
+        raise HTTPException(404, "批量任务不存在")
+
+    active = await asyncio.to_thread(_refresh_batch, batch)
+    jobs = [_jobs[jid] for jid in batch["job_ids"] if jid in _jobs]
+    counts: dict[str, int] = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    if active:
+        status = "queued" if counts.get("queued") == len(jobs) else "processing"
+    elif counts.get("completed") == len(jobs):
+        status = "completed"
+    else:
+        status = "partial" if counts.get("completed") else "failed"
+
+    return {
+        "id": batch_id,
+        "status": status,
+        "total": len(jobs),
+        "counts": counts,
+        "progress": round(sum(job.get("progress", 0) for job in jobs) / len(jobs)) if jobs else 0,
+        "items": [
+            {
+                "job_id": job["id"], "filename": job.get("filename"), "status": job["status"],
+                "progress": job.get("progress", 0), "error": job.get("error"),
+            }
+            for job in jobs
+        ],
+    }
+
+
+@app.get("/batches/{batch_id}/result")
+async def get_batch_result(batch_id: str):
+    """流式下载整批结果 ZIP：每个已完成条目一个目录（sprite + index.json）"""
+    batch = _batches.get(batch_id)
+    if not batch:
+        raise HTTPException(404, "批量任务不存在")
+    if await asyncio.to_thread(_refresh_batch, batch):
+        raise HTTPException(400, "批量任务未完成")
+
+    entries = [
+        (f"{k:04d}_{Path(_jobs[jid].get('filename') or jid).stem}", jid)
+        for k, jid in enumerate(batch["job_ids"])
+        if jid in _jobs and _jobs[jid]["status"] == "completed"
+    ]
+    if not entries:
+        raise HTTPException(404, "没有已完成的结果")
+    for _, jid in entries:
+        touch_output(jid)
+    return StreamingResponse(
+        iter_results_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="batch_{batch_id}.zip"'},
+    )
 
 
 @app.get("/jobs/{job_id}", response_model=dict)
@@ -170,6 +663,9 @@ async def get_job(job_id: str):
         "params": job.get("params"),
         "error": job.get("error"),
         "result": job.get("result"),
+        "queue": job.get("queue"),
+        "estimated_cost": job.get("estimated_cost"),
+        "queue_position": None,
     }
 
     # 若内存状态为 queued/processing，尝试从 RQ 拉取最新状态
@@ -177,27 +673,34 @@ async def get_job(job_id: str):
         try:
             from worker.tasks import get_job_status
             rq_status = get_job_status(job["rq_job_id"])
-            status_map = {"queued": "queued", "started": "processing", "finished": "completed", "failed": "failed", "deferred": "queued"}
+            status_map = _RQ_STATUS_MAP
             resp["status"] = status_map.get(rq_status["status"], job["status"])
+            resp["queue"] = rq_status.get("queue") or resp["queue"]
+            resp["queue_position"] = rq_status.get("queue_position")
             if rq_status.get("result"):
                 resp["result"] = rq_status["result"]
                 resp["progress"] = 100
                 _update_job(job_id, status="completed", progress=100, result=rq_status["result"])
             if rq_status.get("exc_info"):
-                resp["error"] = {"code": "PROCESSING_ERROR", "message": rq_status["exc_info"]}
-                resp["status"] = "failed"
-                _update_job(job_id, status="failed", error=resp["error"])
+                resp["status"] = _failure_status(rq_status["exc_info"])
+                resp["error"] = {"code": _FAILURE_CODES[resp["status"]], "message": rq_status["exc_info"]}
+                _update_job(job_id, status=resp["status"], error=resp["error"])
         except Exception:
             pass
-
+    if resp["status"] == "processing":
+        job["status"] = "processing"
+        _update_progress(job)
+        resp["progress"] = job.get("progress", 0)
     return resp
 
 
 @app.get("/jobs/{job_id}/result")
-async def get_result(job_id: str, format: str = "png"):
-    """下载结果：png 或 zip"""
+async def get_result(request: Request, job_id: str, format: str = "png"):
+    """下载结果：序列帧图（png/webp，按任务 output_format）或 zip（支持 ETag / 304 / Range）"""
     if job_id not in _jobs:
         raise HTTPException(404, "任务不存在")
+    if _jobs[job_id]["status"] == "expired":
+        raise HTTPException(410, "结果已过期并被清理")
     if _jobs[job_id]["status"] != "completed":
         raise HTTPException(400, "任务未完成")
 
@@ -205,25 +708,124 @@ async def get_result(job_id: str, format: str = "png"):
     if not paths:
         raise HTTPException(404, "结果文件不存在")
 
-    sprite_path, index_path = paths
+    sprite_path, _ = paths
+    touch_output(job_id)
     if format == "zip":
-        import zipfile
-        zip_path = OUTPUT_DIR / job_id / "result.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            zf.write(sprite_path, "sprite.png")
-            zf.write(index_path, "index.json")
-        return FileResponse(zip_path, filename="sprite_sheet.zip", media_type="application/zip")
-    return FileResponse(sprite_path, filename="sprite.png", media_type="image/png")
+        zip_path = await asyncio.to_thread(get_result_zip_path, job_id)
+        return await cached_file_response(request, zip_path, "application/zip", "sprite_sheet.zip")
+    media_type = SPRITE_MIME_TYPES.get(sprite_path.suffix, "application/octet-stream")
+    return await cached_file_response(request, sprite_path, media_type, sprite_path.name)
 
 
 @app.get("/jobs/{job_id}/index")
-async def get_index(job_id: str):
+async def get_index(request: Request, job_id: str):
     """获取索引 JSON"""
     paths = get_result_paths(job_id)
     if not paths:
         raise HTTPException(404, "结果不存在")
     _, index_path = paths
-    return FileResponse(index_path, media_type="application/json")
+    return await cached_file_response(request, index_path, "application/json")
+
+
+@app.get("/jobs/{job_id}/preview")
+async def get_preview(request: Request, job_id: str):
+    """
+    渐进式预览：先是低分辨率预览条，随后为按批次刷新的缩小版局部图。
+    进度见响应头 X-Preview-Kind / X-Preview-Frames-Done / X-Preview-Total。
+    """
+    paths = get_preview_paths(job_id)
+    if not paths:
+        raise HTTPException(404, "预览尚未生成")
+    preview_path, meta_path = paths
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        meta = {}
+    resp = await cached_file_response(request, preview_path, "image/png", cache_control="no-cache")
+    resp.headers["X-Preview-Kind"] = str(meta.get("kind", ""))
+    resp.headers["X-Preview-Frames-Done"] = str(meta.get("frames_done", 0))
+    resp.headers["X-Preview-Total"] = str(meta.get("total", 0))
+    return resp
+
+
+def _frame_etag(sheet_etag: str, suffix: str) -> str:
+    """派生单帧 / 区间的强 ETag：整图内容不变则裁剪结果不变"""
+    return f'"{sheet_etag.strip(chr(34))}-{suffix}"'
+
+
+def _build_frames_zip(sprite_path: Path, index_path: Path, start: int, end: int) -> bytes:
+    """将 [start, end) 帧打包为 ZIP（PNG 已压缩，STORED）"""
+    import io
+    import zipfile
+    buf = io.BytesIO()
+    pngs = get_frame_pngs(sprite_path, index_path, start, end)
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for i, data in enumerate(pngs, start):
+            zf.writestr(f"frame_{i:05d}.png", data)
+    return buf.getvalue()
+
+
+@app.get("/jobs/{job_id}/frames/{i}")
+async def get_frame(request: Request, job_id: str, i: int):
+    """按索引裁出单帧 PNG（解码后的整图缓存在 API 进程内）"""
+    paths = get_result_paths(job_id)
+    if not paths:
+        raise HTTPException(404, "结果不存在")
+    sprite_path, index_path = paths
+    touch_output(job_id)
+    etag = _frame_etag(await asyncio.to_thread(file_etag, sprite_path), str(i))
+    headers = cache_headers(etag)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data = await asyncio.to_thread(get_frame_png, sprite_path, index_path, i)
+    if data is None:
+        raise HTTPException(404, "帧不存在")
+    return Response(content=data, media_type="image/png", headers=headers)
+
+
+@app.get("/jobs/{job_id}/frames")
+async def get_frames(request: Request, job_id: str, start: int = 0, end: Optional[int] = None):
+    """区间取帧 [start, end)，返回 ZIP（frame_00000.png ...）"""
+    paths = get_result_paths(job_id)
+    if not paths:
+        raise HTTPException(404, "结果不存在")
+    sprite_path, index_path = paths
+    touch_output(job_id)
+    total = await asyncio.to_thread(frame_count, sprite_path, index_path)
+    end = total if end is None else min(end, total)
+    if start < 0 or start >= end:
+        raise HTTPException(400, f"帧区间无效，共 {total} 帧")
+    if end - start > MAX_FRAMES_PER_RANGE:
+        raise HTTPException(400, f"单次最多 {MAX_FRAMES_PER_RANGE} 帧")
+
+    etag = _frame_etag(await asyncio.to_thread(file_etag, sprite_path), f"{start}-{end}")
+    headers = cache_headers(etag)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data = await asyncio.to_thread(_build_frames_zip, sprite_path, index_path, start, end)
+    headers["Content-Disposition"] = f'attachment; filename="frames_{start}_{end}.zip"'
+    return Response(content=data, media_type="application/zip", headers=headers)
+
+
+@app.get("/jobs/{job_id}/profile")
+async def get_profile(request: Request, job_id: str, format: str = "json"):
+    """
+    下载任务剖析结果（序列帧与水印任务通用）：json 为摘要（墙钟 / CPU、ffmpeg 等子进程耗时、热点函数），
+    pstats 为原始 cProfile 数据（python -m pstats / snakeviz 查看）。
+    任务参数 profile=true 或被 JOB_PROFILE_SAMPLE_RATE 抽中时才有；失败的任务也会保留。
+    """
+    if job_id not in _jobs and job_id not in _watermark_jobs:
+        raise HTTPException(404, "任务不存在")
+    if format not in PROFILE_FILENAMES:
+        raise HTTPException(400, f"format 仅支持: {', '.join(PROFILE_FILENAMES)}")
+    path = get_profile_path(job_id, format)
+    if not path:
+        raise HTTPException(404, "该任务没有剖析结果")
+    if format == "json":
+        return await cached_file_response(request, path, "application/json", cache_control="no-cache")
+    return await cached_file_response(request, path, "application/octet-stream", f"{job_id}.pstats", "no-cache")
 
 
 def _run_matte_sync(content: bytes) -> bytes:
@@ -249,20 +851,36 @@ async def matte_image(file: UploadFile = File(...)):
     if len(content) > MAX_IMAGE_MB * 1024 * 1024:
         raise HTTPException(400, f"图片不得超过 {MAX_IMAGE_MB}MB")
 
-    try:
-        result = await asyncio.to_thread(_run_matte_sync, content)
-        return Response(content=result, media_type="image/png")
-    except Exception as e:
-        raise HTTPException(500, f"抠图失败: {str(e)}")
+    async with matte_slot():
+        try:
+            result = await asyncio.to_thread(_run_matte_sync, content)
+            return Response(content=result, media_type="image/png")
+        except Exception as e:
+            raise HTTPException(500, f"抠图失败: {str(e)}")
 
 
 @app.post("/watermark")
-async def create_watermark_job(file: UploadFile = File(...)):
+async def create_watermark_job(
+    request: Request,
+    file: UploadFile = File(...),
+    params: str = Form(default="{}"),
+):
     """
     创建 Seedance 水印去除任务。上传视频，返回 job_id，轮询 GET /watermark/{id} 获取状态。
+    params 可选 {"region": {"x", "y", "w", "h"}} 或 {"preset": "bottom_right"}，均不给时自动检测；
+    region 须完整落在画面内（按探测到的宽高校验），超出时返回 400；
+    {"profile": true} 时在 cProfile 下运行，结果由 GET /jobs/{id}/profile 下载。
+    准入规则同 POST /jobs。
     """
     job_id = generate_job_id()
 
+    try:
+        params_obj = WatermarkParams.model_validate_json(params)
+    except Exception as e:
+        raise HTTPException(400, f"参数解析失败: {e}")
+    region = params_obj.region.model_dump() if params_obj.region else None
+    preset = params_obj.preset
+
     if not file.filename:
         raise HTTPException(400, "请上传视频文件")
 
@@ -270,36 +888,53 @@ async def create_watermark_job(file: UploadFile = File(...)):
     if ext not in ALLOWED_VIDEO_EXTENSIONS:
         raise HTTPException(400, f"不支持的格式，仅支持: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}")
 
-    content = await file.read()
-    if len(content) > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+    if (file.size or 0) > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
         raise HTTPException(400, f"文件过大，限制 {MAX_UPLOAD_SIZE_MB}MB")
 
-    save_uploaded_file(job_id, file.filename or "video.mp4", content)
+    client = await _admit(request)
+    _, digest = await asyncio.to_thread(_save_upload, job_id, file.filename or "video.mp4", file)
     video_path = get_video_path(job_id)
     if not video_path:
         raise HTTPException(500, "保存视频失败")
+    video_info = await _inspect_upload(job_id, video_path, digest, None)
+    if region and video_info and (region["x"] + region["w"] > video_info["width"]
+                                  or region["y"] + region["h"] > video_info["height"]):
+        delete_upload(job_id)
+        raise HTTPException(400, f"水印区域超出画面（{video_info['width']}x{video_info['height']}）")
 
     _watermark_jobs[job_id] = {
         "id": job_id,
         "status": "queued",
         "progress": 0,
         "rq_job_id": "",
+        "client": client,
         "result": None,
         "error": None,
     }
 
     try:
         from worker.tasks import enqueue_watermark_job
-        rq_id = enqueue_watermark_job(job_id, str(video_path), str(OUTPUT_DIR))
-        _watermark_jobs[job_id]["rq_job_id"] = rq_id
+        queued = enqueue_watermark_job(
+            job_id, str(video_path), str(OUTPUT_DIR), str(TEMP_DIR), region, preset, params_obj.profile, video_info
+        )
+        _watermark_jobs[job_id].update(
+            rq_job_id=queued["rq_job_id"], queue=queued["queue"], estimated_cost=queued["estimated_cost"]
+        )
+        note_enqueued(1, queued["estimated_frames"] or 0, queued["estimated_temp_bytes"] or 0)
     except Exception:
         _watermark_jobs[job_id]["status"] = "processing"
         _watermark_jobs[job_id]["rq_job_id"] = ""
-        thread = threading.Thread(target=_run_watermark_sync, args=(job_id, str(video_path)))
+        thread = threading.Thread(target=_run_watermark_sync, args=(job_id, str(video_path), region, preset, params_obj.profile))
         thread.daemon = True
         thread.start()
+        return {"job_id": job_id}
 
-    return {"job_id": job_id}
+    return {
+        "job_id": job_id,
+        "queue": queued["queue"],
+        "estimated_cost": queued["estimated_cost"],
+        "queue_position": queued["queue_position"],
+    }
 
 
 @app.get("/watermark/{job_id}")
@@ -315,14 +950,19 @@ async def get_watermark_job(job_id: str):
         "progress": job.get("progress", 0),
         "error": job.get("error"),
         "result": job.get("result"),
+        "queue": job.get("queue"),
+        "estimated_cost": job.get("estimated_cost"),
+        "queue_position": None,
     }
 
     if job["status"] in ("queued", "processing") and job.get("rq_job_id"):
         try:
             from worker.tasks import get_job_status
             rq_status = get_job_status(job["rq_job_id"])
-            status_map = {"queued": "queued", "started": "processing", "finished": "completed", "failed": "failed", "deferred": "queued"}
+            status_map = _RQ_STATUS_MAP
             resp["status"] = status_map.get(rq_status["status"], job["status"])
+            resp["queue"] = rq_status.get("queue") or resp["queue"]
+            resp["queue_position"] = rq_status.get("queue_position")
             if rq_status.get("result"):
                 resp["result"] = rq_status["result"]
                 resp["progress"] = 100
@@ -330,9 +970,9 @@ async def get_watermark_job(job_id: str):
                 job["progress"] = 100
                 job["result"] = rq_status["result"]
             if rq_status.get("exc_info"):
-                resp["error"] = {"code": "PROCESSING_ERROR", "message": rq_status["exc_info"]}
-                resp["status"] = "failed"
-                job["status"] = "failed"
+                resp["status"] = _failure_status(rq_status["exc_info"])
+                resp["error"] = {"code": _FAILURE_CODES[resp["status"]], "message": rq_status["exc_info"]}
+                job["status"] = resp["status"]
                 job["error"] = resp["error"]
         except Exception:
             pass
@@ -341,10 +981,12 @@ async def get_watermark_job(job_id: str):
 
 
 @app.get("/watermark/{job_id}/result")
-async def get_watermark_result(job_id: str):
+async def get_watermark_result(request: Request, job_id: str):
     """下载去水印后的视频"""
     if job_id not in _watermark_jobs:
         raise HTTPException(404, "任务不存在")
+    if _watermark_jobs[job_id]["status"] == "expired":
+        raise HTTPException(410, "结果已过期并被清理")
     if _watermark_jobs[job_id]["status"] != "completed":
         raise HTTPException(400, "任务未完成")
 
@@ -359,33 +1001,56 @@ async def get_watermark_result(job_id: str):
     if not out_path:
         raise HTTPException(404, "结果文件不存在")
 
-    return FileResponse(out_path, filename="clean.mp4", media_type="video/mp4")
+    touch_output(job_id)
+    return await cached_file_response(request, out_path, "video/mp4", "clean.mp4")
 
 
-@app.delete("/watermark/{job_id}")
-async def delete_watermark_job(job_id: str):
-    """删除水印去除任务及结果"""
-    if job_id in _watermark_jobs:
-        del _watermark_jobs[job_id]
+def _remove_job_dirs(job_id: str):
+    """删除任务的上传、输出与临时目录"""
     import shutil
     for base in [UPLOAD_DIR, OUTPUT_DIR, TEMP_DIR]:
         d = base / job_id
         if d.exists():
             shutil.rmtree(d, ignore_errors=True)
+
+
+def _cancel_or_delete(jobs: dict, job_id: str) -> dict:
+    """
+    进行中的任务：排队的直接出队，运行中的写入取消标记，由 worker 在帧间退出并清理文件；
+    记录保留为 canceled 状态。已结束的任务：删除记录及文件。
+    """
+    job = jobs.get(job_id)
+    if job and job["status"] in ("queued", "processing"):
+        rq_status = ""
+        try:
+            from worker.tasks import cancel_job
+            rq_status = cancel_job(job_id, job.get("rq_job_id", ""))
+        except Exception:
+            from worker.cancellation import request_cancel
+            request_cancel(job_id)
+        if rq_status not in ("finished", "failed", "canceled", "stopped"):
+            job["status"] = "canceled"
+            job["error"] = {"code": "CANCELED", "message": "任务已取消"}
+            # 运行中（RQ started、同步线程或状态未知）的任务由 worker 自行清理，避免删掉正在读写的文件
+            if rq_status not in ("started", ""):
+                _remove_job_dirs(job_id)
+            return {"ok": True, "status": "canceled"}
+
+    jobs.pop(job_id, None)
+    _remove_job_dirs(job_id)
     return {"ok": True}
 
 
+@app.delete("/watermark/{job_id}")
+async def delete_watermark_job(job_id: str):
+    """取消进行中的水印去除任务，或删除已结束任务及结果"""
+    return await asyncio.to_thread(_cancel_or_delete, _watermark_jobs, job_id)
+
+
 @app.delete("/jobs/{job_id}")
 async def delete_job(job_id: str):
-    """删除任务及结果"""
-    if job_id in _jobs:
-        del _jobs[job_id]
-    import shutil
-    for base in [UPLOAD_DIR, OUTPUT_DIR, TEMP_DIR]:
-        d = base / job_id
-        if d.exists():
-            shutil.rmtree(d, ignore_errors=True)
-    return {"ok": True}
+    """取消进行中的任务，或删除已结束任务及结果"""
+    return await asyncio.to_thread(_cancel_or_delete, _jobs, job_id)
 
 
 # 后台轮询更新：需要 worker 完成后更新 _jobs。可通过 RQ 的失败/成功回调实现。
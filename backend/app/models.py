@@ -1,6 +1,6 @@
 """数据模型定义"""
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -23,6 +23,7 @@ class JobParams(BaseModel):
     fps: int = Field(ge=1, le=60, default=12)
     frame_range: FrameRange = Field(default_factory=FrameRange)
     max_frames: int = Field(ge=1, le=2000, default=300)
+    sampling: Literal["uniform", "adaptive"] = "uniform"  # adaptive 按运动能量选帧，max_frames 为上限
     target_size: TargetSize = Field(default_factory=lambda: TargetSize(w=256, h=256))
     bg_color: str = "transparent"  # #RRGGBB or transparent
     transparent: bool = True
@@ -31,7 +32,26 @@ class JobParams(BaseModel):
     layout_mode: str = "fixed_columns"  # fixed_columns / auto_square
     columns: int = Field(ge=1, le=64, default=12)
     matte_strength: float = Field(ge=0.0, le=1.0, default=0.6)
-    crop_mode: str = "tight_bbox"  # none / tight_bbox / safe_bbox
+    crop_mode: Literal["none", "tight_bbox", "safe_bbox", "union_bbox"] = "tight_bbox"
+    output_format: Literal["png", "webp", "png8"] = "png"  # webp 为无损，png8 为调色板量化
+    compress_level: int = Field(ge=0, le=9, default=6)  # 0 最快、9 最小
+    preview_frames: int = Field(ge=0, le=64, default=8)  # 预览条帧数，0 关闭渐进式预览
+    profile: bool = False  # 在 cProfile 下运行，剖析结果由 GET /jobs/{id}/profile 下载
+
+
+class WatermarkRegion(BaseModel):
+    """水印区域（源视频像素坐标）"""
+    x: int = Field(ge=0)
+    y: int = Field(ge=0)
+    w: int = Field(gt=0)
+    h: int = Field(gt=0)
+
+
+class WatermarkParams(BaseModel):
+    """水印去除参数；region 优先于 preset，均未给定时自动检测"""
+    region: Optional[WatermarkRegion] = None
+    preset: Optional[Literal["top_left", "top_right", "bottom_left", "bottom_right"]] = None
+    profile: bool = False
 
 
 class JobCreateRequest(BaseModel):
@@ -49,7 +69,7 @@ class JobError(BaseModel):
 class JobResponse(BaseModel):
     """任务响应"""
     id: str
-    status: str  # queued / processing / completed / failed / canceled
+    status: str  # queued / processing / completed / failed / canceled / expired
     progress: int = 0
     params: Optional[JobParams] = None
     created_at: Optional[datetime] = None
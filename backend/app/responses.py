@@ -0,0 +1,129 @@
+"""结果文件响应：强 ETag、Cache-Control、304 与 Range"""
+import asyncio
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from .config import RESULT_CACHE_MAX_AGE
+
+_CHUNK_SIZE = 256 * 1024
+
+
+@lru_cache(maxsize=1024)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    """按内容计算摘要；mtime/size 参与缓存键，文件被替换时自动失效"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:32]
+
+
+def file_etag(path: Path) -> str:
+    """文件内容的强 ETag（带引号）"""
+    st = path.stat()
+    return f'"{_hash_file(str(path), st.st_mtime_ns, st.st_size)}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中（忽略 W/ 前缀，支持 *）"""
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def cache_headers(etag: str, max_age: int = RESULT_CACHE_MAX_AGE) -> dict:
+    """结果一经生成即不可变，可被 CDN 长期缓存"""
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, immutable",
+    }
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """解析单段 bytes=start-end，返回闭区间；多段或非法时返回 None"""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return start, start  # 不可满足，由调用方返回 416
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _iter_file(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def cached_file_response(
+    request: Request,
+    path: Path,
+    media_type: str,
+    filename: Optional[str] = None,
+    cache_control: Optional[str] = None,
+) -> Response:
+    """带条件请求与 Range 支持的文件响应；cache_control 用于覆盖默认的长期缓存策略"""
+    etag = await asyncio.to_thread(file_etag, path)
+    headers = cache_headers(etag)
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    headers["Accept-Ranges"] = "bytes"
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    size = path.stat().st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        if size == 0:
+            return Response(status_code=416, headers={**headers, "Content-Range": "bytes */0"})
+        rng = _parse_range(range_header, size)
+        if rng is not None:
+            start, end = rng
+            if start >= size:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+            length = end - start + 1
+            headers.update({
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(length),
+            })
+            if filename:
+                headers["Content-Disposition"] = f'attachment; filename="{os.path.basename(filename)}"'
+            return StreamingResponse(
+                _iter_file(path, start, length),
+                status_code=206,
+                media_type=media_type,
+                headers=headers,
+            )
+
+    return FileResponse(path, filename=filename, media_type=media_type, headers=headers)
@@ -1,11 +1,31 @@
 """存储管理"""
 import json
+import os
 import shutil
+import time
 import uuid
+import zipfile
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
-from .config import UPLOAD_DIR, OUTPUT_DIR, TEMP_DIR
+from .config import (
+    ADMISSION_MIN_FREE_DISK_MB,
+    OUTPUT_DIR,
+    OUTPUT_MIN_FREE_PERCENT,
+    OUTPUT_QUOTA_MB,
+    OUTPUT_TTL_HOURS,
+    TEMP_DIR,
+    TEMP_TTL_HOURS,
+    UPLOAD_DIR,
+    UPLOAD_TTL_HOURS,
+)
+
+
+# 序列帧图按 output_format 可能为 PNG 或 WebP
+SPRITE_FILENAMES = ("sprite.png", "sprite.webp")
+SPRITE_MIME_TYPES = {".png": "image/png", ".webp": "image/webp"}
+# 任务剖析结果（worker/profiling.py 写入）：摘要 JSON 与原始 cProfile 数据
+PROFILE_FILENAMES = {"json": "profile.json", "pstats": "profile.pstats"}
 
 
 def ensure_dirs():
@@ -27,13 +47,15 @@ def get_job_dirs(job_id: str) -> tuple[Path, Path, Path]:
     return upload_path, temp_path, output_path
 
 
-def save_uploaded_file(job_id: str, filename: str, content: bytes) -> Path:
-    """保存上传的文件"""
+def save_uploaded_file(job_id: str, filename: str, chunks: Iterable[bytes]) -> Path:
+    """分块保存上传的文件，不把整个文件读入内存"""
     ensure_dirs()
     upload_path, _, _ = get_job_dirs(job_id)
     upload_path.mkdir(parents=True, exist_ok=True)
     file_path = upload_path / filename
-    file_path.write_bytes(content)
+    with open(file_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
     return file_path
 
 
@@ -50,7 +72,7 @@ def get_video_path(job_id: str) -> Optional[Path]:
 
 def save_result(job_id: str, sprite_path: Path, index_data: dict) -> tuple[Path, Path]:
     """保存结果文件"""
-    output_path, _, _ = get_job_dirs(job_id)
+    _, _, output_path = get_job_dirs(job_id)
     output_path.mkdir(parents=True, exist_ok=True)
     dest_sprite = output_path / "sprite.png"
     dest_index = output_path / "index.json"
@@ -62,18 +84,245 @@ def save_result(job_id: str, sprite_path: Path, index_data: dict) -> tuple[Path,
 
 def get_result_paths(job_id: str) -> Optional[tuple[Path, Path]]:
     """获取结果文件路径"""
-    output_path, _, _ = get_job_dirs(job_id)
-    sprite = output_path / "sprite.png"
+    _, _, output_path = get_job_dirs(job_id)
     index = output_path / "index.json"
-    if sprite.exists() and index.exists():
-        return sprite, index
+    if not index.exists():
+        return None
+    for name in SPRITE_FILENAMES:
+        sprite = output_path / name
+        if sprite.exists():
+            return sprite, index
+    return None
+
+
+def get_result_zip_path(job_id: str) -> Optional[Path]:
+    """获取结果 ZIP 路径；worker 已预先生成，旧任务缺失时补建一次"""
+    paths = get_result_paths(job_id)
+    if not paths:
+        return None
+    sprite, index = paths
+    zip_path = sprite.parent / "result.zip"
+    if not zip_path.exists():
+        from worker.results import write_result_zip
+        write_result_zip(sprite, index, zip_path)
+    return zip_path
+
+
+class _ZipStream:
+    """只追加的写缓冲；zipfile 写入不可 seek 的流时改用数据描述符，无需回写文件头"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._pos = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_results_zip(entries: list[tuple[str, str]], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    流式打包多个任务的结果：entries 为 (目录名, job_id)，每个目录放 sprite 与 index.json。
+    边读边产出，不在磁盘或内存中拼出完整 ZIP。
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w") as zf:
+        for folder, job_id in entries:
+            paths = get_result_paths(job_id)
+            if not paths:
+                continue
+            for path, arcname, compress in (
+                (paths[0], paths[0].name, zipfile.ZIP_STORED),
+                (paths[1], "index.json", zipfile.ZIP_DEFLATED),
+            ):
+                info = zipfile.ZipInfo.from_file(path, f"{folder}/{arcname}")
+                info.compress_type = compress
+                with open(path, "rb") as src, zf.open(info, "w") as dst:
+                    while chunk := src.read(chunk_size):
+                        dst.write(chunk)
+                        yield stream.drain()
+                yield stream.drain()
+    yield stream.drain()
+
+
+def get_preview_paths(job_id: str) -> Optional[tuple[Path, Path]]:
+    """获取渐进式预览图及其说明（preview.json）路径"""
+    _, _, output_path = get_job_dirs(job_id)
+    preview = output_path / "preview.png"
+    meta = output_path / "preview.json"
+    if preview.exists() and meta.exists():
+        return preview, meta
     return None
 
 
 def get_watermark_output_path(job_id: str) -> Optional[Path]:
     """获取水印去除任务的结果视频路径"""
-    output_path, _, _ = get_job_dirs(job_id)
+    _, _, output_path = get_job_dirs(job_id)
     clean = output_path / "clean.mp4"
     if clean.exists():
         return clean
     return None
+
+
+def get_profile_path(job_id: str, fmt: str = "json") -> Optional[Path]:
+    """获取任务的剖析结果路径（fmt: json / pstats）；未剖析时返回 None"""
+    _, _, output_path = get_job_dirs(job_id)
+    profile = output_path / PROFILE_FILENAMES[fmt]
+    return profile if profile.exists() else None
+
+
+# ---- 存储生命周期：TTL、输出配额 LRU 淘汰、孤儿临时目录清理 ----
+
+# 结果被访问时刷新输出目录 mtime 作为 LRU 时间，同一目录最多每分钟刷新一次
+_TOUCH_INTERVAL_SEC = 60
+_STORAGE_CLASSES = {"uploads": UPLOAD_DIR, "outputs": OUTPUT_DIR, "temp": TEMP_DIR}
+
+
+def _dir_stats(path: Path) -> tuple[int, float]:
+    """目录总字节数与其中最新的 mtime"""
+    total, newest = 0, path.stat().st_mtime
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    newest = max(newest, st.st_mtime)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    else:
+                        total += st.st_size
+        except OSError:
+            continue
+    return total, newest
+
+
+def _job_dirs(base: Path) -> list[Path]:
+    try:
+        return [p for p in base.iterdir() if p.is_dir()]
+    except OSError:
+        return []
+
+
+def touch_output(job_id: str) -> None:
+    """记录结果被访问（LRU 依据）"""
+    _, _, output_path = get_job_dirs(job_id)
+    try:
+        if time.time() - output_path.stat().st_mtime > _TOUCH_INTERVAL_SEC:
+            os.utime(output_path)
+    except OSError:
+        pass
+
+
+def delete_upload(job_id: str) -> None:
+    """处理成功后删除上传的源视频"""
+    upload_path, _, _ = get_job_dirs(job_id)
+    shutil.rmtree(upload_path, ignore_errors=True)
+
+
+def _output_min_free() -> int:
+    """输出卷应保持的最低剩余字节数，0 表示不按剩余空间淘汰"""
+    if not OUTPUT_MIN_FREE_PERCENT:
+        return 0
+    try:
+        total = shutil.disk_usage(OUTPUT_DIR).total
+    except OSError:
+        return 0
+    return int(max(total * OUTPUT_MIN_FREE_PERCENT / 100, ADMISSION_MIN_FREE_DISK_MB * 1024 * 1024))
+
+
+def storage_usage() -> dict:
+    """各类目录占用与所在卷的剩余空间"""
+    usage = {}
+    for name, base in _STORAGE_CLASSES.items():
+        dirs = _job_dirs(base)
+        size = sum(_dir_stats(d)[0] for d in dirs)
+        entry = {"bytes": size, "jobs": len(dirs)}
+        try:
+            disk = shutil.disk_usage(base)
+            entry.update(disk_total=disk.total, disk_free=disk.free)
+        except OSError:
+            pass
+        usage[name] = entry
+    usage["outputs"]["quota_bytes"] = OUTPUT_QUOTA_MB * 1024 * 1024
+    usage["outputs"]["min_free_bytes"] = _output_min_free()
+    return usage
+
+
+def collect_garbage(active_job_ids: Iterable[str] = ()) -> dict:
+    """
+    一轮存储回收，跳过进行中的任务：
+    1. 上传、临时目录超过各自 TTL（按目录内最新 mtime，崩溃任务的临时目录不再更新）即删除；
+    2. 输出目录超过 TTL（按最近访问）删除；
+    3. 输出总量超过配额、或输出卷剩余空间低于 OUTPUT_MIN_FREE_PERCENT 时，按最近访问从旧到新淘汰。
+    active_job_ids 应取自 RQ（排队 / 执行中 / 等待重试），而非单个 API 进程内存中的任务。
+    返回各类删除的目录数、释放字节数与被删除输出的 job_id。
+    """
+    active = set(active_job_ids)
+    now = time.time()
+    report = {"removed": {}, "freed_bytes": 0, "expired_outputs": []}
+
+    def remove(name: str, path: Path, size: int) -> None:
+        shutil.rmtree(path, ignore_errors=True)
+        report["removed"][name] = report["removed"].get(name, 0) + 1
+        report["freed_bytes"] += size
+        if name == "outputs":
+            report["expired_outputs"].append(path.name)
+
+    for name, base, ttl_hours in (
+        ("uploads", UPLOAD_DIR, UPLOAD_TTL_HOURS),
+        ("temp", TEMP_DIR, TEMP_TTL_HOURS),
+    ):
+        if not ttl_hours:
+            continue
+        for d in _job_dirs(base):
+            if d.name in active:
+                continue
+            size, newest = _dir_stats(d)
+            if now - newest > ttl_hours * 3600:
+                remove(name, d, size)
+
+    outputs = []
+    for d in _job_dirs(OUTPUT_DIR):
+        if d.name in active:
+            continue
+        size = _dir_stats(d)[0]
+        try:
+            last_access = d.stat().st_mtime
+        except OSError:
+            continue
+        if OUTPUT_TTL_HOURS and now - last_access > OUTPUT_TTL_HOURS * 3600:
+            remove("outputs", d, size)
+        else:
+            outputs.append((last_access, size, d))
+
+    quota = OUTPUT_QUOTA_MB * 1024 * 1024
+    total = sum(size for _, size, _ in outputs)
+    min_free = _output_min_free()
+    try:
+        free = shutil.disk_usage(OUTPUT_DIR).free if min_free else 0
+    except OSError:
+        min_free = 0
+    for _, size, d in sorted(outputs, key=lambda item: item[0]):
+        if not (quota and total > quota) and not (min_free and free < min_free):
+            break
+        remove("outputs", d, size)
+        total -= size
+        free += size
+    return report
+
@@ -4,6 +4,7 @@ export interface JobParams {
   fps?: number
   frame_range?: { start_sec?: number; end_sec?: number }
   max_frames?: number
+  sampling?: 'uniform' | 'adaptive'
   target_size?: { w: number; h: number }
   bg_color?: string
   transparent?: boolean
@@ -12,15 +13,19 @@ export interface JobParams {
   layout_mode?: 'fixed_columns' | 'auto_square'
   columns?: number
   matte_strength?: number
-  crop_mode?: 'none' | 'tight_bbox' | 'safe_bbox'
+  crop_mode?: 'none' | 'tight_bbox' | 'safe_bbox' | 'union_bbox'
+  output_format?: 'png' | 'webp' | 'png8'
+  compress_level?: number
+  preview_frames?: number
+  profile?: boolean
 }
 
 export interface Job {
   id: string
-  status: 'queued' | 'processing' | 'completed' | 'failed' | 'canceled'
+  status: 'queued' | 'processing' | 'completed' | 'failed' | 'canceled' | 'expired'
   progress: number
   params?: JobParams
-  result?: { frame_count?: number; width?: number; height?: number }
+  result?: { frame_count?: number; width?: number; height?: number; output_format?: string }
   error?: { code: string; message: string }
 }
 
@@ -39,6 +44,22 @@ export async function createJob(file: File, params: JobParams): Promise<{ job_id
   return res.json()
 }
 
+/** 由 worker 直接从 http(s) URL 拉取视频，无需先下载再上传 */
+export async function createJobFromUrl(url: string, params: JobParams): Promise<{ job_id: string }> {
+  const formData = new FormData()
+  formData.append('url', url)
+  formData.append('params', JSON.stringify(params))
+  const res = await fetch(`${API_BASE}/jobs`, {
+    method: 'POST',
+    body: formData,
+  })
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({ detail: res.statusText }))
+    throw new Error(err.detail || String(err))
+  }
+  return res.json()
+}
+
 export async function getJob(jobId: string): Promise<Job> {
   const res = await fetch(`${API_BASE}/jobs/${jobId}`)
   if (!res.ok) throw new Error('任务不存在')
@@ -49,21 +70,75 @@ export function getResultUrl(jobId: string, format: 'png' | 'zip' = 'png'): stri
   return `${API_BASE}/jobs/${jobId}/result?format=${format}`
 }
 
+export function getProfileUrl(jobId: string, format: 'json' | 'pstats' = 'json'): string {
+  return `${API_BASE}/jobs/${jobId}/profile?format=${format}`
+}
+
 export function getIndexUrl(jobId: string): string {
   return `${API_BASE}/jobs/${jobId}/index`
 }
 
+export interface Batch {
+  id: string
+  status: 'queued' | 'processing' | 'completed' | 'partial' | 'failed'
+  total: number
+  counts: Record<string, number>
+  progress: number
+  items: { job_id: string; filename?: string; status: string; error?: { code: string; message: string } }[]
+}
+
+export async function createBatch(
+  files: File[],
+  params: JobParams
+): Promise<{ batch_id: string; job_ids: string[]; total: number }> {
+  const formData = new FormData()
+  files.forEach((f) => formData.append('files', f))
+  formData.append('params', JSON.stringify(params))
+  const res = await fetch(`${API_BASE}/batches`, {
+    method: 'POST',
+    body: formData,
+  })
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({ detail: res.statusText }))
+    throw new Error(err.detail || String(err))
+  }
+  return res.json()
+}
+
+export async function getBatch(batchId: string): Promise<Batch> {
+  const res = await fetch(`${API_BASE}/batches/${batchId}`)
+  if (!res.ok) throw new Error('批量任务不存在')
+  return res.json()
+}
+
+export function getBatchResultUrl(batchId: string): string {
+  return `${API_BASE}/batches/${batchId}/result`
+}
+
 export interface WatermarkJob {
   id: string
   status: 'queued' | 'processing' | 'completed' | 'failed'
   progress: number
-  result?: { output?: string }
+  result?: {
+    output?: string
+    detection?: 'cache' | 'auto' | 'manual' | 'preset'
+    inpaint_reuse?: { frames: number; reused: number; hit_rate: number }
+  }
   error?: { code: string; message: string }
 }
 
-export async function createWatermarkJob(file: File): Promise<{ job_id: string }> {
+export type WatermarkPreset = 'top_left' | 'top_right' | 'bottom_left' | 'bottom_right'
+
+export interface WatermarkParams {
+  region?: { x: number; y: number; w: number; h: number }
+  preset?: WatermarkPreset
+  profile?: boolean
+}
+
+export async function createWatermarkJob(file: File, params: WatermarkParams = {}): Promise<{ job_id: string }> {
   const formData = new FormData()
   formData.append('file', file)
+  formData.append('params', JSON.stringify(params))
   const res = await fetch(`${API_BASE}/watermark`, {
     method: 'POST',
     body: formData,
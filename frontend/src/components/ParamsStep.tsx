@@ -986,7 +986,7 @@ export default function ParamsStep({ file, params, onParamsChange }: Props) {
           layout_mode: (v.layout_mode as 'fixed_columns' | 'auto_square') ?? 'fixed_columns',
           columns: (v.columns as number) ?? 4,
           matte_strength: ((v.matte_strength as number) ?? 60) / 100,
-          crop_mode: (v.crop_mode as 'none' | 'tight_bbox' | 'safe_bbox') ?? 'tight_bbox',
+          crop_mode: (v.crop_mode as 'none' | 'tight_bbox' | 'safe_bbox' | 'union_bbox') ?? 'tight_bbox',
         })
       }}
     >
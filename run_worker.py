@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
-"""启动 RQ Worker"""
+"""
+启动 RQ Worker
+
+WORKER_PROCESSES > 1（或 auto）时以 supervisor 模式运行：按核数把 CPU 均分给 N 个 worker 子进程，
+每个子进程绑定自己的 CPU 集，onnxruntime / OpenCV / ffmpeg 线程数限制在各自预算内，子进程异常退出时重启。
+"""
 import os
+import signal
+import subprocess
 import sys
+import time
 
 # 项目根目录加入 path
 ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -10,11 +18,109 @@ if ROOT not in sys.path:
 
 os.chdir(ROOT)
 
-# 启动 worker
-from rq import Worker
-from rq.cli import main
+from worker.threads import apply_thread_budget, available_cpus, format_cpus, plan_workers
 
-if __name__ == "__main__":
-    # 使用 rq 命令行
-    sys.argv = ["rq", "worker", "pixelwork", "--url", os.getenv("REDIS_URL", "redis://localhost:6379/0")]
+# auto 时每个 worker 分到的核数
+WORKER_THREADS_PER_PROCESS = int(os.getenv("WORKER_THREADS_PER_PROCESS", "4"))
+RESTART_DELAY_SEC = 2.0
+
+
+def worker_processes() -> int:
+    value = os.getenv("WORKER_PROCESSES", "1")
+    if value == "auto":
+        return max(1, len(available_cpus()) // max(1, WORKER_THREADS_PER_PROCESS))
+    return max(1, int(value))
+
+
+def run_worker() -> None:
+    # 线程预算须在导入 numpy / cv2 / onnxruntime 之前生效
+    apply_thread_budget()
+
+    from rq.cli import main
+
+    # 任务按点分路径入队、执行时才导入；预加载时启动即导入重依赖并创建抠图会话，各任务复用
+    preload = os.getenv("WORKER_PRELOAD", "1") == "1"
+    if preload:
+        import worker.processor
+        import worker.watermark_remover  # noqa: F401
+        worker.processor.preload()
+    sys.argv = worker_argv(preload)
     main()
+
+
+def worker_argv(preload: bool) -> list[str]:
+    """rq worker 命令行"""
+    # 队列按顺序优先消费；WORKER_QUEUES 可按权重订阅，如仅 "pixelwork-large"
+    from worker.tasks import DEFAULT_WORKER_QUEUES
+    # onnxruntime 会话的线程池线程不会随 fork 复制，fork 出的执行进程里推理会挂起，
+    # 故预加载会话时用 SimpleWorker 在本进程内执行任务（进程崩溃由 supervisor 重启）；
+    # 未预加载时沿用 rq 默认的每任务 fork 一个执行进程
+    worker_class = os.getenv("WORKER_CLASS", "rq.worker.SimpleWorker" if preload else "")
+    queues = [q for q in os.getenv("WORKER_QUEUES", ",".join(DEFAULT_WORKER_QUEUES)).split(",") if q]
+    argv = [
+        "rq", "worker", *queues,
+        "--url", os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        # 只对瞬时错误自动重试，取消与参数错误直接失败
+        "--exception-handler", "worker.tasks.retry_transient_only",
+        # 带间隔的重试先进入 ScheduledJobRegistry，须有调度器到期后放回队列（多个 worker 间由锁选出一个执行）
+        "--with-scheduler",
+    ]
+    if worker_class:
+        argv += ["--worker-class", worker_class]
+    return argv
+
+
+def supervise(processes: int) -> int:
+    """启动并看护 processes 个 worker 子进程；收到 SIGTERM / SIGINT 时转发给子进程并等待其完成当前任务"""
+    plan = plan_workers(processes)
+    children: list[subprocess.Popen] = [None] * len(plan)
+    stopping = False
+    forwarded = None
+
+    def spawn(i: int) -> subprocess.Popen:
+        env = dict(os.environ,
+                   WORKER_PROCESSES="1",
+                   PIXELWORK_CPUS=format_cpus(plan[i]["cpus"]),
+                   PIXELWORK_THREADS=str(plan[i]["threads"]))
+        print(f"[supervisor] worker {i}: cpus={env['PIXELWORK_CPUS']} threads={env['PIXELWORK_THREADS']}", flush=True)
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    def stop(signum, frame):
+        nonlocal stopping, forwarded
+        stopping = True
+        if signum == signal.SIGINT:
+            # 终端 Ctrl-C 已送达整个进程组，再转发会让 rq 直接冷关闭
+            return
+        forwarded = signum
+        for child in children:
+            if child and child.poll() is None:
+                child.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(len(plan)):
+        children[i] = spawn(i)
+    while not stopping:
+        time.sleep(1.0)
+        for i, child in enumerate(children):
+            if child.poll() is not None and not stopping:
+                print(f"[supervisor] worker {i} exited with {child.returncode}, restarting", flush=True)
+                time.sleep(RESTART_DELAY_SEC)
+                # 等待期间可能已收到停止信号：此时再启动的子进程收不到转发的信号，会让关闭一直等待
+                if stopping:
+                    break
+                children[i] = spawn(i)
+                if forwarded is not None:
+                    # 信号恰在启动过程中到达
+                    children[i].send_signal(forwarded)
+    for child in children:
+        child.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    n = worker_processes()
+    if n > 1:
+        sys.exit(supervise(n))
+    run_worker()
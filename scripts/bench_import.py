@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+导入耗时基准：在全新解释器中导入 API 与任务入队模块，检查耗时与是否误引入重依赖。
+用于 CI / 发布前防回归：API 进程不应加载 rembg、onnxruntime、cv2 或 worker 的处理模块。
+
+    python scripts/bench_import.py               # 默认预算
+    python scripts/bench_import.py --runs 5 --max-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (模块, 额外 sys.path) —— API 以 backend 为根导入 app.main，与 uvicorn 部署一致
+TARGETS = [
+    ("app.main", os.path.join(ROOT, "backend")),
+    ("worker.tasks", ROOT),
+]
+FORBIDDEN = [
+    "rembg", "onnxruntime", "cv2", "numpy",
+    "worker.processor", "worker.watermark_remover", "worker.postprocess",
+]
+
+_PROBE = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"ms": elapsed * 1000, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module: str, path: str) -> dict:
+    """在子进程中冷启动导入一次"""
+    code = _PROBE.format(paths=[path, ROOT], module=module)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="每个模块导入次数，取中位数")
+    parser.add_argument("--max-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")),
+                        help="单个模块导入耗时上限（毫秒）")
+    args = parser.parse_args()
+
+    failed = False
+    for module, path in TARGETS:
+        try:
+            runs = [measure(module, path) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            failed = True
+            print(f"FAIL {module:<16} import error: {(e.stderr or '').strip().splitlines()[-1:]}")
+            continue
+        median = statistics.median(r["ms"] for r in runs)
+        loaded = set(runs[0]["modules"])
+        heavy = [m for m in FORBIDDEN if m in loaded]
+        ok = median <= args.max_ms and not heavy
+        failed |= not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {module:<16} {median:8.1f} ms  {len(loaded)} modules"
+              + (f"  heavy: {', '.join(heavy)}" if heavy else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+客户端识别自检（不需要 Redis）：
+
+- 直连请求按来源地址识别，X-Forwarded-For 不被采信；
+- 来自 TRUSTED_PROXIES 的请求按 X-Forwarded-For 从右往左取第一个不受信任的地址，
+  客户端自带的伪造条目（更左侧）被忽略，多层受信任代理被跳过；
+- 单客户端并发配额按识别出的客户端 IP 计，同一 CDN 后的不同客户端互不占用配额。
+
+    python scripts/check_admission.py
+"""
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+os.environ["TRUSTED_PROXIES"] = "10.0.0.0/8,192.0.2.10"
+os.environ["MAX_ACTIVE_JOBS_PER_CLIENT"] = "1"
+
+
+def _request(host: str, forwarded: list[str] = ()):
+    from starlette.requests import Request
+    headers = [(b"x-forwarded-for", v.encode()) for v in forwarded]
+    return Request({"type": "http", "method": "POST", "path": "/jobs", "headers": headers, "client": (host, 40000)})
+
+
+def main() -> int:
+    from fastapi import HTTPException
+
+    from app import main as api
+    from app.admission import client_id, request_ip
+
+    failures = []
+
+    def check(ok: bool, name: str, detail: str = "") -> None:
+        print(f"{'OK  ' if ok else 'FAIL'} {name}" + (f"  ({detail})" if detail else ""))
+        if not ok:
+            failures.append(name)
+
+    cases = [
+        ("direct client ignores X-Forwarded-For", _request("203.0.113.5", ["198.51.100.1"]), "203.0.113.5"),
+        ("trusted proxy: client from X-Forwarded-For", _request("10.1.2.3", ["198.51.100.1"]), "198.51.100.1"),
+        ("trusted proxy: spoofed left entries ignored", _request("10.1.2.3", ["1.2.3.4, 198.51.100.1"]), "198.51.100.1"),
+        ("trusted proxy chain skipped", _request("10.1.2.3", ["198.51.100.1, 192.0.2.10", "10.9.9.9"]), "198.51.100.1"),
+        ("trusted proxy without header", _request("10.1.2.3"), "10.1.2.3"),
+        ("trusted proxy with malformed entry", _request("10.1.2.3", ["198.51.100.1, garbage"]), "10.1.2.3"),
+    ]
+    for name, request, expected in cases:
+        got = request_ip(request)
+        check(got == expected, name, got)
+
+    # 同一 CDN 节点转发的两个客户端各自计配额；同一客户端超出配额返回 429
+    api._jobs.clear()
+    api._jobs["a"] = {"id": "a", "status": "queued", "client": client_id(_request("10.1.2.3", ["198.51.100.1"]))}
+    for name, request, admitted in (
+        ("another client behind the same proxy is admitted", _request("10.1.2.3", ["198.51.100.2"]), True),
+        ("same client behind the proxy hits its quota", _request("10.1.2.4", ["198.51.100.1"]), False),
+        ("direct client cannot borrow a forwarded address", _request("203.0.113.5", ["198.51.100.1"]), True),
+    ):
+        try:
+            asyncio.run(api._admit(request))
+            ok = admitted
+        except HTTPException as e:
+            ok = not admitted and e.status_code == 429
+        check(ok, name)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+URL 取源自检：在本机起两个 HTTP 源站（支持 / 不支持 Range），检查 worker/ingest.py 与帧提取的行为。
+
+- 地址校验：内部地址、非 http(s) 协议、经重定向跳到内部地址的 URL 均被拒绝；
+- 协议白名单：HLS 播放列表引用 file: 分片时 ffmpeg 拒绝读取；
+- 拒绝 HEAD（405）的源站：改用 Range: bytes=0-0 的 GET 取得长度与是否支持 Range；
+- 支持 Range 的受信任源站：直接读取 URL，整个提取只打开远端文件一两次，传输量约为文件大小一倍
+  （服务端按写入 socket 的字节计，略高于 ffmpeg 实际读取量）。本机 ffprobe 读不了 http URL 时
+  （如用脚本替身代替 ffprobe），open_source 会回退为下载，此项标为 SKIP 并给出原因；
+- 不支持 Range 的源站：先下载再提取，只发起一次 GET；
+- 两种方式提取出的帧逐字节一致。
+
+需要 ffmpeg / ffprobe（真实的 ffprobe，直接读取一项需要它能读取 http URL）。
+
+    python scripts/check_ingest.py
+    python scripts/check_ingest.py --fps 10 --duration 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_CHUNK = 64 * 1024
+
+
+class _Origin(ThreadingHTTPServer):
+    """测试源站：/video.mp4 为视频，/redirect 302 到 redirect_to，/list.m3u8 为引用本地文件的播放列表"""
+    daemon_threads = True
+
+    def __init__(self, data: bytes, ranges: bool, head: bool = True):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.data = data
+        self.ranges = ranges
+        self.head = head
+        self.redirect_to = ""
+        self.playlist = b""
+        self.gets = 0
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: _Origin
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        if not self.server.head:
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body: bool):
+        path = urlparse(self.path).path
+        if path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", self.server.redirect_to)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if path == "/list.m3u8":
+            data, start, end, status = self.server.playlist, 0, len(self.server.playlist) - 1, 200
+        elif path == "/video.mp4":
+            data, status = self.server.data, 200
+            start, end = 0, len(data) - 1
+            rng = self.headers.get("Range") if self.server.ranges else None
+            if rng and rng.startswith("bytes="):
+                first, _, last = rng[6:].split(",")[0].partition("-")
+                if first:
+                    start, end = int(first), min(int(last) if last else end, end)
+                else:
+                    start = max(0, len(data) - int(last))
+                status = 206
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(status)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if not body:
+            return
+        with self.server.lock:
+            self.server.gets += 1
+        try:
+            for pos in range(start, end + 1, _CHUNK):
+                chunk = data[pos:min(pos + _CHUNK, end + 1)]
+                self.wfile.write(chunk)
+                with self.server.lock:
+                    self.server.sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def _start(data: bytes, ranges: bool, head: bool = True) -> _Origin:
+    origin = _Origin(data, ranges, head)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    return origin
+
+
+def _make_video(path: Path, duration: float) -> None:
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=s=640x360:r=30:d={duration}",
+        "-c:v", "libx264", "-g", "30", "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+        str(path)
+    ], check=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10, help="测试视频时长（秒）")
+    parser.add_argument("--fps", type=int, default=5, help="提取帧率")
+    parser.add_argument("--max-transfer", type=float, default=1.5, help="直接读取时传输量上限（文件大小的倍数）")
+    args = parser.parse_args()
+
+    from worker import ingest
+    from worker.probe import input_args, is_url
+    from worker.processor import extract_frames
+
+    failures = []
+
+    def check(ok: bool, name: str, detail: str = "") -> None:
+        print(f"{'OK  ' if ok else 'FAIL'} {name}" + (f"  ({detail})" if detail else ""))
+        if not ok:
+            failures.append(name)
+
+    def rejected(url: str) -> str:
+        try:
+            ingest.check_url(url)
+        except ValueError as e:
+            return str(e)
+        return ""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        video = tmp / "video.mp4"
+        _make_video(video, args.duration)
+        data = video.read_bytes()
+        ranged, plain = _start(data, True), _start(data, False)
+        no_head = [_start(data, True, head=False), _start(data, False, head=False)]
+        try:
+            ingest.URL_ALLOWED_HOSTS = set()
+            for url in ("http://127.0.0.1/", "http://10.0.0.1/", "http://169.254.169.254/latest/meta-data/",
+                        "http://[::1]/", "http://[::ffff:127.0.0.1]/", "file:///etc/passwd", "ftp://example.com/"):
+                reason = rejected(url)
+                check(bool(reason), f"reject {url}", reason)
+
+            # 受信任主机 127.0.0.1 重定向到未受信任的 localhost（回环地址）
+            ingest.URL_ALLOWED_HOSTS = {"127.0.0.1"}
+            ranged.redirect_to = f"http://localhost:{ranged.server_address[1]}/video.mp4"
+            try:
+                ingest.open_source(f"{ranged.base}/redirect", tmp / "redirect")
+                check(False, "reject redirect to internal host")
+            except ValueError as e:
+                check(True, "reject redirect to internal host", str(e))
+
+            ranged.playlist = (
+                "#EXTM3U\n#EXT-X-TARGETDURATION:10\n#EXTINF:1,\n"
+                f"file://{video}\n#EXT-X-ENDLIST\n"
+            ).encode()
+            proc = subprocess.run(
+                ["ffmpeg", "-v", "error", *input_args(f"{ranged.base}/list.m3u8"), "-f", "null", "-"],
+                capture_output=True, text=True
+            )
+            check(proc.returncode != 0 and "not on whitelist" in proc.stderr,
+                  "ffmpeg refuses file: segments", proc.stderr.strip().splitlines()[0] if proc.stderr else "")
+
+            for origin in no_head:
+                _, length, supports_range, _ = ingest._stat_remote(f"{origin.base}/video.mp4")
+                name = f"HEAD rejected, {'range' if origin.ranges else 'no-range'} origin: size and Range support from GET"
+                check(length == len(data) and supports_range == origin.ranges, name,
+                      f"length={length}, ranged={supports_range}")
+
+            # 直接读取依赖 ffprobe 能读取 http URL；读不了时 open_source 回退为下载，这里如实报告而不是判为失败
+            direct_ok = ingest._probe_duration(f"{ranged.base}/video.mp4") is not None
+
+            stores = {}
+            for name, origin in (("range", ranged), ("no-range", plain)):
+                origin.gets = origin.sent = 0
+                work = tmp / name
+                source, _ = ingest.open_source(f"{origin.base}/video.mp4", work)
+                direct = is_url(source)
+                if direct:
+                    # 只统计提取阶段（open_source 中 ffprobe 读头部的请求不计）
+                    origin.gets = origin.sent = 0
+                store = extract_frames(source, work / "frames", args.fps, 0, None, 10000)
+                stores[name] = store
+                ratio = origin.sent / len(data)
+                detail = f"{len(store)} frames, {origin.gets} GET, {ratio:.2f}x file size"
+                if name == "range" and not direct_ok:
+                    print(f"SKIP range origin: direct read  (ffprobe could not read {origin.base}/video.mp4; "
+                          f"open_source downloaded instead: {detail})")
+                elif name == "range":
+                    check(direct and origin.gets <= 2 and ratio <= args.max_transfer, "range origin: direct read", detail)
+                else:
+                    check(not direct and origin.gets == 1, "no-range origin: single download", detail)
+            a, b = stores["range"], stores["no-range"]
+            check(len(a) == len(b) and all((a[i] == b[i]).all() for i in range(len(a))),
+                  "direct read and download give identical frames")
+        finally:
+            for origin in (ranged, plain, *no_head):
+                origin.shutdown()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
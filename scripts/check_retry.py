@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+任务重试自检（fakeredis，进程内 SimpleWorker，不需要 Redis / ffmpeg）：
+
+- run_worker.py 的 rq worker 命令行带 --with-scheduler（带间隔的重试依赖调度器放回队列）；
+- 瞬时错误（OSError）的任务进入 scheduled，调度器到期后放回队列，第二次执行成功；
+- 非瞬时错误（ValueError）直接失败，不重试。
+
+需要 fakeredis[lua]（rq 调度器的锁用 Lua 脚本实现；见 backend/requirements-dev.txt）。
+
+    python scripts/check_retry.py
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_attempts: dict[str, int] = {}
+
+
+def flaky(key: str, error: str) -> str:
+    """第一次执行抛出 error 类型的异常，之后成功"""
+    _attempts[key] = _attempts.get(key, 0) + 1
+    if _attempts[key] == 1:
+        raise {"OSError": OSError, "ValueError": ValueError}[error](f"{key}: attempt 1")
+    return f"{key}: attempt {_attempts[key]}"
+
+
+def main() -> int:
+    import fakeredis
+    from rq.job import JobStatus
+    from rq.worker import SimpleWorker
+
+    import run_worker
+    from worker import tasks
+
+    failures = []
+
+    def check(ok: bool, name: str, detail: str = "") -> None:
+        print(f"{'OK  ' if ok else 'FAIL'} {name}" + (f"  ({detail})" if detail else ""))
+        if not ok:
+            failures.append(name)
+
+    argv = run_worker.worker_argv(preload=True)
+    check("--with-scheduler" in argv, "rq worker runs the scheduler", " ".join(argv[2:]))
+
+    conn = fakeredis.FakeRedis()
+    tasks.get_connection = lambda: conn
+    tasks.JOB_RETRY_INTERVALS = [1]
+    func = f"{__name__}.flaky"
+    queue = tasks.get_queue(tasks.QUEUE_SMALL, conn)
+    transient = queue.enqueue(func, "transient", "OSError", retry=tasks._retry())
+    permanent = queue.enqueue(func, "permanent", "ValueError", retry=tasks._retry())
+
+    def work() -> None:
+        worker = SimpleWorker(
+            [queue], connection=conn,
+            exception_handlers=[tasks.retry_transient_only],
+        )
+        worker.work(burst=True, with_scheduler=True)
+
+    work()
+    check(transient.get_status(refresh=True) == JobStatus.SCHEDULED, "transient failure is scheduled for retry",
+          str(transient.get_status()))
+    check(permanent.get_status(refresh=True) == JobStatus.FAILED and _attempts.get("permanent") == 1,
+          "non-transient failure is not retried", f"{permanent.get_status()}, attempts={_attempts.get('permanent')}")
+
+    deadline = time.time() + 10
+    while transient.get_status(refresh=True) != JobStatus.FINISHED and time.time() < deadline:
+        time.sleep(0.5)
+        work()
+    check(transient.get_status() == JobStatus.FINISHED and _attempts.get("transient") == 2,
+          "scheduler re-enqueues the retry and the second attempt succeeds",
+          f"{transient.get_status()}, attempts={_attempts.get('transient')}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
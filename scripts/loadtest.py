@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+API 压测：多个虚拟用户并发执行 提交任务 → 轮询状态 → 下载结果，并按比例穿插 /matte 抠图请求。
+输出各端点 p50/p95/p99 延迟、错误率、事件循环延迟与 API 进程内存，用于评估 API 副本数、发现阻塞事件循环的回归。
+
+默认进程内运行：httpx.AsyncClient 经 ASGITransport 直连 FastAPI 应用，Redis 由 fakeredis 代替，
+桩 worker（RQ SimpleWorker 线程）按配置的耗时模拟处理并写出结果文件；/matte 的抠图同样以固定耗时模拟。
+应用与压测客户端共享同一事件循环，接口中的同步阻塞会直接体现为延迟与事件循环滞后
+（桩 worker 线程同样争用 GIL，绝对值偏高，宜与基线对比看回归）。
+
+    python scripts/loadtest.py                                  # 20 用户，60 秒
+    python scripts/loadtest.py --users 100 --duration 120 --job-sec 2 8 --workers 8
+    python scripts/loadtest.py --redis-url redis://localhost:6379/15   # 本地 Redis 代替 fakeredis
+    python scripts/loadtest.py --base-url http://api:8000 --api-pid 1234  # 压已部署的 API（需真实 worker）
+
+进程内运行需要 fakeredis（见 backend/requirements-dev.txt：pip install -r backend/requirements-dev.txt）；
+--redis-url / --base-url 模式不需要。
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 桩 worker 的处理耗时区间（秒），由 --job-sec 设置
+_job_sec = (1.0, 3.0)
+
+
+def _png_bytes(w: int, h: int) -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGBA", (w, h), (255, 0, 0, 128)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _sample_video() -> bytes:
+    """2 秒测试视频（API 上传时会探测，需是可解析的视频）；无 ffmpeg 时退化为随机字节"""
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "clip.mp4")
+        cmd = ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=320x180:rate=12", "-t", "2", path]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+            return Path(path).read_bytes()
+        except (OSError, subprocess.CalledProcessError):
+            return os.urandom(64 * 1024)
+
+
+def stub_pipeline(
+    job_id: str,
+    video_path: str,
+    output_base: str,
+    temp_base: str,
+    params: dict,
+    video_info: Optional[dict] = None
+) -> dict:
+    """替代 worker.processor.run_pipeline：等待模拟耗时后写出 sprite.png 与 index.json"""
+    time.sleep(random.uniform(*_job_sec))
+    tw, th = params["target_size"]["w"], params["target_size"]["h"]
+    columns, frames = params["columns"], min(params["max_frames"], 24)
+    rows = -(-frames // columns)
+    out = Path(output_base) / job_id
+    out.mkdir(parents=True, exist_ok=True)
+    (out / "sprite.png").write_bytes(_png_bytes(tw * columns, th * rows))
+    index = {
+        "image": {"file": "sprite.png", "format": "png"},
+        "sheet_size": {"w": tw * columns, "h": th * rows},
+        "frames": [
+            {"i": i, "x": (i % columns) * tw, "y": (i // columns) * th, "w": tw, "h": th, "t": i / params["fps"]}
+            for i in range(frames)
+        ],
+    }
+    (out / "index.json").write_text(json.dumps(index), encoding="utf-8")
+    return {"frame_count": frames, "width": tw * columns, "height": th * rows, "output_format": "png"}
+
+
+def _start_stub_workers(count: int, stop: threading.Event) -> list[threading.Thread]:
+    """在线程中运行 RQ SimpleWorker 消费 fakeredis 队列（不 fork、不装信号处理）"""
+    from rq.timeouts import TimerDeathPenalty
+    from rq.worker import SimpleWorker
+    from worker.tasks import DEFAULT_WORKER_QUEUES, get_connection
+
+    class StubWorker(SimpleWorker):
+        death_penalty_class = TimerDeathPenalty
+
+        def _install_signal_handlers(self):
+            pass
+
+    def loop():
+        w = StubWorker(list(DEFAULT_WORKER_QUEUES), connection=get_connection())
+        while not stop.is_set():
+            if not w.work(burst=True, logging_level="WARNING"):
+                stop.wait(0.05)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def _setup_in_process(args) -> tuple:
+    """配置进程内被测应用：临时存储目录、fakeredis（或指定 Redis）、桩 worker 与桩抠图"""
+    global _job_sec
+    work = Path(tempfile.mkdtemp(prefix="pixelwork-loadtest-"))
+    for name in ("UPLOAD_DIR", "OUTPUT_DIR", "TEMP_DIR"):
+        os.environ.setdefault(name, str(work / name.split("_")[0].lower()))
+    os.environ.setdefault("STORAGE_GC_INTERVAL_SEC", "0")
+    os.environ.setdefault("ADMISSION_MIN_FREE_DISK_MB", "0")
+    # 进程内所有虚拟用户同一来源 IP，按 IP 计的客户端配额会把它们当成一个客户端
+    os.environ.setdefault("MAX_ACTIVE_JOBS_PER_CLIENT", "0")
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        import fakeredis
+        import redis
+        server = fakeredis.FakeServer()
+        redis.from_url = lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)
+    sys.path[:0] = [os.path.join(ROOT, "backend"), ROOT]
+
+    import worker.tasks
+    from app import main
+
+    _job_sec = tuple(args.job_sec)
+    worker.tasks.PIPELINE_FUNC = f"{__name__}.stub_pipeline"
+
+    def stub_matte(content: bytes) -> bytes:
+        time.sleep(args.matte_sec)
+        return content
+    main._run_matte_sync = stub_matte
+
+    stop = threading.Event()
+    _start_stub_workers(args.workers, stop)
+    transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+    return transport, "http://loadtest", stop, work
+
+
+class Recorder:
+    """按端点记录延迟与状态码"""
+
+    def __init__(self):
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.status: dict[str, dict] = defaultdict(lambda: defaultdict(int))
+        self.jobs_completed = 0
+        self.job_turnaround: list[float] = []
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        t = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.status[name][type(e).__name__] += 1
+            return None
+        self.latency[name].append(time.perf_counter() - t)
+        self.status[name][resp.status_code] += 1
+        return resp
+
+
+async def virtual_user(client, rec: Recorder, args, video: bytes, image: bytes, deadline: float) -> None:
+    """一个客户端：串行提交任务并轮询至完成，期间按比例调用 /matte"""
+    headers = {"X-Client-Id": f"loadtest-{uuid.uuid4().hex[:8]}"}
+    params = json.dumps({"fps": 12, "max_frames": 24, "columns": 6, "target_size": {"w": 64, "h": 64}})
+    while time.monotonic() < deadline:
+        if random.random() < args.matte_ratio:
+            await rec.request(client, "POST /matte", "POST", "/matte", headers=headers,
+                              files={"file": ("frame.png", image, "image/png")})
+            continue
+        started = time.monotonic()
+        resp = await rec.request(client, "POST /jobs", "POST", "/jobs", headers=headers,
+                                 files={"file": ("clip.mp4", video, "video/mp4")}, data={"params": params})
+        if resp is None or resp.status_code != 200:
+            await asyncio.sleep(float(resp.headers.get("retry-after", 1)) if resp is not None else 1)
+            continue
+        job_id = resp.json()["job_id"]
+        status = "queued"
+        while status in ("queued", "processing") and time.monotonic() < deadline + args.drain_sec:
+            await asyncio.sleep(args.poll_interval)
+            resp = await rec.request(client, "GET /jobs/{id}", "GET", f"/jobs/{job_id}", headers=headers)
+            if resp is not None and resp.status_code == 200:
+                status = resp.json()["status"]
+        if status == "completed":
+            rec.jobs_completed += 1
+            rec.job_turnaround.append(time.monotonic() - started)
+            await rec.request(client, "GET /jobs/{id}/result", "GET", f"/jobs/{job_id}/result", headers=headers)
+
+
+async def loop_lag(samples: list[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    """事件循环滞后：定时器实际唤醒时间超出预期的部分"""
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - t - interval)
+
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """进程常驻内存（Linux /proc）"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def memory_sampler(samples: list[float], stop: asyncio.Event, pid: Optional[int]) -> None:
+    while not stop.is_set():
+        value = rss_mb(pid)
+        if value is not None:
+            samples.append(value)
+        await asyncio.sleep(0.5)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """最近秩百分位"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def summarize(rec: Recorder, elapsed: float, lag: list[float], memory: list[float], in_process: bool) -> dict:
+    endpoints = {}
+    for name in sorted(rec.status):
+        lat = rec.latency[name]
+        total = sum(rec.status[name].values())
+        errors = sum(n for code, n in rec.status[name].items() if not (isinstance(code, int) and code < 400))
+        endpoints[name] = {
+            "requests": total,
+            "rps": round(total / elapsed, 1),
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "status": {str(code): n for code, n in sorted(rec.status[name].items(), key=lambda kv: str(kv[0]))},
+            **({
+                f"p{p}_ms": round(percentile(lat, p) * 1000, 1) for p in (50, 95, 99)
+            } if lat else {}),
+            "max_ms": round(max(lat) * 1000, 1) if lat else None,
+        }
+    return {
+        "elapsed_sec": round(elapsed, 1),
+        "jobs_completed": rec.jobs_completed,
+        "job_turnaround_p50_sec": round(statistics.median(rec.job_turnaround), 2) if rec.job_turnaround else None,
+        "endpoints": endpoints,
+        "event_loop_lag_ms": {
+            "p99": round(percentile(lag, 99) * 1000, 1), "max": round(max(lag) * 1000, 1)
+        } if lag else None,
+        "memory_mb": {
+            "scope": "loadtest process (app + client)" if in_process else "api process",
+            "start": round(memory[0], 1), "peak": round(max(memory), 1), "end": round(memory[-1], 1),
+        } if memory else None,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['elapsed_sec']}s, {report['jobs_completed']} jobs completed"
+          + (f", turnaround p50 {report['job_turnaround_p50_sec']}s" if report["job_turnaround_p50_sec"] else ""))
+    print(f"{'endpoint':<24}{'reqs':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  status")
+    for name, e in report["endpoints"].items():
+        cols = [e.get(k) for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{name:<24}{e['requests']:>7}{e['rps']:>8}{e['error_rate'] * 100:>7.1f}"
+              + "".join(f"{c:>9}" if c is not None else f"{'-':>9}" for c in cols)
+              + "  " + " ".join(f"{k}:{v}" for k, v in e["status"].items()))
+    if report["event_loop_lag_ms"]:
+        lag = report["event_loop_lag_ms"]
+        print(f"event loop lag: p99 {lag['p99']} ms, max {lag['max']} ms")
+    if report["memory_mb"]:
+        m = report["memory_mb"]
+        print(f"memory ({m['scope']}): start {m['start']} MB, peak {m['peak']} MB, end {m['end']} MB")
+
+
+async def run(args) -> dict:
+    in_process = not args.base_url
+    if in_process:
+        transport, base_url, stop_workers, work_dir = _setup_in_process(args)
+    else:
+        transport, base_url, stop_workers, work_dir = None, args.base_url, None, None
+
+    video = Path(args.video).read_bytes() if args.video else _sample_video()
+    image = _png_bytes(256, 256)
+    rec = Recorder()
+    lag: list[float] = []
+    memory: list[float] = []
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.users * 2)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        monitors = [asyncio.create_task(memory_sampler(memory, stop, None if in_process else args.api_pid))]
+        if in_process:
+            monitors.append(asyncio.create_task(loop_lag(lag, stop)))
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(virtual_user(client, rec, args, video, image, deadline) for _ in range(args.users)))
+        elapsed = time.monotonic() - started
+        stop.set()
+        await asyncio.gather(*monitors)
+    if stop_workers:
+        stop_workers.set()
+    if work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not in_process and not args.api_pid:
+        memory = []
+    return summarize(rec, elapsed, lag, memory, in_process)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=60, help="提交新请求的时长（秒）")
+    parser.add_argument("--drain-sec", type=float, default=30, help="时长结束后等待在途任务完成的上限（秒）")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="状态轮询间隔（秒）")
+    parser.add_argument("--matte-ratio", type=float, default=0.2, help="每轮改为调用 /matte 的概率")
+    parser.add_argument("--timeout", type=float, default=30, help="单个请求超时（秒）")
+    parser.add_argument("--video", help="上传的视频文件；默认用 ffmpeg 生成 2 秒测试视频")
+    parser.add_argument("--job-sec", type=float, nargs=2, default=[1.0, 3.0], metavar=("MIN", "MAX"),
+                        help="桩 worker 单任务处理耗时区间（秒）")
+    parser.add_argument("--matte-sec", type=float, default=0.2, help="桩抠图耗时（秒）")
+    parser.add_argument("--workers", type=int, default=4, help="桩 worker 线程数")
+    parser.add_argument("--redis-url", help="使用该 Redis 代替 fakeredis（建议用空库）")
+    parser.add_argument("--base-url", help="压测已运行的 API，而非进程内应用")
+    parser.add_argument("--api-pid", type=int, help="--base-url 时采样该 API 进程的内存")
+    parser.add_argument("--json", help="报告另存为 JSON 文件")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
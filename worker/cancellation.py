@@ -0,0 +1,115 @@
+"""
+协作式取消：API 写入 Redis 取消标记，管线在帧 / 批次之间检查并主动退出。
+无 Redis 的同步模式下退化为进程内标记。
+"""
+import os
+import subprocess
+import time
+from typing import Callable, Optional
+
+from .profiling import track_subprocess
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CANCEL_TTL_SEC = 24 * 3600
+# Redis 连接失败后的静默期：期间只看进程内标记，不再每帧尝试连接
+REDIS_RETRY_SEC = 30
+
+# 进程内取消标记 {job_id: 标记时间}；任务结束时由 clear_cancel 移除，漏掉的按 CANCEL_TTL_SEC 过期
+_local_cancels: dict[str, float] = {}
+_conn = None
+_redis_retry_at = 0.0
+
+
+class JobCanceled(Exception):
+    """任务已被取消"""
+
+
+def _cancel_key(job_id: str) -> str:
+    return f"pixelwork:cancel:{job_id}"
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        import redis
+        _conn = redis.from_url(REDIS_URL)
+    return _conn
+
+
+def _redis_call(fn: Callable, default=None):
+    """执行一次 Redis 操作；失败后 REDIS_RETRY_SEC 内直接返回 default（无 Redis 的同步模式不再逐帧连接）"""
+    global _redis_retry_at
+    if time.monotonic() < _redis_retry_at:
+        return default
+    try:
+        return fn(_get_conn())
+    except Exception:
+        _redis_retry_at = time.monotonic() + REDIS_RETRY_SEC
+        return default
+
+
+def request_cancel(job_id: str) -> None:
+    """标记任务取消（进程内 + Redis，后者失败时忽略）"""
+    now = time.monotonic()
+    for jid, at in list(_local_cancels.items()):
+        if now - at > CANCEL_TTL_SEC:
+            _local_cancels.pop(jid, None)
+    _local_cancels[job_id] = now
+    _redis_call(lambda conn: conn.set(_cancel_key(job_id), 1, ex=CANCEL_TTL_SEC))
+
+
+def clear_cancel(job_id: str) -> None:
+    """任务结束后移除进程内取消标记（Redis 标记按 TTL 过期）"""
+    _local_cancels.pop(job_id, None)
+
+
+def is_canceled(job_id: str) -> bool:
+    """任务是否已被请求取消"""
+    if job_id in _local_cancels:
+        return True
+    return bool(_redis_call(lambda conn: conn.exists(_cancel_key(job_id)), False))
+
+
+def canceller(job_id: str) -> Callable[[], None]:
+    """返回检查函数，已取消时抛 JobCanceled，供管线在帧间调用"""
+    def check() -> None:
+        if is_canceled(job_id):
+            raise JobCanceled(job_id)
+    return check
+
+
+def run_cancellable(
+    cmd: list[str],
+    check_cancel: Optional[Callable[[], None]] = None,
+    check: bool = False,
+    poll_interval: float = 0.5,
+) -> subprocess.CompletedProcess:
+    """
+    运行子进程（捕获 stdout/stderr），等待期间定期检查取消；
+    取消时立即 kill 子进程（如 ffmpeg）再抛出 JobCanceled。
+    """
+    with track_subprocess(cmd):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while True:
+                try:
+                    stdout, stderr = proc.communicate(timeout=poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    if check_cancel:
+                        check_cancel()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def discard_job_files(job_id: str, *dirs) -> None:
+    """取消后清理该任务的目录；只删除以 job_id 命名的目录，避免误删共享路径"""
+    import shutil
+    for d in dirs:
+        if d is not None and d.name == job_id and d.exists():
+            shutil.rmtree(d, ignore_errors=True)
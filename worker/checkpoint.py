@@ -0,0 +1,64 @@
+"""
+断点续跑：在 TEMP_DIR/<job_id>/manifest.json 记录已完成的帧区间。
+worker 崩溃或超时后 RQ 重试同一任务，管线从最近的检查点继续。
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+MANIFEST_NAME = "manifest.json"
+
+
+def fingerprint(*parts: Any) -> str:
+    """输入指纹：视频路径、大小、参数等任一变化则检查点作废"""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def load_manifest(work_dir: Path, fp: str) -> dict:
+    """读取检查点；不存在、损坏或指纹不符时返回空 dict"""
+    path = work_dir / MANIFEST_NAME
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("fingerprint") != fp:
+        return {}
+    return data
+
+
+def manifest_progress(work_dir: Path) -> Optional[int]:
+    """按检查点估算序列帧任务进度（已后处理帧 / 提取帧，0~99）；尚无检查点时返回 None"""
+    try:
+        with open(work_dir / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    extracted = data.get("extracted") or 0
+    if not extracted:
+        return None
+    return min(99, int(99 * (data.get("processed") or 0) / extracted))
+
+
+def save_manifest(work_dir: Path, fp: str, data: dict) -> None:
+    """原子写入检查点，崩溃时不会留下半截 manifest"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    path = work_dir / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**data, "fingerprint": fp}, f)
+    os.replace(tmp, path)
+
+
+def clear_manifest(work_dir: Path) -> None:
+    """任务完成后删除检查点"""
+    (work_dir / MANIFEST_NAME).unlink(missing_ok=True)
+
+
+def source_fingerprint(video_path: Path, *extra: Any) -> str:
+    """以视频路径、大小与修改时间加上额外参数生成指纹"""
+    st = video_path.stat()
+    return fingerprint(str(video_path), st.st_size, st.st_mtime_ns, *extra)
@@ -0,0 +1,94 @@
+"""
+帧存储：每个任务每个阶段一个定长内存映射数组文件（.npy），外加一份索引（.json）
+记录时间戳、alpha bbox 与去重 id。
+
+取代逐帧 PNG：阶段之间、进程之间直接读写切片，没有逐文件的文件系统开销与 PNG 编解码。
+.npy 头部自带 shape/dtype，其他进程用 FrameStore.open 以 r+ 打开即可并行写不同下标。
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from PIL import Image
+
+
+class FrameStore:
+    """定长帧数组（N, H, W, C）uint8 + 索引"""
+
+    def __init__(self, array: np.ndarray, meta_path: Path, meta: dict):
+        self.array = array
+        self.meta_path = meta_path
+        self.meta = meta
+
+    @classmethod
+    def create(cls, directory: Path, name: str, count: int, height: int, width: int, channels: int) -> "FrameStore":
+        """新建（覆盖）存储文件"""
+        directory.mkdir(parents=True, exist_ok=True)
+        array = np.lib.format.open_memmap(
+            directory / f"{name}.npy", mode="w+", dtype=np.uint8, shape=(count, height, width, channels)
+        )
+        meta = {"t": [0.0] * count, "bbox": [None] * count, "dedup": list(range(count))}
+        store = cls(array, directory / f"{name}.json", meta)
+        store.save_meta()
+        return store
+
+    @classmethod
+    def open(cls, directory: Path, name: str, mode: str = "r+") -> Optional["FrameStore"]:
+        """打开已有存储；不存在或损坏时返回 None"""
+        try:
+            array = np.lib.format.open_memmap(directory / f"{name}.npy", mode=mode)
+            with open(directory / f"{name}.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(array, directory / f"{name}.json", meta)
+
+    def __len__(self) -> int:
+        return self.array.shape[0]
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """第 i 帧（内存映射视图，不拷贝）"""
+        return self.array[i]
+
+    @property
+    def frame_size(self) -> tuple[int, int]:
+        """(w, h)"""
+        return self.array.shape[2], self.array.shape[1]
+
+    def write(self, i: int, frame: Any) -> None:
+        """写入第 i 帧；接受 ndarray 或 PIL Image，尺寸须与存储一致"""
+        self.array[i] = np.asarray(frame, dtype=np.uint8).reshape(self.array.shape[1:])
+
+    def write_batch(self, start: int, frames: np.ndarray) -> None:
+        """从 start 起连续写入一批帧 (n, H, W, C)"""
+        self.array[start:start + len(frames)] = frames
+
+    def image(self, i: int) -> Image.Image:
+        """第 i 帧的 PIL 视图"""
+        return Image.fromarray(self.array[i])
+
+    def digest(self, i: int) -> str:
+        """帧内容摘要，用于去重"""
+        return hashlib.blake2b(self.array[i].tobytes(), digest_size=16).hexdigest()
+
+    def flush(self) -> None:
+        """落盘（检查点前调用）"""
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+        self.save_meta()
+
+    def save_meta(self) -> None:
+        tmp = self.meta_path.with_name(self.meta_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def remove(self) -> None:
+        """删除存储文件"""
+        array_path = self.meta_path.with_suffix(".npy")
+        self.array = None
+        array_path.unlink(missing_ok=True)
+        self.meta_path.unlink(missing_ok=True)
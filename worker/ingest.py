@@ -0,0 +1,190 @@
+"""
+URL 取源：worker 用连接池化的 httpx 客户端拉取视频，边传输边检查大小与时长上限。
+
+- 主机在 URL_ALLOWED_HOSTS 内且服务器支持 Range 时不落盘，ffprobe / ffmpeg 直接读取 URL，按需取字节，
+  解码与传输重叠（先用 ffprobe 读取头部检查时长，超限时不传输正文）；
+- 否则流式下载到 temp_base/job_id/，超过大小上限立即中断，下载后再检查时长。
+长度与是否支持 Range 先用 HEAD 取得，源站拒绝 HEAD 时改用 Range: bytes=0-0 的 GET。
+
+防 SSRF：不在允许列表内的主机须解析为公网地址（拒绝私有、回环、链路本地等地址），
+重定向不自动跟随，每一跳重新校验；ffmpeg 自身会跟随重定向，故只对允许列表内的主机直接读取。
+"""
+import ipaddress
+import json
+import os
+import socket
+import subprocess
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from .probe import input_args
+from .profiling import track_subprocess
+
+MAX_DOWNLOAD_MB = int(os.getenv("MAX_DOWNLOAD_MB", os.getenv("MAX_UPLOAD_SIZE_MB", "200")))
+MAX_VIDEO_DURATION_SEC = int(os.getenv("MAX_VIDEO_DURATION_SEC", "300"))
+# 受信任的源站主机名（逗号分隔）：跳过地址检查，支持 Range 时允许 ffmpeg 直接读取
+URL_ALLOWED_HOSTS = {h.strip().lower() for h in os.getenv("URL_ALLOWED_HOSTS", "").split(",") if h.strip()}
+# 置 0 时总是先下载（例如源站 Range 实现不可靠）
+INGEST_DIRECT_READ = os.getenv("INGEST_DIRECT_READ", "1") == "1"
+INGEST_PROBE_TIMEOUT_SEC = 30
+MAX_REDIRECTS = 5
+_CHUNK_SIZE = 1024 * 1024
+
+_client: Optional[httpx.Client] = None
+
+
+def _is_public(addr: str) -> bool:
+    ip = ipaddress.ip_address(addr.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def is_trusted_host(url: str) -> bool:
+    return (urlparse(url).hostname or "").lower() in URL_ALLOWED_HOSTS
+
+
+def check_url(url: str) -> None:
+    """
+    校验取源 URL：仅 http(s)；主机不在 URL_ALLOWED_HOSTS 内时，其解析出的所有地址都须为公网地址。
+    不合法时抛 ValueError（消息可直接返回给客户端）。
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("URL 仅支持 http / https")
+    if is_trusted_host(url):
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addrs = {ai[4][0] for ai in socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError):
+        raise ValueError("URL 主机无法解析")
+    if not addrs or not all(_is_public(a) for a in addrs):
+        raise ValueError("URL 指向内部地址，不允许取源")
+
+
+def get_client() -> httpx.Client:
+    """进程内共享的连接池客户端，同一源站的多个任务复用 keep-alive 连接；重定向由 _send 逐跳校验"""
+    global _client
+    if _client is None:
+        _client = httpx.Client(
+            follow_redirects=False,
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+        )
+    return _client
+
+
+def _send(method: str, url: str, headers: Optional[dict] = None) -> tuple[str, httpx.Response]:
+    """
+    发送请求（正文未读取，调用方负责关闭），手动跟随重定向，每一跳都经 check_url 校验。
+    返回 (最终 URL, 响应)。
+    """
+    client = get_client()
+    for _ in range(MAX_REDIRECTS + 1):
+        check_url(url)
+        resp = client.send(client.build_request(method, url, headers=headers), stream=True)
+        if not resp.is_redirect:
+            return url, resp
+        resp.close()
+        url = urljoin(url, resp.headers["location"])
+    raise ValueError(f"Too many redirects (>{MAX_REDIRECTS})")
+
+
+def _probe_duration(url: str) -> Optional[float]:
+    """ffprobe 只读容器头部；读不出（如 moov 在文件尾且不支持 Range）时返回 None"""
+    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", *input_args(url)]
+    try:
+        with track_subprocess(cmd):
+            out = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=INGEST_PROBE_TIMEOUT_SEC).stdout
+        return float(json.loads(out)["format"]["duration"])
+    except (OSError, ValueError, KeyError, subprocess.SubprocessError):
+        return None
+
+
+def _stat_remote(url: str) -> tuple[str, int, bool, httpx.Headers]:
+    """
+    取远端文件的 (最终 URL, 长度, 是否支持 Range, 响应头)，长度未知时为 0。
+    先发 HEAD；源站拒绝 HEAD（如 403 / 405）时改发 Range: bytes=0-0 的 GET，
+    206 即支持 Range，长度取自 Content-Range 的总长。
+    """
+    final_url, head = _send("HEAD", url)
+    head.close()
+    if head.is_success:
+        length = int(head.headers.get("content-length") or 0)
+        return final_url, length, head.headers.get("accept-ranges", "").lower() == "bytes" and length > 0, head.headers
+
+    final_url, resp = _send("GET", url, headers={"Range": "bytes=0-0"})
+    resp.close()
+    resp.raise_for_status()
+    if resp.status_code == 206:
+        total = resp.headers.get("content-range", "").rpartition("/")[2]
+        length = int(total) if total.isdigit() else 0
+        return final_url, length, length > 0, resp.headers
+    # 忽略 Range 返回整个文件：正文未读取即关闭，长度取 Content-Length
+    return final_url, int(resp.headers.get("content-length") or 0), False, resp.headers
+
+
+def _check_duration(duration: Optional[float]) -> None:
+    if duration is not None and MAX_VIDEO_DURATION_SEC and duration > MAX_VIDEO_DURATION_SEC:
+        raise ValueError(f"Video too long: {duration:.1f}s > {MAX_VIDEO_DURATION_SEC}s")
+
+
+def _download(url: str, dest: Path, max_bytes: int, check_cancel: Optional[Callable[[], None]]) -> Path:
+    """流式下载到 dest，超过 max_bytes 中断；先写 .part 再改名，重试时不会拿到半截文件"""
+    part = dest.with_name(dest.name + ".part")
+    received = 0
+    _, resp = _send("GET", url)
+    try:
+        resp.raise_for_status()
+        with open(part, "wb") as f:
+            for chunk in resp.iter_bytes(_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ValueError(f"Source exceeds {max_bytes // (1024 * 1024)}MB")
+                f.write(chunk)
+                if check_cancel:
+                    check_cancel()
+    finally:
+        resp.close()
+    os.replace(part, dest)
+    return dest
+
+
+def open_source(
+    url: str,
+    work_dir: Path,
+    check_cancel: Optional[Callable[[], None]] = None,
+    duration: Optional[float] = None
+) -> tuple[str, str]:
+    """
+    准备可供 ffmpeg 读取的输入，返回 (输入路径或 URL, 版本标识)。
+    版本标识取 ETag / Last-Modified / 长度，远端文件变化时检查点随之失效。
+    duration: 入队时已探测到的时长，给定时不再探测。
+    """
+    max_bytes = MAX_DOWNLOAD_MB * 1024 * 1024
+    final_url, length, ranged, headers = _stat_remote(url)
+    if length > max_bytes:
+        raise ValueError(f"Source exceeds {MAX_DOWNLOAD_MB}MB")
+    version = headers.get("etag") or headers.get("last-modified") or str(length)
+
+    if INGEST_DIRECT_READ and ranged and is_trusted_host(final_url):
+        if not duration:
+            duration = _probe_duration(final_url)
+        _check_duration(duration)
+        if duration is not None:
+            return final_url, version
+    else:
+        _check_duration(duration)
+
+    suffix = Path(urlparse(final_url).path).suffix.lower() or ".mp4"
+    dest = work_dir / f"source{suffix}"
+    if not dest.exists():
+        work_dir.mkdir(parents=True, exist_ok=True)
+        _download(final_url, dest, max_bytes, check_cancel)
+    if duration is None:
+        _check_duration(_probe_duration(str(dest)))
+    return str(dest), version
@@ -0,0 +1,133 @@
+"""
+批量后处理：对一批抠图后的 RGBA 帧（N, H, W, 4）统一计算 alpha bbox、裁剪、缩放并居中到目标画布。
+
+- bbox 一次向量化求出，不再逐帧 getbbox；
+- crop_mode=union_bbox 时整段使用同一个裁剪框，角色不会逐帧抖动；
+- 裁剪框相同的帧归为一组，预乘、缩放与合成按组向量化完成。
+
+缩放在预乘 alpha 空间进行（与 PIL 对 RGBA 的处理一致，避免边缘发黑的色晕）；
+粘贴沿用 Image.paste(img, pos, img) 的语义：所有通道按 alpha 与底色混合。
+"""
+from typing import Optional
+
+import cv2
+import numpy as np
+
+BBox = tuple[int, int, int, int]
+
+
+def alpha_bboxes(stack: np.ndarray) -> list[Optional[BBox]]:
+    """一批帧的 alpha 非空边界框 (x1, y1, x2, y2)，语义同 PIL getbbox；全透明帧为 None"""
+    alpha = stack[..., 3] > 0
+    rows = alpha.any(axis=2)
+    cols = alpha.any(axis=1)
+    has = rows.any(axis=1)
+    h, w = alpha.shape[1:]
+    y1 = rows.argmax(axis=1)
+    y2 = h - rows[:, ::-1].argmax(axis=1)
+    x1 = cols.argmax(axis=1)
+    x2 = w - cols[:, ::-1].argmax(axis=1)
+    return [
+        (int(x1[k]), int(y1[k]), int(x2[k]), int(y2[k])) if has[k] else None
+        for k in range(len(stack))
+    ]
+
+
+def union_bbox(bboxes: list[Optional[BBox]]) -> Optional[BBox]:
+    """多个 bbox 的并集"""
+    boxes = [b for b in bboxes if b]
+    if not boxes:
+        return None
+    arr = np.array(boxes)
+    return int(arr[:, 0].min()), int(arr[:, 1].min()), int(arr[:, 2].max()), int(arr[:, 3].max())
+
+
+def crop_box(bbox: Optional[BBox], crop_mode: str, padding: int, width: int, height: int) -> BBox:
+    """按 crop_mode 得到裁剪框；none 或无 bbox 时为整帧"""
+    if not bbox or crop_mode == "none":
+        return 0, 0, width, height
+    pad = padding if crop_mode in ("safe_bbox", "union_bbox") else 0
+    return (
+        max(0, bbox[0] - pad),
+        max(0, bbox[1] - pad),
+        min(width, bbox[2] + pad),
+        min(height, bbox[3] + pad),
+    )
+
+
+def _fit_size(w: int, h: int, max_w: int, max_h: int) -> tuple[int, int]:
+    """等比缩小到不超过 (max_w, max_h)，不放大（同 PIL thumbnail）"""
+    scale = min(1.0, max_w / w, max_h / h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def _premultiply(rgba: np.ndarray) -> np.ndarray:
+    out = rgba.copy()
+    a = rgba[..., 3:4].astype(np.uint16)
+    out[..., :3] = ((rgba[..., :3].astype(np.uint16) * a + 127) // 255).astype(np.uint8)
+    return out
+
+
+def _resize_batch(crops: np.ndarray, size: tuple[int, int]) -> np.ndarray:
+    """同尺寸的一批 (N, h, w, 4) 缩放到 size；只缩小，用 INTER_AREA"""
+    n, h, w, c = crops.shape
+    if (w, h) == size:
+        return crops
+    out = np.empty((n, size[1], size[0], c), dtype=np.uint8)
+    for k in range(n):
+        # INTER_AREA 缩小只支持 ≤4 通道，不能沿通道维拼接多帧，逐帧调用
+        out[k] = cv2.resize(crops[k], size, interpolation=cv2.INTER_AREA)
+    return out
+
+
+def _composite(canvases: np.ndarray, premul: np.ndarray, x: int, y: int) -> np.ndarray:
+    """按 Image.paste(img, pos, img) 语义，把一批预乘后的图合成到画布上，返回合成后的画布"""
+    h, w = premul.shape[1:3]
+    out = canvases.copy()
+    region = canvases[:, y:y + h, x:x + w].astype(np.uint16)
+    a = premul[..., 3:4].astype(np.uint16)
+    inv = 255 - a
+    rgb = premul[..., :3].astype(np.uint16) + (region[..., :3] * inv + 127) // 255
+    alpha = (a * a + 127) // 255 + (region[..., 3:4] * inv + 127) // 255
+    out[:, y:y + h, x:x + w, :3] = np.minimum(rgb, 255).astype(np.uint8)
+    out[:, y:y + h, x:x + w, 3:4] = np.minimum(alpha, 255).astype(np.uint8)
+    return out
+
+
+def postprocess_batch(
+    stack: np.ndarray,
+    target_w: int,
+    target_h: int,
+    padding: int,
+    bg_rgba: tuple[int, int, int, int],
+    crop_mode: str,
+    bboxes: Optional[list[Optional[BBox]]] = None,
+    fixed_box: Optional[BBox] = None
+) -> np.ndarray:
+    """
+    裁剪、缩放并居中一批 RGBA 帧，返回 (N, target_h, target_w, 4)。
+    fixed_box: 整批共用的裁剪框（union_bbox 时由调用方对全片求并集后传入）。
+    """
+    n, height, width = stack.shape[:3]
+    if bboxes is None and fixed_box is None and crop_mode != "none":
+        bboxes = alpha_bboxes(stack)
+    if fixed_box is not None:
+        boxes = [fixed_box] * n
+    else:
+        boxes = [crop_box(bboxes[k] if bboxes else None, crop_mode, padding, width, height) for k in range(n)]
+
+    out = np.empty((n, target_h, target_w, 4), dtype=np.uint8)
+    out[:] = bg_rgba
+    max_w, max_h = max(1, target_w - padding * 2), max(1, target_h - padding * 2)
+
+    # 裁剪框相同的帧归为一组，整组一次缩放
+    groups: dict[BBox, list[int]] = {}
+    for k, box in enumerate(boxes):
+        groups.setdefault(box, []).append(k)
+    for (x1, y1, x2, y2), idx in groups.items():
+        crops = _premultiply(stack[idx, y1:y2, x1:x2])
+        size = _fit_size(x2 - x1, y2 - y1, max_w, max_h)
+        resized = _resize_batch(crops, size)
+        px, py = (target_w - size[0]) // 2, (target_h - size[1]) // 2
+        out[idx] = _composite(out[idx], resized, px, py)
+    return out
@@ -0,0 +1,157 @@
+"""
+视频探测（ffprobe），只依赖标准库（缓存的 redis 按需导入），API 与任务入队时可直接导入。
+
+上传时由 API 探测一次，结果按内容摘要缓存（Redis，多 API 副本与 worker 共享；无 Redis 时退化为进程内缓存），
+并随任务参数传给 worker，worker 不再重复探测。
+"""
+import hashlib
+import json
+import os
+import subprocess
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import urlparse
+
+from .profiling import track_subprocess
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# 探测结果缓存有效期（秒），0 关闭缓存
+PROBE_CACHE_TTL = int(os.getenv("PROBE_CACHE_TTL", str(30 * 24 * 3600)))
+# get_video_info 返回字段变化时递增，旧缓存随之失效
+_PROBE_CACHE_VERSION = 1
+_LOCAL_CACHE_MAX = 1024
+
+# URL 输入只允许网络协议：防止 HLS / concat 播放列表让 ffmpeg 读取 file: 等本地资源
+URL_PROTOCOL_WHITELIST = "http,https,tcp,tls"
+
+_local_infos: dict[str, dict] = {}
+_conn = None
+
+
+def is_url(source: Union[Path, str]) -> bool:
+    return urlparse(str(source)).scheme in ("http", "https")
+
+
+def input_args(source: Union[Path, str]) -> list[str]:
+    """ffmpeg / ffprobe 的输入参数；URL 输入附加协议白名单"""
+    if is_url(source):
+        return ["-protocol_whitelist", URL_PROTOCOL_WHITELIST, "-i", str(source)]
+    return ["-i", str(source)]
+
+
+def _stream_rotation(stream: dict) -> int:
+    """视频流的旋转角度（tags.rotate 或 Display Matrix side data）"""
+    try:
+        rotate = stream.get("tags", {}).get("rotate")
+        if rotate is not None:
+            return int(float(rotate)) % 360
+        for side in stream.get("side_data_list", []):
+            if "rotation" in side:
+                return int(float(side["rotation"])) % 360
+    except (TypeError, ValueError):
+        pass
+    return 0
+
+
+def get_video_info(video_path: Union[Path, str]) -> dict:
+    """使用 ffprobe 获取视频信息"""
+    cmd = [
+        "ffprobe",
+        "-v", "quiet",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        *input_args(video_path)
+    ]
+    with track_subprocess(cmd):
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+    
+    duration = 0
+    width, height = 0, 0
+    fps = 30
+    
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video":
+            width = int(stream.get("width", 0))
+            height = int(stream.get("height", 0))
+            if "r_frame_rate" in stream:
+                num, den = map(int, stream["r_frame_rate"].split("/"))
+                fps = num / den if den else 30
+            # ffmpeg 解码时会自动旋转，宽高以显示方向为准
+            if _stream_rotation(stream) % 180 == 90:
+                width, height = height, width
+            break
+    
+    try:
+        duration = float(data.get("format", {}).get("duration", 0))
+    except (ValueError, KeyError, TypeError):
+        duration = 0
+    
+    return {
+        "duration": duration,
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "frame_count": int(duration * fps) if duration and fps else 0
+    }
+
+
+def content_hasher():
+    """视频内容摘要的哈希对象，可分块 update（与 content_digest 结果一致）"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_digest(data: bytes) -> str:
+    """视频内容摘要，作为探测缓存的键"""
+    hasher = content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        import redis
+        _conn = redis.from_url(REDIS_URL)
+    return _conn
+
+
+def _cache_key(digest: str) -> str:
+    return f"pixelwork:probe:v{_PROBE_CACHE_VERSION}:{digest}"
+
+
+def _load_info(key: str) -> Optional[dict]:
+    info = _local_infos.get(key)
+    if info is not None:
+        return info
+    try:
+        data = _get_conn().get(key)
+    except Exception:
+        return None
+    return json.loads(data) if data else None
+
+
+def _store_info(key: str, info: dict) -> None:
+    if len(_local_infos) >= _LOCAL_CACHE_MAX:
+        _local_infos.pop(next(iter(_local_infos)))
+    _local_infos[key] = info
+    try:
+        _get_conn().set(key, json.dumps(info), ex=PROBE_CACHE_TTL)
+    except Exception:
+        pass
+
+
+def probe_video(video_path: Union[Path, str], digest: Optional[str] = None) -> dict:
+    """
+    带缓存的 get_video_info：给定内容摘要时先查缓存，未命中再调用 ffprobe 并写入。
+    探测失败照常抛出，不缓存。
+    """
+    if not digest or PROBE_CACHE_TTL <= 0:
+        return get_video_info(video_path)
+    key = _cache_key(digest)
+    info = _load_info(key)
+    if info is None:
+        info = get_video_info(video_path)
+        _store_info(key, info)
+    return info
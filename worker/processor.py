@@ -1,78 +1,214 @@
 """视频处理管线：帧提取、抠图、合成"""
 import json
 import math
+import os
 import subprocess
 from pathlib import Path
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Iterator, Optional, Union
 
+import numpy as np
 from PIL import Image
-from rembg import remove
-from rembg.session_factory import new_session
 
-# 预加载 rembg 会话
+from .cancellation import JobCanceled, canceller, discard_job_files, run_cancellable
+from .checkpoint import clear_manifest, fingerprint, load_manifest, save_manifest, source_fingerprint
+from .frame_store import FrameStore
+from .ingest import open_source
+from .probe import get_video_info, input_args, is_url
+from .postprocess import alpha_bboxes, crop_box, postprocess_batch, union_bbox
+from .profiling import job_profile, track_subprocess
+from .results import write_result_zip
+from .sizing import store_frame_size
+from .threads import ffmpeg_threads
+
+# rembg 会话（rembg / onnxruntime 导入较重，首次使用时才导入，见 preload）
 _matting_session = None
 
+# 渐进式预览：缩略条单格边长、局部图最长边、每完成多少帧刷新一次局部图
+PREVIEW_TILE = int(os.getenv("PREVIEW_TILE", "128"))
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", "2048"))
+PREVIEW_CHUNK = int(os.getenv("PREVIEW_CHUNK", "16"))
+
+# 抠图后每攒够多少帧做一次批量后处理（裁剪 / 缩放 / 居中），同时作为检查点间隔
+POSTPROCESS_BATCH = int(os.getenv("POSTPROCESS_BATCH", "16"))
+
+# 解码后超过此大小（MB）的序列帧图另存逐帧 PNG 到输出目录的 frames/，帧接口直接读取，不必解码整图
+FRAME_FILES_MIN_MB = int(os.getenv("FRAME_FILES_MIN_MB", "64"))
+FRAME_FILES_DIR = "frames"
+
 
 def _get_session():
     global _matting_session
     if _matting_session is None:
+        from rembg.session_factory import new_session
+        # rembg 按 OMP_NUM_THREADS 设置 onnxruntime 的 intra / inter-op 线程数，由线程预算写入
         _matting_session = new_session("u2net")
     return _matting_session
 
 
-def get_video_info(video_path: Path) -> dict:
-    """使用 ffprobe 获取视频信息"""
+def preload() -> None:
+    """
+    worker 启动时调用：导入抠图依赖并创建 u2net 会话，模型只加载一次，各任务复用。
+    onnxruntime 会话的线程池不能跨 fork 使用，预加载时 worker 以 SimpleWorker 在本进程内执行任务（见 run_worker.py）。
+    """
+    _get_session()
+
+
+def uniform_timestamps(start_sec: float, end_sec: float, fps: int, max_frames: int) -> list[float]:
+    """固定 1/fps 间隔采样"""
+    interval = 1.0 / fps
+    timestamps = []
+    t = start_sec
+    while t < end_sec and len(timestamps) < max_frames:
+        timestamps.append(t)
+        t += interval
+    return timestamps
+
+
+def motion_energy(
+    video_path: Path,
+    info: dict,
+    start_sec: float,
+    end_sec: float,
+    analysis_fps: float,
+    width: int = 64,
+    check_cancel: Optional[Callable[[], None]] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    以低分辨率灰度解码区间，返回 (各帧时间戳, 与前一帧的平均绝对差)。
+    只跑一次 ffmpeg，输出 rawvideo 到管道，不落盘。
+    """
+    src_w, src_h = info.get("width") or 16, info.get("height") or 9
+    height = max(2, int(round(width * src_h / src_w / 2)) * 2)
     cmd = [
-        "ffprobe",
-        "-v", "quiet",
-        "-print_format", "json",
-        "-show_format",
-        "-show_streams",
-        str(video_path)
+        "ffmpeg", "-v", "error",
+        *ffmpeg_threads(),
+        "-ss", str(start_sec),
+        "-t", str(end_sec - start_sec),
+        *input_args(video_path),
+        "-vf", f"fps={analysis_fps},scale={width}:{height},format=gray",
+        "-f", "rawvideo", "-"
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    data = json.loads(result.stdout)
-    
-    duration = 0
-    width, height = 0, 0
-    fps = 30
-    
-    for stream in data.get("streams", []):
-        if stream.get("codec_type") == "video":
-            width = int(stream.get("width", 0))
-            height = int(stream.get("height", 0))
-            if "r_frame_rate" in stream:
-                num, den = map(int, stream["r_frame_rate"].split("/"))
-                fps = num / den if den else 30
-            break
-    
-    try:
-        duration = float(data.get("format", {}).get("duration", 0))
-    except (ValueError, KeyError, TypeError):
-        duration = 0
-    
-    return {
-        "duration": duration,
-        "width": width,
-        "height": height,
-        "fps": fps,
-        "frame_count": int(duration * fps) if duration and fps else 0
-    }
+    raw = run_cancellable(cmd, check_cancel, check=True).stdout
+    n = len(raw) // (width * height)
+    if n == 0:
+        return np.zeros(0), np.zeros(0)
+    frames = np.frombuffer(raw[:n * width * height], dtype=np.uint8).reshape(n, height, width).astype(np.int16)
+    energy = np.zeros(n, dtype=np.float64)
+    if n > 1:
+        energy[1:] = np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2))
+    times = start_sec + np.arange(n) / analysis_fps
+    return times, energy
+
+
+def _analysis_fps(info: dict) -> float:
+    """运动分析的解码帧率；自适应采样的时间点都落在该帧率的网格上"""
+    return min(30.0, info.get("fps") or 30.0)
+
+
+def adaptive_timestamps(
+    video_path: Path,
+    info: dict,
+    start_sec: float,
+    end_sec: float,
+    uniform: list[float],
+    check_cancel: Optional[Callable[[], None]] = None
+) -> list[float]:
+    """
+    运动自适应采样：在累计运动能量上按等分位选取至多 len(uniform) 个时间点。
+    运动剧烈处更密，静止段合并为少量帧（重复落点去重），故通常少于固定采样。
+    能量加一个小底噪，保证静止段仍有覆盖。
+    """
+    analysis_fps = _analysis_fps(info)
+    times, energy = motion_energy(video_path, info, start_sec, end_sec, analysis_fps, check_cancel=check_cancel)
+    if len(times) < 2:
+        return uniform
+
+    budget = len(uniform)
+    weights = energy + max(energy.mean() * 0.05, 1e-6)
+    cum = np.cumsum(weights)
+    cum /= cum[-1]
+    targets = (np.arange(budget) + 0.5) / budget
+    picks = np.unique(np.searchsorted(cum, targets).clip(0, len(times) - 1))
+    picks = np.union1d([0], picks)
+    return [float(t) for t in times[picks]]
+
+
+def decode_frames(
+    video_path: Union[Path, str],
+    start_sec: float,
+    end_sec: float,
+    rate: float,
+    width: int,
+    height: int,
+    check_cancel: Optional[Callable[[], None]] = None
+) -> Iterator[bytes]:
+    """
+    一次解码区间，按 rate 帧率逐帧产出 rgb24 原始字节（管道读取，不落盘）；
+    fps 滤镜取最接近各输出时间点的源帧，与逐帧 -ss 相比至多相差一个源帧。
+    URL 输入只打开一次远端文件，按顺序读取，不为每帧重新请求头部与 GOP。
+    提前关闭生成器时结束 ffmpeg。
+    """
+    frame_bytes = width * height * 3
+    # 从头解码时不加 -ss：对 URL 输入，-ss 0 也会触发一次回跳，重新请求整个文件
+    seek = ["-ss", str(start_sec)] if start_sec > 0 else []
+    cmd = [
+        "ffmpeg", "-v", "error",
+        *ffmpeg_threads(),
+        *seek,
+        "-t", str(max(end_sec - start_sec, 1.0 / rate)),
+        *input_args(video_path),
+        "-vf", f"fps={rate},scale={width}:{height}",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "-"
+    ]
+    with track_subprocess(cmd):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        count = 0
+        try:
+            while True:
+                if check_cancel:
+                    check_cancel()
+                raw = proc.stdout.read(frame_bytes)
+                if len(raw) < frame_bytes:
+                    break
+                count += 1
+                yield raw
+            stderr = proc.stderr.read()
+            if proc.wait() != 0 and count == 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
 
 
 def extract_frames(
     video_path: Path,
-    output_dir: Path,
+    store_dir: Path,
     fps: int,
     start_sec: float,
     end_sec: Optional[float],
     max_frames: int,
-    on_progress: Optional[Callable[[int, int], None]] = None
-) -> list[tuple[Path, float]]:
-    """提取视频帧为 PNG 序列"""
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    info = get_video_info(video_path)
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    sampling: str = "uniform",
+    check_cancel: Optional[Callable[[], None]] = None,
+    target_size: tuple[int, int] = (256, 256),
+    info: Optional[dict] = None,
+    on_frame: Optional[Callable[[FrameStore, int], None]] = None,
+    crop_mode: str = "none"
+) -> FrameStore:
+    """
+    提取视频帧到帧存储（RGB）；sampling=adaptive 时按运动能量选取时间点。
+    整个区间只解码一次（见 decode_frames），选中的帧以 rawvideo 直接写入内存映射数组，
+    并记录时间戳与去重 id（内容完全相同的帧指向首帧）。
+    info: 入队时的探测结果，给定时不再调用 ffprobe。
+    on_frame: (store, i) -> None，第 i 帧写入后调用，供提取过程中提前出预览。
+    crop_mode: 决定帧存储的分辨率（见 sizing.store_frame_size）。
+    """
+    info = info or get_video_info(video_path)
     duration = info["duration"]
     if end_sec is None or end_sec <= 0:
         end_sec = duration
@@ -80,112 +216,84 @@ def extract_frames(
     start_sec = max(0, min(start_sec, duration))
     end_sec = max(start_sec, min(end_sec, duration))
     
-    interval = 1.0 / fps
-    timestamps = []
-    t = start_sec
-    while t < end_sec and len(timestamps) < max_frames:
-        timestamps.append(t)
-        t += interval
+    timestamps = uniform_timestamps(start_sec, end_sec, fps, max_frames)
+    rate = fps
+    if sampling == "adaptive" and len(timestamps) > 1:
+        adaptive = adaptive_timestamps(video_path, info, start_sec, end_sec, timestamps, check_cancel)
+        if adaptive is not timestamps:
+            timestamps, rate = adaptive, _analysis_fps(info)
+    # 每个时间点对应按 rate 解码的第几帧
+    wanted = {round((ts - start_sec) * rate): i for i, ts in enumerate(timestamps)}
     
-    for i, ts in enumerate(timestamps):
-        out_path = output_dir / f"frame_{i:05d}.png"
-        cmd = [
-            "ffmpeg", "-y",
-            "-ss", str(ts),
-            "-i", str(video_path),
-            "-vframes", "1",
-            "-f", "image2",
-            str(out_path)
-        ]
-        subprocess.run(cmd, capture_output=True, check=True)
+    width, height = store_frame_size(info, *target_size, crop_mode)
+    store = FrameStore.create(store_dir, "frames", len(timestamps), height, width, 3)
+    if not timestamps:
+        return store
+    first_by_digest: dict[str, int] = {}
+    done = 0
+
+    def finish(i: int, ts: float) -> None:
+        store.meta["t"][i] = ts
+        store.meta["dedup"][i] = first_by_digest.setdefault(store.digest(i), i)
+        if on_frame:
+            on_frame(store, i)
         if on_progress:
             on_progress(i + 1, len(timestamps))
+
+    frames = decode_frames(video_path, start_sec, end_sec, rate, width, height, check_cancel)
+    try:
+        for k, raw in enumerate(frames):
+            i = wanted.get(k)
+            if i is None:
+                continue
+            store.write(i, np.frombuffer(raw, dtype=np.uint8))
+            finish(i, timestamps[i])
+            done = i + 1
+            if done == len(timestamps):
+                break
+    finally:
+        frames.close()
+    if done == 0:
+        raise ValueError(f"Failed to decode frame at {timestamps[0]:.3f}s")
+    # 末尾时间点可能越过最后一帧，沿用上一帧
+    for i in range(done, len(timestamps)):
+        store.write(i, store[i - 1])
+        finish(i, timestamps[i])
     
-    return [(output_dir / f"frame_{i:05d}.png", timestamps[i]) for i in range(len(timestamps))]
+    store.flush()
+    return store
 
 
 def process_matte(
-    input_path: Path,
-    output_path: Path,
+    img: Image.Image,
     alpha_matting: bool = False,
     alpha_matting_foreground_threshold: int = 240,
     alpha_matting_background_threshold: int = 10
-) -> None:
-    """对单帧进行抠图"""
-    with open(input_path, "rb") as f:
-        input_data = f.read()
-    
-    output_data = remove(
-        input_data,
+) -> Image.Image:
+    """对单帧进行抠图，返回 RGBA"""
+    from rembg import remove
+    output = remove(
+        img,
         session=_get_session(),
         alpha_matting=alpha_matting,
         alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
         alpha_matting_background_threshold=alpha_matting_background_threshold
     )
-    
-    with open(output_path, "wb") as f:
-        f.write(output_data)
-
-
-def get_alpha_bbox(img: Image.Image) -> Optional[tuple[int, int, int, int]]:
-    """获取 Alpha 非空区域的边界框"""
-    if img.mode != "RGBA":
-        return None
-    alpha = img.split()[-1]
-    bbox = alpha.getbbox()
-    return bbox
+    return output.convert("RGBA")
 
 
-def process_frame(
-    src: Path,
-    dest: Path,
-    target_w: int,
-    target_h: int,
-    padding: int,
-    bg_color: str,
-    transparent: bool,
-    crop_mode: str,
-    matte_strength: float
-) -> None:
-    """单帧后处理：抠图、裁剪、缩放、填充"""
-    # 抠图
-    matte_tmp = dest.parent / f"_matte_{dest.name}"
-    process_matte(
-        src, matte_tmp,
+def matte_frame(src: Image.Image, matte_strength: float) -> Image.Image:
+    """按 matte_strength 抠图，返回与原图同尺寸的 RGBA"""
+    return process_matte(
+        src,
         alpha_matting=matte_strength > 0.5,
         alpha_matting_foreground_threshold=int(240 * matte_strength),
         alpha_matting_background_threshold=int(10 * (1 - matte_strength))
     )
-    
-    img = Image.open(matte_tmp).convert("RGBA")
-    matte_tmp.unlink(missing_ok=True)
-    
-    # 按 crop_mode 裁剪
-    bbox = get_alpha_bbox(img)
-    if crop_mode == "tight_bbox" and bbox:
-        pad = 0
-        x1 = max(0, bbox[0] - pad)
-        y1 = max(0, bbox[1] - pad)
-        x2 = min(img.width, bbox[2] + pad)
-        y2 = min(img.height, bbox[3] + pad)
-        img = img.crop((x1, y1, x2, y2))
-    elif crop_mode == "safe_bbox" and bbox:
-        pad = padding
-        x1 = max(0, bbox[0] - pad)
-        y1 = max(0, bbox[1] - pad)
-        x2 = min(img.width, bbox[2] + pad)
-        y2 = min(img.height, bbox[3] + pad)
-        img = img.crop((x1, y1, x2, y2))
-    
-    # 缩放并居中到 target_size
-    img.thumbnail((target_w - padding * 2, target_h - padding * 2), Image.Resampling.LANCZOS)
-    
-    canvas = Image.new("RGBA", (target_w, target_h), (0, 0, 0, 0) if transparent else _parse_bg_color(bg_color))
-    paste_x = (target_w - img.width) // 2
-    paste_y = (target_h - img.height) // 2
-    canvas.paste(img, (paste_x, paste_y), img)
-    
-    canvas.save(dest, "PNG")
+
+
+def _bg_rgba(bg_color: str, transparent: bool) -> tuple[int, int, int, int]:
+    return (0, 0, 0, 0) if transparent else _parse_bg_color(bg_color)
 
 
 def _parse_bg_color(s: str) -> tuple[int, int, int, int]:
@@ -218,25 +326,62 @@ def compute_layout(
     return cols, rows, sheet_w, sheet_h
 
 
+SHEET_MIME_TYPES = {".png": "image/png", ".webp": "image/webp"}
+WEBP_MAX_EDGE = 16383
+
+
+def save_sheet(sheet: Image.Image, output_path: Path, output_format: str, compress_level: int) -> tuple[str, Path]:
+    """
+    按 output_format 编码序列帧图，返回 (实际格式, 实际路径)。
+    png: 指定 zlib 压缩级别；webp: 无损 WebP（超出 WebP 尺寸上限时回退 png）；
+    png8: FASTOCTREE 量化到 256 色调色板，适合像素风。
+    """
+    compress_level = max(0, min(9, compress_level))
+    if output_format == "webp" and max(sheet.size) <= WEBP_MAX_EDGE:
+        path = output_path.with_suffix(".webp")
+        # WebP 无损下 method 0-6 控制编码耗时，与 compress_level 0-9 线性对应
+        sheet.save(path, "WEBP", lossless=True, quality=100, method=round(compress_level * 6 / 9))
+        return "webp", path
+
+    path = output_path.with_suffix(".png")
+    if output_format == "png8":
+        indexed = sheet.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        indexed.save(path, "PNG", compress_level=compress_level)
+        return "png8", path
+
+    sheet.save(path, "PNG", compress_level=compress_level)
+    return "png", path
+
+
+def write_frame_files(sheet: Image.Image, frames_index: list[dict], frames_dir: Path) -> None:
+    """从序列帧图裁出各帧存为 {i}.png（与帧接口的编码参数一致）"""
+    frames_dir.mkdir(parents=True, exist_ok=True)
+    for fr in frames_index:
+        crop = sheet.crop((fr["x"], fr["y"], fr["x"] + fr["w"], fr["y"] + fr["h"]))
+        crop.save(frames_dir / f"{fr['i']}.png", "PNG", compress_level=1)
+
+
 def compose_sprite_sheet(
-    processed_frames: list[Path],
+    processed_frames: FrameStore,
     timestamps: list[float],
     frame_w: int,
     frame_h: int,
     spacing: int,
     layout_mode: str,
     columns: int,
-    output_path: Path
+    output_path: Path,
+    output_format: str = "png",
+    compress_level: int = 6
 ) -> dict:
-    """合成序列帧图并生成索引"""
+    """合成序列帧图并生成索引（直接读取帧存储）；output_path 的后缀按实际编码格式改写"""
     n = len(processed_frames)
     cols, rows, sheet_w, sheet_h = compute_layout(n, frame_w, frame_h, spacing, layout_mode, columns)
     
     sheet = Image.new("RGBA", (sheet_w, sheet_h), (0, 0, 0, 0))
     frames_index = []
     
-    for i, (fp, t) in enumerate(zip(processed_frames, timestamps)):
-        img = Image.open(fp).convert("RGBA")
+    for i, t in enumerate(timestamps):
+        img = processed_frames.image(i)
         col = i % cols
         row = i // cols
         x = col * (frame_w + spacing)
@@ -251,30 +396,129 @@ def compose_sprite_sheet(
             "t": round(t, 3)
         })
     
-    sheet.save(output_path, "PNG")
+    used_format, sheet_path = save_sheet(sheet, output_path, output_format, compress_level)
+    if sheet_w * sheet_h * 4 > FRAME_FILES_MIN_MB * 1024 * 1024:
+        if used_format != "png":
+            # png8 量化、无损 WebP 会改写全透明像素的颜色：从编码后的图裁切，与帧接口解码整图再裁切的结果一致
+            sheet = Image.open(sheet_path).convert("RGBA")
+        write_frame_files(sheet, frames_index, output_path.parent / FRAME_FILES_DIR)
 
     return {
         "version": "1.0",
         "frame_size": {"w": frame_w, "h": frame_h},
         "sheet_size": {"w": sheet_w, "h": sheet_h},
+        "image": {
+            "file": sheet_path.name,
+            "format": used_format,
+            "mime": SHEET_MIME_TYPES[sheet_path.suffix],
+        },
         "frames": frames_index
     }
 
 
-def run_pipeline(job_id: str, video_path: str, output_base: str, temp_base: str, params: dict) -> dict:
+def _save_atomic(img: Image.Image, path: Path, meta: dict) -> None:
+    """预览图与说明先写临时文件再替换，API 读取时不会拿到半截文件"""
+    tmp = path.with_name(path.name + ".tmp")
+    img.save(tmp, "PNG", compress_level=1)
+    os.replace(tmp, path)
+    meta_path = path.with_suffix(".json")
+    tmp = meta_path.with_name(meta_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def matted_rgba(extracted: FrameStore, alpha: FrameStore, start: int, end: int) -> np.ndarray:
     """
-    完整处理管线入口。
-    由 RQ worker 调用；video_path/output_base/temp_base 由 API 传入绝对路径。
+    拼出 [start, end) 帧抠图后的 RGBA。抠图结果只存 alpha，颜色取自提取帧，
+    不另存一份整帧 RGBA，临时盘占用由 7 字节/像素降到 4 字节/像素。
     """
-    vpath = Path(video_path)
-    if not vpath.exists():
-        raise FileNotFoundError(f"Video not found: {video_path}")
+    return np.concatenate([extracted.array[start:end], alpha.array[start:end]], axis=-1)
 
-    temp_path = Path(temp_base) / job_id
-    output_path = Path(output_base) / job_id
-    temp_path.mkdir(parents=True, exist_ok=True)
-    output_path.mkdir(parents=True, exist_ok=True)
 
+def matte_alpha(extracted: FrameStore, alpha: FrameStore, i: int, matte_strength: float) -> None:
+    """第 i 帧抠图写入 alpha 存储；内容与更早帧相同时直接复用其 alpha"""
+    dup = extracted.meta["dedup"][i]
+    if dup < i:
+        alpha.write(i, alpha[dup])
+    else:
+        alpha.write(i, np.asarray(matte_frame(extracted.image(i), matte_strength))[..., 3])
+
+
+def write_preview_strip(
+    extracted: FrameStore,
+    alpha: FrameStore,
+    preview_path: Path,
+    count: int,
+    target_w: int,
+    target_h: int,
+    padding: int,
+    bg_rgba: tuple[int, int, int, int],
+    crop_mode: str,
+    matte_strength: float,
+    check_cancel: Optional[Callable[[], None]] = None
+) -> int:
+    """
+    对最先提取的 count 帧正式抠图（结果写入 alpha，后续抠图阶段直接复用），缩小拼成一行预览条。
+    在帧提取过程中即可调用，用户不必等全片提取完就能发现参数问题。返回已抠图的帧数。
+    """
+    count = min(count, len(extracted))
+    for i in range(count):
+        if check_cancel:
+            check_cancel()
+        matte_alpha(extracted, alpha, i, matte_strength)
+    alpha.flush()
+
+    scale = min(1.0, PREVIEW_TILE / max(target_w, target_h))
+    tile_w, tile_h = max(1, int(target_w * scale)), max(1, int(target_h * scale))
+    frames = matted_rgba(extracted, alpha, 0, count)
+    tiles = postprocess_batch(frames, tile_w, tile_h, int(padding * scale), bg_rgba, crop_mode, alpha_bboxes(frames))
+    strip = Image.new("RGBA", (tile_w * count, tile_h), (0, 0, 0, 0))
+    for k in range(count):
+        strip.paste(Image.fromarray(tiles[k]), (k * tile_w, 0))
+    _save_atomic(strip, preview_path, {"kind": "strip", "frames_done": 0, "total": len(extracted)})
+    return count
+
+
+class PartialSheet:
+    """
+    渐进式局部图：按最终布局缩小后常驻内存，每完成一帧粘贴一次，
+    每 PREVIEW_CHUNK 帧落盘一次，整体开销与帧数线性相关。
+    """
+
+    def __init__(self, preview_path: Path, total: int, frame_w: int, frame_h: int,
+                 spacing: int, layout_mode: str, columns: int):
+        self.preview_path = preview_path
+        self.total = total
+        self.cols, _, sheet_w, sheet_h = compute_layout(total, frame_w, frame_h, spacing, layout_mode, columns)
+        self.scale = min(1.0, PREVIEW_MAX_EDGE / max(sheet_w, sheet_h, 1))
+        self.cell_w = (frame_w + spacing) * self.scale
+        self.cell_h = (frame_h + spacing) * self.scale
+        self.tile = (max(1, int(frame_w * self.scale)), max(1, int(frame_h * self.scale)))
+        self.sheet = Image.new("RGBA", (max(1, int(sheet_w * self.scale)), max(1, int(sheet_h * self.scale))), (0, 0, 0, 0))
+        self.done = 0
+
+    def add(self, i: int, frame: Image.Image) -> None:
+        tile = frame.resize(self.tile, Image.Resampling.BILINEAR)
+        self.sheet.paste(tile, (int((i % self.cols) * self.cell_w), int((i // self.cols) * self.cell_h)))
+        self.done += 1
+        if self.done % PREVIEW_CHUNK == 0 or self.done == self.total:
+            self.flush()
+
+    def flush(self) -> None:
+        _save_atomic(self.sheet, self.preview_path, {"kind": "partial", "frames_done": self.done, "total": self.total})
+
+
+def _run_stages(
+    vpath: Union[Path, str],
+    fp: str,
+    temp_path: Path,
+    output_path: Path,
+    params: dict,
+    check_cancel: Callable[[], None],
+    video_info: Optional[dict] = None
+) -> dict:
+    """帧提取 → 抠图后处理 → 合成"""
     fr = params.get("frame_range", {})
     start_sec = fr.get("start_sec", 0)
     end_sec = fr.get("end_sec")
@@ -291,44 +535,190 @@ def run_pipeline(job_id: str, video_path: str, output_base: str, temp_base: str,
     matte_strength = params.get("matte_strength", 0.6)
     layout_mode = params.get("layout_mode", "fixed_columns")
     columns = params.get("columns", 12)
+    sampling = params.get("sampling", "uniform")
+    preview_frames = params.get("preview_frames", 8)
+    output_format = params.get("output_format", "png")
+    compress_level = params.get("compress_level", 6)
+
+    # 0. 检查点：重试时跳过已提取、已抠图的帧
+    manifest = load_manifest(temp_path, fp)
+    preview_path = output_path / "preview.png"
+    bg_rgba = _bg_rgba(bg_color, transparent)
+    # union_bbox 需要全片 bbox，批次内先按单帧裁剪给预览用，全部抠完后统一重做
+    batch_mode = "safe_bbox" if crop_mode == "union_bbox" else crop_mode
+    stores = {}
 
-    # 1. 帧提取
-    frames_dir = temp_path / "frames"
-    extracted = extract_frames(vpath, frames_dir, fps, start_sec, end_sec, max_frames)
+    def strip(extracted: FrameStore) -> int:
+        w, h = extracted.frame_size
+        stores["alpha"] = FrameStore.create(temp_path, "alpha", len(extracted), h, w, 1)
+        return write_preview_strip(
+            extracted, stores["alpha"], preview_path, preview_frames,
+            target_w, target_h, padding, bg_rgba, batch_mode, matte_strength, check_cancel
+        )
 
-    if not extracted:
+    def on_frame(store: FrameStore, i: int) -> None:
+        # 前 preview_frames 帧一提取完就出预览条，不等全片提取
+        if i + 1 == min(preview_frames, len(store)):
+            stores["prematted"] = strip(store)
+
+    # 1. 帧提取（写入帧存储 temp_path/frames.npy）
+    extracted = FrameStore.open(temp_path, "frames") if manifest.get("extracted") else None
+    if extracted is None or len(extracted) != manifest["extracted"]:
+        extracted = extract_frames(
+            vpath, temp_path, fps, start_sec, end_sec, max_frames,
+            sampling=sampling, check_cancel=check_cancel, target_size=(target_w, target_h), info=video_info,
+            on_frame=on_frame if preview_frames > 0 else None, crop_mode=crop_mode
+        )
+        manifest = {"extracted": len(extracted), "processed": 0, "prematted": stores.get("prematted", 0)}
+        save_manifest(temp_path, fp, manifest)
+
+    if not len(extracted):
         raise ValueError("No frames extracted")
 
-    # 2. 抠图 + 后处理
-    processed_dir = temp_path / "processed"
-    processed_dir.mkdir(parents=True, exist_ok=True)
-    processed = []
+    # 1.5 预览条：提取阶段未出（从检查点续跑）时补出；已有局部图时跳过
+    resumed = manifest.get("processed", 0)
+    prematted = manifest.get("prematted", 0)
+    if preview_frames > 0 and not resumed and not prematted:
+        prematted = manifest["prematted"] = strip(extracted)
+        save_manifest(temp_path, fp, manifest)
+
+    # 2. 抠图（只把 alpha 写入 temp_path/alpha.npy；内容重复的帧、预览条已抠的帧直接复用）
+    #    每 POSTPROCESS_BATCH 帧批量后处理一次写入 processed.npy，刷新局部图并记检查点
     total = len(extracted)
-    for i, (src, ts) in enumerate(extracted):
-        dest = processed_dir / f"out_{i:05d}.png"
-        process_frame(src, dest, target_w, target_h, padding, bg_color, transparent, crop_mode, matte_strength)
-        processed.append((dest, ts))
+    src_w, src_h = extracted.frame_size
+    alpha = stores.get("alpha")
+    if alpha is None and (resumed or prematted):
+        alpha = FrameStore.open(temp_path, "alpha")
+    processed = FrameStore.open(temp_path, "processed") if resumed else None
+    if alpha is None or len(alpha) != total or alpha.frame_size != (src_w, src_h):
+        alpha = FrameStore.create(temp_path, "alpha", total, src_h, src_w, 1)
+        resumed = prematted = 0
+    if processed is None or len(processed) != total or processed.frame_size != (target_w, target_h):
+        processed = FrameStore.create(temp_path, "processed", total, target_h, target_w, 4)
+        resumed = 0
+    timestamps = extracted.meta["t"]
+    processed.meta["t"] = timestamps
+    bboxes = alpha.meta["bbox"]
+    partial = PartialSheet(preview_path, total, target_w, target_h, spacing, layout_mode, columns) if preview_frames > 0 else None
+
+    for s in range(0, total, POSTPROCESS_BATCH):
+        e = min(s + POSTPROCESS_BATCH, total)
+        if e > resumed:
+            lo = max(s, resumed)
+            for i in range(max(lo, prematted), e):
+                check_cancel()
+                matte_alpha(extracted, alpha, i, matte_strength)
+            rgba = matted_rgba(extracted, alpha, s, e)
+            bboxes[lo:e] = [list(b) if b else None for b in alpha_bboxes(rgba[lo - s:])]
+            processed.write_batch(s, postprocess_batch(
+                rgba, target_w, target_h, padding, bg_rgba, batch_mode, bboxes[s:e]
+            ))
+            alpha.flush()
+            processed.flush()
+            manifest["processed"] = e
+            save_manifest(temp_path, fp, manifest)
+        if partial:
+            for i in range(s, e):
+                partial.add(i, processed.image(i))
+
+    if crop_mode == "union_bbox":
+        box = crop_box(union_bbox(bboxes), crop_mode, padding, src_w, src_h)
+        for s in range(0, total, POSTPROCESS_BATCH):
+            check_cancel()
+            e = min(s + POSTPROCESS_BATCH, total)
+            processed.write_batch(s, postprocess_batch(
+                matted_rgba(extracted, alpha, s, e), target_w, target_h, padding, bg_rgba, crop_mode, fixed_box=box
+            ))
+    processed.meta["bbox"] = bboxes
+    processed.flush()
 
     # 3. 合成
-    sprite_path = output_path / "sprite.png"
+    check_cancel()
     index_data = compose_sprite_sheet(
-        [p[0] for p in processed],
-        [p[1] for p in processed],
-        target_w, target_h, spacing, layout_mode, columns, sprite_path
+        processed, timestamps,
+        target_w, target_h, spacing, layout_mode, columns, output_path / "sprite.png",
+        output_format, compress_level
     )
+    index_data["sampling"] = sampling
+    sprite_path = output_path / index_data["image"]["file"]
     index_path = output_path / "index.json"
     with open(index_path, "w", encoding="utf-8") as f:
         json.dump(index_data, f, indent=2, ensure_ascii=False)
+    write_result_zip(sprite_path, index_path, output_path / "result.zip")
 
-    # 4. 清理临时帧
-    import shutil
-    if frames_dir.exists():
-        shutil.rmtree(frames_dir, ignore_errors=True)
-    if processed_dir.exists():
-        shutil.rmtree(processed_dir, ignore_errors=True)
+    # 4. 清理帧存储
+    extracted.remove()
+    alpha.remove()
+    processed.remove()
+    clear_manifest(temp_path)
 
     return {
-        "frame_count": len(processed),
+        "frame_count": total,
         "width": index_data["sheet_size"]["w"],
-        "height": index_data["sheet_size"]["h"]
+        "height": index_data["sheet_size"]["h"],
+        "output_format": index_data["image"]["format"]
     }
+
+
+def run_pipeline(
+    job_id: str,
+    video_path: str,
+    output_base: str,
+    temp_base: str,
+    params: dict,
+    video_info: Optional[dict] = None
+) -> dict:
+    """
+    完整处理管线入口。
+    由 RQ worker 调用；video_path/output_base/temp_base 由 API 传入绝对路径。
+    video_path 也可为 http(s) URL：源站支持 Range 时 ffmpeg 直接读取，否则流式下载到 temp_base/job_id。
+    帧与批次之间检查取消标记，被取消时清理文件并抛出 JobCanceled。
+    已完成的帧记录在 temp_base/job_id/manifest.json，RQ 重试时从检查点续跑。
+    params.profile 为真（或被 JOB_PROFILE_SAMPLE_RATE 抽中）时在 cProfile 下运行，剖析结果写入输出目录。
+    video_info: 入队时的探测结果（get_video_info 格式），给定时跳过 worker 内的 ffprobe。
+    """
+    output_path = Path(output_base) / job_id
+    with job_profile(output_path, params.get("profile", False)):
+        return _run_job(job_id, video_path, output_path, Path(temp_base) / job_id, params, video_info)
+
+
+def _run_job(
+    job_id: str,
+    video_path: str,
+    output_path: Path,
+    temp_path: Path,
+    params: dict,
+    video_info: Optional[dict]
+) -> dict:
+    check_cancel = canceller(job_id)
+
+    if is_url(video_path):
+        upload_dir = None
+        try:
+            duration = video_info["duration"] if video_info else None
+            source, version = open_source(video_path, temp_path, check_cancel, duration)
+        except JobCanceled:
+            discard_job_files(job_id, temp_path)
+            raise
+        fp = fingerprint(video_path, version, params)
+    else:
+        source = Path(video_path)
+        if not source.exists():
+            raise FileNotFoundError(f"Video not found: {video_path}")
+        upload_dir = source.parent
+        fp = source_fingerprint(source, params)
+
+    temp_path.mkdir(parents=True, exist_ok=True)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    try:
+        result = _run_stages(source, fp, temp_path, output_path, params, check_cancel, video_info)
+    except JobCanceled:
+        # 被取消：立即释放，删除本任务的临时、输出与上传目录
+        discard_job_files(job_id, temp_path, output_path, upload_dir)
+        raise
+    # 成功后源视频不再需要：删除下载的源文件或本任务的上传目录（只删以 job_id 命名的目录）
+    if upload_dir is None and not is_url(str(source)):
+        Path(source).unlink(missing_ok=True)
+    discard_job_files(job_id, upload_dir)
+    return result
@@ -0,0 +1,114 @@
+"""
+任务级性能剖析：在 cProfile 下运行管线，同时按程序统计子进程（ffmpeg / ffprobe）耗时，
+结果写入输出目录，供 GET /jobs/{id}/profile 下载：
+- profile.json：墙钟 / CPU 时间、子进程耗时、累计耗时最高的函数
+- profile.pstats：原始 cProfile 数据，可用 snakeviz / pstats 查看
+
+任务参数 profile=true 时必定剖析；JOB_PROFILE_SAMPLE_RATE（0~1）按比例抽样其余任务，用于线上热点诊断。
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+JOB_PROFILE_SAMPLE_RATE = float(os.getenv("JOB_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_JSON = "profile.json"
+PROFILE_PSTATS = "profile.pstats"
+
+# 当前线程剖析中的子进程统计 {程序名: {"calls", "wall_sec"}}；同步模式下多个任务各在自己的线程
+_state = threading.local()
+
+
+def should_profile(requested: bool = False) -> bool:
+    return requested or (JOB_PROFILE_SAMPLE_RATE > 0 and random.random() < JOB_PROFILE_SAMPLE_RATE)
+
+
+@contextmanager
+def track_subprocess(cmd: list[str]) -> Iterator[None]:
+    """记录一次子进程调用的墙钟耗时；未在剖析中时不做任何事"""
+    subprocesses = getattr(_state, "subprocesses", None)
+    if subprocesses is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = subprocesses.setdefault(os.path.basename(str(cmd[0])), {"calls": 0, "wall_sec": 0.0})
+        entry["calls"] += 1
+        entry["wall_sec"] += time.perf_counter() - start
+
+
+def _children_cpu() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _top_functions(stats: pstats.Stats) -> list[dict]:
+    rows = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "ncalls": ncalls,
+            "tottime": round(tottime, 4),
+            "cumtime": round(cumtime, 4),
+        })
+    rows.sort(key=lambda r: r["cumtime"], reverse=True)
+    return rows[:PROFILE_TOP_FUNCTIONS]
+
+
+@contextmanager
+def job_profile(output_dir: Path, requested: bool = False) -> Iterator[None]:
+    """
+    在 cProfile 下执行 with 块，结束（含失败）后把结果写入 output_dir。
+    output_dir 已被删除（如任务被取消）时不写。
+    """
+    if not should_profile(requested):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 同一进程中已有其他剖析器在运行（同步模式并发任务），本任务不剖析
+        yield
+        return
+    _state.subprocesses = {}
+    wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _children_cpu()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        profiler.disable()
+        subprocesses, _state.subprocesses = _state.subprocesses, None
+        if output_dir.exists():
+            stats = pstats.Stats(profiler)
+            stats.dump_stats(str(output_dir / PROFILE_PSTATS))
+            summary = {
+                "failed": failed,
+                "wall_sec": round(time.perf_counter() - wall, 3),
+                "cpu_sec": round(time.process_time() - cpu, 3),
+                "subprocess_cpu_sec": round(_children_cpu() - children_cpu, 3),
+                "subprocesses": {
+                    name: {"calls": s["calls"], "wall_sec": round(s["wall_sec"], 3)}
+                    for name, s in sorted(subprocesses.items(), key=lambda kv: -kv[1]["wall_sec"])
+                },
+                "top_functions": _top_functions(stats),
+            }
+            with open(output_dir / PROFILE_JSON, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
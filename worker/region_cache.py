@@ -0,0 +1,62 @@
+"""
+水印检测缓存：同一来源的水印在同一分辨率下位置固定，
+确认成功的蒙版按 (分辨率, 来源配置) 缓存，后续任务跳过采样与检测。
+蒙版的笔画取自具体视频（手动 / 预设区域也一样），命中后由调用方在当前视频上复核（见 watermark_remover._mask_matches）。
+存于 Redis（多 worker 共享），无 Redis 时退化为进程内缓存。
+"""
+import os
+from typing import Optional
+
+import cv2
+import numpy as np
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# 缓存有效期（秒），0 关闭检测缓存
+WATERMARK_CACHE_TTL = int(os.getenv("WATERMARK_CACHE_TTL", str(30 * 24 * 3600)))
+
+_local_masks: dict[str, bytes] = {}
+_conn = None
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        import redis
+        _conn = redis.from_url(REDIS_URL)
+    return _conn
+
+
+def cache_key(width: int, height: int, profile: str) -> str:
+    """profile: auto（自动检测）、预设名或手动区域 x,y,w,h"""
+    return f"pixelwork:wm-mask:{width}x{height}:{profile}"
+
+
+def load_mask(key: str) -> Optional[np.ndarray]:
+    """读取缓存的蒙版；未命中或已关闭缓存时返回 None"""
+    if WATERMARK_CACHE_TTL <= 0:
+        return None
+    data = _local_masks.get(key)
+    if data is None:
+        try:
+            data = _get_conn().get(key)
+        except Exception:
+            data = None
+    if not data:
+        return None
+    mask = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    return mask if mask is not None and mask.any() else None
+
+
+def store_mask(key: str, mask: np.ndarray) -> None:
+    """任务成功后写入确认过的蒙版（PNG 编码，几乎全零，体积很小）"""
+    if WATERMARK_CACHE_TTL <= 0:
+        return
+    ok, buf = cv2.imencode(".png", mask)
+    if not ok:
+        return
+    data = buf.tobytes()
+    _local_masks[key] = data
+    try:
+        _get_conn().set(key, data, ex=WATERMARK_CACHE_TTL)
+    except Exception:
+        pass
@@ -0,0 +1,22 @@
+"""结果打包：worker 完成时预生成下载用 ZIP，API 为缺少 ZIP 的旧任务补建，两侧共用此实现（只依赖标准库）"""
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+
+def write_result_zip(sprite_path: Path, index_path: Path, zip_path: Path) -> Path:
+    """
+    打包 sprite + index：PNG 已压缩故 STORED，index.json 仍 DEFLATED。
+    先写同目录下的唯一临时文件再原子替换，并发补建时互不覆盖半成品。
+    """
+    fd, tmp = tempfile.mkstemp(dir=zip_path.parent, prefix=zip_path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w") as zf:
+            zf.write(sprite_path, sprite_path.name, compress_type=zipfile.ZIP_STORED)
+            zf.write(index_path, "index.json", compress_type=zipfile.ZIP_DEFLATED)
+        os.replace(tmp, zip_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return zip_path
@@ -0,0 +1,37 @@
+"""
+帧存储尺寸与临时盘用量估算。不依赖 numpy / cv2，API 入队时估算任务也可直接导入。
+"""
+import os
+
+# crop_mode=none 时帧存储中提取帧的长边 = 目标长边 × FRAME_STORE_SCALE（不放大源视频）；
+# 按 alpha bbox 裁剪的模式保持源分辨率，见 store_frame_size
+FRAME_STORE_SCALE = float(os.getenv("FRAME_STORE_SCALE", "2"))
+# 水印任务的修复帧以 PNG 落盘，按原始 RGB 的该比例估算
+WATERMARK_PNG_RATIO = 0.5
+
+
+def store_frame_size(info: dict, target_w: int, target_h: int, crop_mode: str = "none") -> tuple[int, int]:
+    """
+    提取帧在帧存储中的尺寸。
+    crop_mode=none 时整帧缩放进目标画布，长边不超过 FRAME_STORE_SCALE × 目标长边即可（不放大源视频）；
+    按 alpha bbox 裁剪时主体可能只占画面一小部分，裁剪框内须保留源分辨率的像素，故不缩小。
+    """
+    src_w, src_h = info.get("width") or 0, info.get("height") or 0
+    if not src_w or not src_h:
+        raise ValueError("Unable to determine video size")
+    if crop_mode != "none":
+        return src_w, src_h
+    limit = max(1.0, FRAME_STORE_SCALE * max(target_w, target_h))
+    scale = min(1.0, limit / max(src_w, src_h))
+    return max(1, int(round(src_w * scale))), max(1, int(round(src_h * scale)))
+
+
+def pipeline_temp_bytes(info: dict, frames: int, target_w: int, target_h: int, crop_mode: str = "none") -> int:
+    """序列帧任务的临时盘峰值：提取帧 RGB + alpha（4 字节/像素）与后处理后的目标尺寸 RGBA"""
+    w, h = store_frame_size(info, target_w, target_h, crop_mode)
+    return frames * (w * h * 4 + target_w * target_h * 4)
+
+
+def watermark_temp_bytes(info: dict, frames: int) -> int:
+    """水印任务的临时盘峰值：全部修复帧的 PNG"""
+    return int(frames * info["width"] * info["height"] * 3 * WATERMARK_PNG_RATIO)
@@ -1,49 +1,356 @@
 """RQ 任务定义"""
+import math
 import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
 import redis
-from rq import Queue
+from rq import Queue, Retry
 from rq.job import Job
+from rq.registry import StartedJobRegistry
+
+from .cancellation import request_cancel
+from .probe import get_video_info, is_url
+from .sizing import pipeline_temp_bytes, watermark_temp_bytes
 
-from .processor import run_pipeline
-from .watermark_remover import run_watermark_pipeline
+# 按点分路径入队，由 worker 执行时再导入；API 进程不加载 rembg / onnxruntime / cv2
+PIPELINE_FUNC = "worker.processor.run_pipeline"
+WATERMARK_FUNC = "worker.watermark_remover.run_watermark_pipeline"
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+# 按成本分级的队列。worker 按命令行顺序优先消费，见 run_worker.py
+QUEUE_SMALL = "pixelwork-small"
+QUEUE_LARGE = "pixelwork-large"
+QUEUE_WATERMARK = "pixelwork-watermark"
+LEGACY_QUEUE = "pixelwork"
+DEFAULT_WORKER_QUEUES = [QUEUE_SMALL, QUEUE_WATERMARK, QUEUE_LARGE, LEGACY_QUEUE]
+
+# 成本单位：帧数 × 源分辨率百万像素。低于阈值进 small 队列
+SMALL_JOB_MAX_COST = float(os.getenv("SMALL_JOB_MAX_COST", "150"))
+# large 队列中等待超过该秒数的任务提升到 small 队列，避免饿死
+QUEUE_AGING_SEC = int(os.getenv("QUEUE_AGING_SEC", "600"))
+AGING_SCAN_LIMIT = 50
+# worker 崩溃 / 超时后的自动重试；管线从检查点续跑，重试代价只是剩余部分
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "2"))
+JOB_RETRY_INTERVALS = [30, 120]
+JOB_TIMEOUT = "30m"
+# 批量提交时并行探测视频的线程数
+BATCH_PROBE_WORKERS = int(os.getenv("BATCH_PROBE_WORKERS", "8"))
+
+
+def get_connection():
+    """获取 Redis 连接"""
+    return redis.from_url(REDIS_URL)
+
 
-def get_queue():
+def get_queue(name: str = LEGACY_QUEUE, conn=None):
     """获取 Redis 队列"""
-    conn = redis.from_url(REDIS_URL)
-    return Queue("pixelwork", connection=conn)
+    return Queue(name, connection=conn or get_connection())
+
+
+def probe_info(video_path: str) -> Optional[dict]:
+    """探测视频信息（本地路径或 URL，ffprobe 均可直接读取）；失败返回 None"""
+    try:
+        return get_video_info(video_path)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def estimate_job(video_path: str, params: Optional[dict] = None, info: Optional[dict] = None) -> Optional[dict]:
+    """
+    估算任务规模：frames 为待处理帧数，cost 为帧数 × 源百万像素，temp_bytes 为临时盘峰值；探测失败返回 None。
+    params 为 None 表示水印任务：处理全部源帧；否则为序列帧任务：按 fps、区间与 max_frames 计帧。
+    info: 已有的探测结果（API 上传时探测），给定时不再调用 ffprobe。
+    """
+    info = info or probe_info(video_path)
+    if info is None:
+        return None
+    megapixels = max(info["width"] * info["height"], 1) / 1e6
+    if params is None:
+        frames = int(math.ceil(info["duration"] * info["fps"]))
+        temp_bytes = watermark_temp_bytes(info, frames)
+    else:
+        fr = params.get("frame_range", {})
+        start = fr.get("start_sec", 0) or 0
+        end = fr.get("end_sec") or info["duration"]
+        span = max(0.0, min(end, info["duration"]) - start)
+        frames = int(math.ceil(min(span * params.get("fps", 12), params.get("max_frames", 300))))
+        target = params.get("target_size", {})
+        temp_bytes = pipeline_temp_bytes(
+            info, frames, target.get("w", 256), target.get("h", 256), params.get("crop_mode", "tight_bbox")
+        )
+    return {"frames": frames, "cost": round(frames * megapixels, 2), "temp_bytes": temp_bytes}
+
+
+def _estimate_meta(estimate: dict) -> dict:
+    return {
+        "estimated_cost": estimate.get("cost"),
+        "estimated_frames": estimate.get("frames"),
+        "estimated_temp_bytes": estimate.get("temp_bytes"),
+    }
+
+
+def get_backlog() -> dict:
+    """
+    各分级队列中排队任务数、估算帧数积压，以及排队与执行中任务预留的临时盘字节数
+    （一次 pipeline 批量读取 meta）。由 API 后台定期调用，不在提交路径上。
+    """
+    conn = get_connection()
+    queued_ids, started_ids = [], []
+    for name in DEFAULT_WORKER_QUEUES:
+        queued_ids.extend(get_queue(name, conn).get_job_ids())
+        started_ids.extend(StartedJobRegistry(name, connection=conn).get_job_ids())
+    frames = temp_bytes = 0
+    for k, job in enumerate(Job.fetch_many(queued_ids + started_ids, connection=conn)):
+        if job is None:
+            continue
+        if k < len(queued_ids):
+            frames += job.meta.get("estimated_frames") or 0
+        temp_bytes += job.meta.get("estimated_temp_bytes") or 0
+    return {"queued_jobs": len(queued_ids), "backlog_frames": frames, "temp_bytes": temp_bytes}
+
+
+def active_job_ids(conn=None) -> set[str]:
+    """
+    排队、执行中、等待重试（scheduled）与等待依赖（deferred）的 RQ 任务对应的 API job_id（任务参数首项）。
+    供 API 存储回收跳过仍在使用的目录；以 Redis 为准，多 API 副本或 API 重启后同样成立。
+    """
+    conn = conn or get_connection()
+    rq_ids = set()
+    for name in DEFAULT_WORKER_QUEUES:
+        q = get_queue(name, conn)
+        rq_ids.update(q.get_job_ids())
+        for registry in (q.started_job_registry, q.scheduled_job_registry, q.deferred_job_registry):
+            rq_ids.update(registry.get_job_ids())
+    return {job.args[0] for job in Job.fetch_many(list(rq_ids), connection=conn) if job is not None and job.args}
+
+
+def promote_aged_jobs(conn=None) -> int:
+    """
+    将 large 队列中等待过久的任务移入 small 队列末尾，返回提升数量。
+    由 API 后台定时调用；多个 API 实例并发执行时，只有成功移出 large 的一方入队。
+    """
+    conn = conn or get_connection()
+    large = get_queue(QUEUE_LARGE, conn)
+    small = get_queue(QUEUE_SMALL, conn)
+    now = datetime.now(timezone.utc)
+    promoted = 0
+    for job_id in large.get_job_ids(0, AGING_SCAN_LIMIT):
+        job = Job.fetch(job_id, connection=conn)
+        enqueued_at = job.enqueued_at
+        if enqueued_at is None:
+            continue
+        if enqueued_at.tzinfo is None:
+            enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+        if (now - enqueued_at).total_seconds() < QUEUE_AGING_SEC:
+            break  # 队列按入队时间排序，后面的更新
+        if not large.remove(job_id):
+            continue
+        job.meta["aged"] = True
+        job.save_meta()
+        small.enqueue_job(job)
+        promoted += 1
+    return promoted
+
+
+def _retry() -> Optional[Retry]:
+    return Retry(max=JOB_MAX_RETRIES, interval=JOB_RETRY_INTERVALS) if JOB_MAX_RETRIES else None
+
 
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    可重试的瞬时错误：I/O、子进程 / 任务超时、Redis 与网络错误。
+    取消、参数或源视频本身的问题（ValueError、文件不存在、ffmpeg 解码失败等）重试也不会成功。
+    """
+    import httpx
+    from rq.timeouts import JobTimeoutException
+    from .cancellation import JobCanceled
 
-def enqueue_job(job_id: str, video_path: str, output_base: str, temp_base: str, params: dict) -> str:
-    """将任务加入队列，返回 RQ job id"""
-    q = get_queue()
+    if isinstance(exc, (JobCanceled, FileNotFoundError, IsADirectoryError, NotADirectoryError, PermissionError)):
+        return False
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, (
+        OSError, subprocess.TimeoutExpired, JobTimeoutException, redis.RedisError, httpx.TransportError,
+    ))
+
+
+def retry_transient_only(job: Job, exc_type, exc_value, traceback) -> bool:
+    """RQ 异常处理器（run_worker 注册）：非瞬时错误清零剩余重试次数，任务直接进入 failed"""
+    if job.retries_left and not is_transient_error(exc_value):
+        job.retries_left = 0
+    return True
+
+
+def _cost_queue(estimate: Optional[dict]) -> str:
+    """按估算成本选 small / large 队列；无法估算时按大任务处理，不挤占短任务队列"""
+    small = estimate is not None and estimate["cost"] <= SMALL_JOB_MAX_COST
+    return QUEUE_SMALL if small else QUEUE_LARGE
+
+
+def _enqueue(queue_name: str, func: str, args: tuple, estimate: Optional[dict]) -> dict:
+    conn = get_connection()
+    q = get_queue(queue_name, conn)
+    estimate = estimate or {}
     job = q.enqueue(
-        run_pipeline,
-        job_id, video_path, output_base, temp_base, params,
-        job_timeout="30m"
+        func, *args,
+        job_timeout=JOB_TIMEOUT,
+        retry=_retry(),
+        meta=_estimate_meta(estimate)
     )
-    return job.id
+    return {
+        "rq_job_id": job.id,
+        "queue": queue_name,
+        **_estimate_meta(estimate),
+        "queue_position": q.get_job_position(job.id),
+    }
 
 
-def enqueue_watermark_job(job_id: str, video_path: str, output_base: str) -> str:
-    """将水印去除任务加入队列，返回 RQ job id"""
-    q = get_queue()
-    job = q.enqueue(
-        run_watermark_pipeline,
-        job_id, video_path, output_base,
-        job_timeout="30m"
+def enqueue_job(
+    job_id: str,
+    video_path: str,
+    output_base: str,
+    temp_base: str,
+    params: dict,
+    video_info: Optional[dict] = None
+) -> dict:
+    """
+    将任务按估算成本加入 small / large 队列，返回 RQ job id、队列、估算（成本、帧数、临时盘）与排队位置。
+    video_info 为空时在此探测一次；探测结果随任务传给 worker，worker 不再重复探测。
+    URL 不在此探测（入队方不访问远端，由 worker 取源时校验并探测），无估算，按大任务入队。
+    """
+    if video_info is None and not is_url(video_path):
+        video_info = probe_info(video_path)
+    estimate = estimate_job(video_path, params, video_info) if video_info else None
+    return _enqueue(
+        _cost_queue(estimate), PIPELINE_FUNC,
+        (job_id, video_path, output_base, temp_base, params, video_info), estimate
     )
-    return job.id
+
+
+def enqueue_batch(
+    items: list[tuple[str, str]],
+    output_base: str,
+    temp_base: str,
+    params: dict,
+    infos: Optional[list[Optional[dict]]] = None
+) -> list[dict]:
+    """
+    批量入队：items 为 (job_id, video_path)，共用一组参数；infos 为 API 已有的探测结果（与 items 同序）。
+    缺少探测结果的条目并行探测，估算成本后按队列分组，所有任务在一个 Redis pipeline 中写入；
+    返回与 items 同序的 {rq_job_id, queue, estimated_cost, estimated_frames, estimated_temp_bytes}。
+    """
+    infos = list(infos or [None] * len(items))
+    missing = [k for k, info in enumerate(infos) if info is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=BATCH_PROBE_WORKERS) as pool:
+            for k, info in zip(missing, pool.map(lambda k: probe_info(items[k][1]), missing)):
+                infos[k] = info
+
+    conn = get_connection()
+    grouped: dict[str, list] = {}
+    queued = []
+    for (job_id, video_path), info in zip(items, infos):
+        estimate = estimate_job(video_path, params, info) if info else None
+        queue_name = _cost_queue(estimate)
+        estimate = estimate or {}
+        grouped.setdefault(queue_name, []).append(Queue.prepare_data(
+            PIPELINE_FUNC, (job_id, video_path, output_base, temp_base, params, info),
+            timeout=JOB_TIMEOUT,
+            retry=_retry(),
+            meta=_estimate_meta(estimate),
+        ))
+        queued.append({"queue": queue_name, **_estimate_meta(estimate)})
+
+    rq_ids = {}
+    with conn.pipeline() as pipe:
+        for queue_name, datas in grouped.items():
+            jobs = get_queue(queue_name, conn).enqueue_many(datas, pipeline=pipe)
+            rq_ids[queue_name] = iter(job.id for job in jobs)
+        pipe.execute()
+    for entry in queued:
+        entry["rq_job_id"] = next(rq_ids[entry["queue"]])
+    return queued
+
+
+def enqueue_watermark_job(
+    job_id: str,
+    video_path: str,
+    output_base: str,
+    temp_base: Optional[str] = None,
+    region: Optional[dict] = None,
+    preset: Optional[str] = None,
+    profile: bool = False,
+    video_info: Optional[dict] = None
+) -> dict:
+    """
+    将水印去除任务加入 watermark 队列，返回 RQ job id、队列、成本与排队位置。
+    video_info: API 上传时的探测结果，用于估算成本（水印管线按 OpenCV 解码属性处理，不需要传给 worker）。
+    """
+    estimate = estimate_job(video_path, info=video_info)
+    return _enqueue(
+        QUEUE_WATERMARK, WATERMARK_FUNC,
+        (job_id, video_path, output_base, temp_base, region, preset, profile), estimate
+    )
+
+
+def _status_name(status) -> str:
+    """新版 RQ 返回 JobStatus 枚举，统一为字符串"""
+    return getattr(status, "value", status) or ""
 
 
 def get_job_status(rq_job_id: str) -> dict:
-    """获取 RQ 任务状态"""
-    conn = redis.from_url(REDIS_URL)
+    """获取 RQ 任务状态；排队中时附带所在队列与位置"""
+    conn = get_connection()
     job = Job.fetch(rq_job_id, connection=conn)
+    status = _status_name(job.get_status())
+    queue_position = None
+    if status == "queued" and job.origin:
+        queue_position = get_queue(job.origin, conn).get_job_position(job.id)
     return {
-        "status": job.get_status(),
+        "status": status,
         "result": job.result,
-        "exc_info": str(job.exc_info) if job.exc_info else None
+        "exc_info": str(job.exc_info) if job.exc_info else None,
+        "queue": job.origin,
+        "queue_position": queue_position,
+        "estimated_cost": job.meta.get("estimated_cost"),
     }
+
+
+def get_job_statuses(rq_job_ids: list[str]) -> list[Optional[dict]]:
+    """批量获取 RQ 任务状态（一次往返），不存在的任务为 None"""
+    if not rq_job_ids:
+        return []
+    statuses = []
+    for job in Job.fetch_many(rq_job_ids, connection=get_connection()):
+        if job is None:
+            statuses.append(None)
+            continue
+        status = _status_name(job.get_status(refresh=False))
+        # 结果与异常信息需额外读取，只对已结束的任务读取
+        exc_info = job.exc_info if status == "failed" else None
+        statuses.append({
+            "status": status,
+            "result": job.result if status == "finished" else None,
+            "exc_info": str(exc_info) if exc_info else None,
+        })
+    return statuses
+
+
+def cancel_job(job_id: str, rq_job_id: str = "") -> str:
+    """
+    取消任务：排队中的 RQ 任务直接出队；运行中的由管线检查取消标记后自行退出并清理。
+    返回取消前的 RQ 状态（无 RQ 记录时为空字符串）。
+    """
+    request_cancel(job_id)
+    if not rq_job_id:
+        return ""
+    conn = get_connection()
+    job = Job.fetch(rq_job_id, connection=conn)
+    status = _status_name(job.get_status())
+    if status in ("queued", "deferred", "scheduled"):
+        job.cancel()
+    return status
@@ -0,0 +1,94 @@
+"""
+线程预算：一台机器上跑多个 worker 时，按核数给每个 worker 划分 CPU 集与线程数，
+避免 onnxruntime / OpenCV / ffmpeg 各自按全机核数开线程导致过度订阅。
+
+由 run_worker.py 的 supervisor 模式写入环境变量，子进程启动时在导入重依赖前调用 apply_thread_budget：
+- PIXELWORK_CPUS：本 worker 绑定的 CPU 列表，如 "0-3" 或 "0,2,4"
+- PIXELWORK_THREADS：本 worker 的线程预算
+未设置时保持各库默认行为。
+"""
+import os
+from typing import Optional
+
+# 这些库在导入时读取线程数；rembg 创建会话时用 OMP_NUM_THREADS 设置 onnxruntime 的 intra / inter-op 线程
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def available_cpus() -> list[int]:
+    """当前进程可用的 CPU（遵循 cgroup / taskset 限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def format_cpus(cpus: list[int]) -> str:
+    return ",".join(str(c) for c in cpus)
+
+
+def parse_cpus(spec: str) -> list[int]:
+    """解析 "0-3,6" 形式的 CPU 列表"""
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def plan_workers(processes: int, cpus: Optional[list[int]] = None) -> list[dict]:
+    """
+    将 CPU 均分给 processes 个 worker，返回每个的 {"cpus", "threads"}。
+    连续编号的核分在一起（通常同一物理核 / NUMA 节点）；进程数多于核数时轮流共享单核。
+    """
+    cpus = cpus or available_cpus()
+    processes = max(1, processes)
+    if processes >= len(cpus):
+        return [{"cpus": [cpus[i % len(cpus)]], "threads": 1} for i in range(processes)]
+    base, extra = divmod(len(cpus), processes)
+    plan, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        plan.append({"cpus": cpus[start:start + size], "threads": size})
+        start += size
+    return plan
+
+
+def thread_budget() -> Optional[int]:
+    """本进程的线程预算；未由 supervisor 指定时返回 None"""
+    value = os.getenv("PIXELWORK_THREADS")
+    return max(1, int(value)) if value else None
+
+
+def apply_thread_budget() -> Optional[int]:
+    """
+    绑定 CPU 集并设置各库线程数。须在导入 numpy / cv2 / onnxruntime 之前调用，
+    环境变量才会被这些库读取；cv2 已导入时直接调用 setNumThreads。
+    """
+    cpus = os.getenv("PIXELWORK_CPUS")
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, parse_cpus(cpus))
+        except (OSError, ValueError):
+            pass
+    budget = thread_budget()
+    if budget is None:
+        return None
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(budget)
+    try:
+        import cv2
+        cv2.setNumThreads(budget)
+    except ImportError:
+        pass
+    return budget
+
+
+def ffmpeg_threads() -> list[str]:
+    """ffmpeg / ffprobe 的 -threads 参数；无预算时为空，沿用 ffmpeg 自动选择"""
+    budget = thread_budget()
+    return ["-threads", str(budget)] if budget else []
@@ -5,7 +5,6 @@ Seedance 2.0 水印去除
 """
 import os
 import shutil
-import subprocess
 import tempfile
 from pathlib import Path
 from typing import Callable, Optional
@@ -13,6 +12,55 @@ from typing import Callable, Optional
 import cv2
 import numpy as np
 
+from .cancellation import JobCanceled, canceller, discard_job_files, run_cancellable
+from .checkpoint import load_manifest, save_manifest, source_fingerprint
+from .profiling import job_profile
+from .region_cache import cache_key, load_mask, store_mask
+from .threads import ffmpeg_threads
+
+INPAINT_RADIUS = 5
+# 蒙版外圈与缓存帧外圈的平均绝对差不超过该值时复用缓存的修复块（0 关闭复用）
+INPAINT_REUSE_TOL = float(os.getenv("INPAINT_REUSE_TOL", "1.5"))
+# 检测采样帧数；命中缓存的自动检测蒙版先用少量采样帧在当前视频上复核
+DETECT_SAMPLE_FRAMES = 60
+VERIFY_SAMPLE_FRAMES = 8
+# 复核时当前视频在缓存蒙版内重新检出笔画的比例下限
+VERIFY_MIN_OVERLAP = 0.6
+# 修复阶段每完成多少帧写一次检查点（序列帧管线按 POSTPROCESS_BATCH 记检查点）
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "8"))
+
+
+# 预设区域：按角落取检测窗口，窗口内仍用 Canny 构建文字蒙版
+WATERMARK_PRESETS = ("top_left", "top_right", "bottom_left", "bottom_right")
+
+
+def _corners(width: int, height: int) -> dict[str, tuple[int, int, int, int]]:
+    """四个角的检测窗口 (r1, c1, r2, c2)"""
+    corner_h = min(height, max(60, int(height * 0.08)))
+    corner_w = min(width, max(120, int(width * 0.12)))
+    return {
+        "top_left": (0, 0, corner_h, corner_w),
+        "top_right": (0, width - corner_w, corner_h, width),
+        "bottom_left": (height - corner_h, 0, height, corner_w),
+        "bottom_right": (height - corner_h, width - corner_w, height, width),
+    }
+
+
+def preset_region(preset: str, width: int, height: int) -> tuple[int, int, int, int]:
+    """预设名对应的区域 (x, y, w, h)"""
+    if preset not in WATERMARK_PRESETS:
+        raise ValueError(f"Unknown watermark preset: {preset}")
+    r1, c1, r2, c2 = _corners(width, height)[preset]
+    return c1, r1, c2 - c1, r2 - r1
+
+
+def _check_region(region: tuple[int, int, int, int], width: int, height: int) -> tuple[int, int, int, int]:
+    """手动区域须完整落在画面内（API 提交时已按探测尺寸校验），否则抛 ValueError"""
+    x, y, w, h = (int(v) for v in region)
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > width or y + h > height:
+        raise ValueError(f"Watermark region {region} is outside the {width}x{height} frame")
+    return x, y, w, h
+
 
 def _auto_detect(frames: list, mean_frame: np.ndarray, width: int, height: int) -> Optional[tuple[int, int, int, int]]:
     """
@@ -22,17 +70,8 @@ def _auto_detect(frames: list, mean_frame: np.ndarray, width: int, height: int)
     stack = np.stack(frames, axis=0)
     std_map = np.std(stack, axis=0).mean(axis=2)
 
-    corner_h = max(60, int(height * 0.08))
-    corner_w = max(120, int(width * 0.12))
-    corners = [
-        (0, 0, corner_h, corner_w),
-        (0, width - corner_w, corner_h, width),
-        (height - corner_h, 0, height, corner_w),
-        (height - corner_h, width - corner_w, height, width),
-    ]
-
     best, best_score = None, 0
-    for r1, c1, r2, c2 in corners:
+    for r1, c1, r2, c2 in _corners(width, height).values():
         roi_gray = cv2.cvtColor(mean_frame[r1:r2, c1:c2], cv2.COLOR_BGR2GRAY)
         edges = cv2.Canny(roi_gray, 20, 60)
         edge_density = edges.mean() / 255.0
@@ -54,11 +93,9 @@ def _auto_detect(frames: list, mean_frame: np.ndarray, width: int, height: int)
     return best
 
 
-def _build_mask(mean_frame_bgr: np.ndarray, region_xywh: tuple, frame_shape: tuple) -> np.ndarray:
-    """使用 Canny 边缘检测在平均帧上构建文本蒙版"""
-    x, y, w, h = region_xywh
-    H, W = frame_shape[:2]
-    roi_gray = cv2.cvtColor(mean_frame_bgr[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+def _text_strokes(roi_bgr: np.ndarray) -> np.ndarray:
+    """Canny 边缘膨胀后去掉小连通域，得到区域内的文字笔画蒙版（可能为空）"""
+    roi_gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
     edges = cv2.Canny(roi_gray, 30, 80)
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
     dilated = cv2.dilate(edges, kernel, iterations=1)
@@ -67,6 +104,14 @@ def _build_mask(mean_frame_bgr: np.ndarray, region_xywh: tuple, frame_shape: tup
     for i in range(1, n):
         if stats[i, cv2.CC_STAT_AREA] >= 100:
             clean[labels == i] = 255
+    return clean
+
+
+def _build_mask(mean_frame_bgr: np.ndarray, region_xywh: tuple, frame_shape: tuple) -> np.ndarray:
+    """使用 Canny 边缘检测在平均帧上构建文本蒙版"""
+    x, y, w, h = region_xywh
+    H, W = frame_shape[:2]
+    clean = _text_strokes(mean_frame_bgr[y:y + h, x:x + w])
     if clean.sum() == 0:
         clean = np.full((h, w), 255, dtype=np.uint8)
     mask = np.zeros((H, W), dtype=np.uint8)
@@ -74,15 +119,126 @@ def _build_mask(mean_frame_bgr: np.ndarray, region_xywh: tuple, frame_shape: tup
     return mask
 
 
+def _sample_frames(cap, total: int, count: int) -> list[np.ndarray]:
+    """全片均匀采样至多 count 帧（float32）"""
+    frames = []
+    step = max(1, total // count)
+    for i in range(0, total, step):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+        ret, f = cap.read()
+        if ret:
+            frames.append(f.astype(np.float32))
+        if len(frames) >= count:
+            break
+    return frames
+
+
+def _mean_frame(frames: list[np.ndarray]) -> np.ndarray:
+    return np.mean(np.stack(frames), axis=0).astype(np.uint8)
+
+
+def _mask_matches(cap, total: int, mask: np.ndarray) -> bool:
+    """
+    缓存的蒙版是否适用于当前视频：少量采样帧的平均帧在蒙版外接框内重新提取笔画，
+    覆盖缓存蒙版的比例不低于 VERIFY_MIN_OVERLAP。同分辨率但水印位置不同或没有水印的视频会被拒绝；
+    手动 / 预设区域的笔画同样取自首个视频的平均帧，命中后一并复核。
+    """
+    frames = _sample_frames(cap, total, VERIFY_SAMPLE_FRAMES)
+    if not frames:
+        return False
+    ys, xs = np.nonzero(mask)
+    y1, y2, x1, x2 = int(ys.min()), int(ys.max()) + 1, int(xs.min()), int(xs.max()) + 1
+    strokes = _text_strokes(_mean_frame(frames)[y1:y2, x1:x2])
+    hole = mask[y1:y2, x1:x2] > 0
+    return float((strokes[hole] > 0).mean()) >= VERIFY_MIN_OVERLAP
+
+
+def _detect_mask(
+    cap,
+    total: int,
+    width: int,
+    height: int,
+    manual_region: Optional[tuple[int, int, int, int]]
+) -> Optional[np.ndarray]:
+    """采样帧求平均，定位（或使用手动）水印区域并构建蒙版；失败返回 None"""
+    sample_frames = _sample_frames(cap, total, DETECT_SAMPLE_FRAMES)
+    if not sample_frames:
+        return None
+
+    mean_frame = _mean_frame(sample_frames)
+
+    # 检测 / 手动区域
+    if manual_region:
+        x, y, w, h = manual_region
+    else:
+        region = _auto_detect(sample_frames, mean_frame, width, height)
+        if region is None:
+            return None
+        x, y, w, h = region
+
+    return _build_mask(mean_frame, (x, y, w, h), (height, width))
+
+
+class _PatchCache:
+    """
+    增量修复：TELEA 只用到蒙版外 INPAINT_RADIUS 以内的像素，
+    因此只在蒙版外接框（外扩一圈）上修复，并比较这一圈像素与缓存帧是否一致，
+    一致时直接复用缓存的修复块（静态机位、口播类视频大部分帧命中）。
+    """
+
+    def __init__(self, mask: np.ndarray, tol: float = INPAINT_REUSE_TOL):
+        H, W = mask.shape
+        ys, xs = np.nonzero(mask)
+        margin = INPAINT_RADIUS + 2
+        self.y1, self.y2 = max(0, int(ys.min()) - margin), min(H, int(ys.max()) + 1 + margin)
+        self.x1, self.x2 = max(0, int(xs.min()) - margin), min(W, int(xs.max()) + 1 + margin)
+        self.mask = mask[self.y1:self.y2, self.x1:self.x2]
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * margin + 1, 2 * margin + 1))
+        self.ring = (cv2.dilate(self.mask, kernel) > 0) & (self.mask == 0)
+        self.hole = self.mask > 0
+        self.tol = tol
+        self.ring_px: Optional[np.ndarray] = None
+        self.patch: Optional[np.ndarray] = None
+        self.reused = 0
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """就地修复 frame 的水印区域并返回"""
+        roi = frame[self.y1:self.y2, self.x1:self.x2]
+        ring_px = roi[self.ring].astype(np.int16)
+        if (self.patch is not None and self.tol > 0
+                and np.abs(ring_px - self.ring_px).mean() <= self.tol):
+            roi[self.hole] = self.patch
+            self.reused += 1
+            return frame
+        fixed = cv2.inpaint(roi, self.mask, inpaintRadius=INPAINT_RADIUS, flags=cv2.INPAINT_TELEA)
+        roi[self.hole] = fixed[self.hole]
+        # 始终与计算修复块的那一帧比较，缓慢漂移不会累积
+        self.ring_px = ring_px
+        self.patch = fixed[self.hole]
+        return frame
+
+
 def remove_watermark(
     input_path: str,
     output_path: str,
     manual_region: Optional[tuple[int, int, int, int]] = None,
     on_progress: Optional[Callable[[int, int], None]] = None,
+    check_cancel: Optional[Callable[[], None]] = None,
+    work_dir: Optional[str] = None,
+    stats: Optional[dict] = None,
+    preset: Optional[str] = None,
 ) -> bool:
     """
     去除视频水印。返回是否成功。
     on_progress: (current, total) -> None，可选进度回调。
+    check_cancel: 帧间调用，任务被取消时抛出 JobCanceled。
+    work_dir: 修复帧与检查点目录；给定时可在重试后从已修复的帧续跑，成功后清理。
+              未给定时使用一次性临时目录。
+    stats: 可选，写入修复帧数 frames、复用缓存修复块的帧数 reused 与蒙版来源 detection
+           （cache / auto / manual / preset）。
+    preset: 预设角落（见 WATERMARK_PRESETS），manual_region 优先。
+    蒙版按 (分辨率, 自动 / 预设 / 手动区域) 缓存，任务成功后写入，命中时跳过完整采样与检测；
+    蒙版的笔画取自具体视频，命中后先用少量采样帧复核，不匹配时重新检测。
     """
     cap = cv2.VideoCapture(input_path)
     total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -90,48 +246,72 @@ def remove_watermark(
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-    # 采样帧 → 平均帧
-    sample_frames = []
-    step = max(1, total // 60)
-    for i in range(0, total, step):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-        ret, f = cap.read()
-        if ret:
-            sample_frames.append(f.astype(np.float32))
-        if len(sample_frames) >= 60:
-            break
+    resumable = work_dir is not None
+    frames_dir = work_dir or tempfile.mkdtemp(prefix="seedance_wm_")
+    work = Path(frames_dir)
+    work.mkdir(parents=True, exist_ok=True)
+    mask_path = work / "mask.png"
+    fp = source_fingerprint(Path(input_path), manual_region, preset)
+    manifest = load_manifest(work, fp) if resumable else {}
+    done = manifest.get("done", 0) if mask_path.exists() else 0
 
-    if not sample_frames:
+    try:
+        if manual_region:
+            region, profile = _check_region(manual_region, width, height), "manual"
+        elif preset:
+            region, profile = preset_region(preset, width, height), "preset"
+        else:
+            region, profile = None, "auto"
+    except ValueError:
         cap.release()
-        return False
-
-    mean_frame = np.mean(np.stack(sample_frames), axis=0).astype(np.uint8)
+        if not resumable:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+        raise
+    key = cache_key(width, height, ",".join(map(str, region)) if region else "auto")
 
-    # 检测 / 手动区域
-    if manual_region:
-        x, y, w, h = manual_region
+    if done:
+        # 续跑：沿用已确认的蒙版，跳过采样与检测
+        mask = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE)
+        detection = manifest.get("detection", profile)
     else:
-        region = _auto_detect(sample_frames, mean_frame, width, height)
-        if region is None:
+        mask = load_mask(key)
+        detection = "cache"
+        if mask is not None and mask.shape == (height, width) and not _mask_matches(cap, total, mask):
+            mask = None
+        if mask is None or mask.shape != (height, width):
+            mask = _detect_mask(cap, total, width, height, region)
+            detection = profile
+        if mask is None:
             cap.release()
+            if not resumable:
+                shutil.rmtree(frames_dir, ignore_errors=True)
             return False
-        x, y, w, h = region
-
-    mask = _build_mask(mean_frame, (x, y, w, h), (height, width))
+        if resumable:
+            cv2.imwrite(str(mask_path), mask)
+            save_manifest(work, fp, {"done": 0, "detection": detection})
 
-    # 逐帧修复
-    frames_dir = tempfile.mkdtemp(prefix="seedance_wm_")
+    # 逐帧修复（外圈不变时复用上一次的修复块）
+    success = False
+    patches = _PatchCache(mask)
+    patches.reused = manifest.get("reused", 0) if done else 0
+    frames = done
     try:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        for i in range(total):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, done)
+        for i in range(done, total):
+            if check_cancel and i % 10 == 0:
+                check_cancel()
             ret, frame = cap.read()
             if not ret:
                 break
-            result = cv2.inpaint(frame, mask, inpaintRadius=5, flags=cv2.INPAINT_TELEA)
-            cv2.imwrite(os.path.join(frames_dir, f"{i:06d}.png"), result)
-            if on_progress and (i + 1) % 10 == 0:
-                on_progress(i + 1, total)
+            cv2.imwrite(os.path.join(frames_dir, f"{i:06d}.png"), patches.apply(frame))
+            frames = i + 1
+            if resumable and frames % CHECKPOINT_EVERY == 0:
+                save_manifest(work, fp, {"done": frames, "reused": patches.reused, "detection": detection})
+            if on_progress and frames % 10 == 0:
+                on_progress(frames, total)
         cap.release()
+        if stats is not None:
+            stats.update(frames=frames, reused=patches.reused, detection=detection)
 
         # ffmpeg 重组
         cmd = [
@@ -142,6 +322,7 @@ def remove_watermark(
             "-map", "0:v",
             "-map", "1:a?",
             "-c:v", "libx264",
+            *ffmpeg_threads(),
             "-crf", "18",
             "-preset", "fast",
             "-pix_fmt", "yuv420p",
@@ -149,17 +330,34 @@ def remove_watermark(
             "-movflags", "+faststart",
             output_path,
         ]
-        ret_code = subprocess.run(cmd, capture_output=True).returncode
+        ret_code = run_cancellable(cmd, check_cancel).returncode
+        success = ret_code == 0
+        if success:
+            store_mask(key, mask)
     finally:
-        shutil.rmtree(frames_dir, ignore_errors=True)
+        cap.release()
+        # 可续跑模式下失败时保留修复帧，供重试使用
+        if success or not resumable:
+            shutil.rmtree(frames_dir, ignore_errors=True)
 
-    return ret_code == 0
+    return success
 
 
-def run_watermark_pipeline(job_id: str, video_path: str, output_base: str) -> dict:
+def run_watermark_pipeline(
+    job_id: str,
+    video_path: str,
+    output_base: str,
+    temp_base: Optional[str] = None,
+    region: Optional[dict] = None,
+    preset: Optional[str] = None,
+    profile: bool = False
+) -> dict:
     """
     水印去除管线入口，供 RQ worker 调用。
     输出: output_base/job_id/clean.mp4
+    给定 temp_base 时修复帧写入 temp_base/job_id，RQ 重试时从检查点续跑。
+    region: 手动区域 {"x", "y", "w", "h"}；preset: 预设角落。均未给定时自动检测。
+    profile: 在 cProfile 下运行，剖析结果写入输出目录。
     """
     vpath = Path(video_path)
     if not vpath.exists():
@@ -168,8 +366,33 @@ def run_watermark_pipeline(job_id: str, video_path: str, output_base: str) -> di
     out_dir = Path(output_base) / job_id
     out_dir.mkdir(parents=True, exist_ok=True)
     output_file = out_dir / "clean.mp4"
+    work_dir = Path(temp_base) / job_id if temp_base else None
 
-    ok = remove_watermark(str(vpath), str(output_file))
+    stats: dict = {}
+    try:
+        with job_profile(out_dir, profile):
+            ok = remove_watermark(
+                str(vpath), str(output_file),
+                manual_region=(region["x"], region["y"], region["w"], region["h"]) if region else None,
+                check_cancel=canceller(job_id),
+                work_dir=str(work_dir) if work_dir else None,
+                stats=stats,
+                preset=preset,
+            )
+    except JobCanceled:
+        discard_job_files(job_id, out_dir, work_dir, vpath.parent)
+        raise
     if not ok:
         raise RuntimeError("Watermark removal failed")
-    return {"output": str(output_file)}
+    discard_job_files(job_id, vpath.parent)  # 成功后删除上传的源视频
+    frames = stats.get("frames", 0)
+    reused = stats.get("reused", 0)
+    return {
+        "output": str(output_file),
+        "detection": stats.get("detection"),
+        "inpaint_reuse": {
+            "frames": frames,
+            "reused": reused,
+            "hit_rate": round(reused / frames, 3) if frames else 0.0,
+        },
+    }